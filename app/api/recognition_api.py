@@ -1,23 +1,62 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, g
+from contextlib import contextmanager
 import cv2
 import numpy as np
 import base64
+import time
 from app.services.face_recognizer import FaceRecognizer
+from app.services.training_jobs import get_training_queue
+from app.services.subsystems import get_subsystems
+from app.services.evaluation import get_evaluation_runner
 import app.services.models as models
 from app import config
+from app.utils.metrics import REQUEST_SECONDS
+from app.utils.profiler import profiled
 
 
 recognition_bp = Blueprint('recognition', __name__)
 
 recognizer = None
 
+@recognition_bp.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.server_timing = []
+
+@recognition_bp.after_request
+def add_server_timing(response):
+    """Заголовок Server-Timing и гистограмма времени запроса"""
+    total = time.perf_counter() - g.request_started
+    REQUEST_SECONDS.observe(total, request.endpoint or "unknown")
+    entries = [f"{name};dur={duration * 1000:.2f}" for name, duration in g.server_timing]
+    entries.append(f"total;dur={total * 1000:.2f}")
+    response.headers["Server-Timing"] = ", ".join(entries)
+    return response
+
+@contextmanager
+def timing(name):
+    """Замер этапа запроса для заголовка Server-Timing"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        g.server_timing.append((name, time.perf_counter() - started))
+
 def init_recognizer():
-    """Инициализация распознавателя"""
+    """
+    Инициализация распознавателя при первом обращении: каскады и модель
+    загружает реестр подсистем (при запуске в фоне), запрос ждёт их не дольше
+    SUBSYSTEM_WAIT_TIMEOUT
+    """
     global recognizer
+    if recognizer is not None:
+        return True
     try:
+        if not get_subsystems().ensure("cascades", "model", timeout=config.SUBSYSTEM_WAIT_TIMEOUT):
+            print("Каскады или модель ещё не загружены")
+            return False
         recognizer = FaceRecognizer()
-        # Попытка загрузить существующую модель
-        if not models.load_model:
+        if config.model_snapshot is None:
             print("Модель не найдена. Требуется обучение.")
         return True
     except Exception as e:
@@ -26,26 +65,14 @@ def init_recognizer():
 
 @recognition_bp.route('/api/train_model', methods=['POST'])
 def train_model():
-    """API для обучения модели"""
-    global recognizer
-    
+    """API для обучения модели: задание ставится в фоновую очередь"""
     try:
-        if recognizer is None:
-            init_recognizer()
-        
-        success = models.train_model()
-        
-        if success:
-            return jsonify({
-                'success': True,
-                'message': 'Модель успешно обучена',
-                'model_info': recognizer.get_model_info()
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'message': 'Ошибка обучения модели'
-            })
+        job = get_training_queue().submit("train")
+        return jsonify({
+            'success': True,
+            'message': 'Обучение модели поставлено в очередь',
+            'job': job.to_dict()
+        })
     
     except Exception as e:
         return jsonify({
@@ -53,6 +80,30 @@ def train_model():
             'message': f'Ошибка: {str(e)}'
         })
 
+@recognition_bp.route('/api/train_jobs', methods=['GET'])
+def list_train_jobs():
+    """Последние задания обучения, текущее и ожидающее"""
+    queue = get_training_queue()
+    return jsonify({
+        'success': True,
+        'jobs': [job.to_dict() for job in queue.jobs()],
+        **queue.status()
+    })
+
+@recognition_bp.route('/api/train_jobs/<job_id>', methods=['GET'])
+def get_train_job(job_id):
+    """Состояние и прогресс задания обучения"""
+    job = get_training_queue().get(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'message': 'Задание не найдено'
+        }), 404
+    return jsonify({
+        'success': True,
+        'job': job.to_dict()
+    })
+
 @recognition_bp.route('/api/model_info', methods=['GET'])
 def get_model_info():
     """Получить информацию о модели"""
@@ -67,11 +118,17 @@ def get_model_info():
         return jsonify({'error': 'Распознаватель не инициализирован'})
 
 @recognition_bp.route('/api/recognize_image', methods=['POST'])
+@profiled("requests")
 def recognize_image():
     """Распознавание лиц на загруженном изображении"""
     global recognizer
     
-    if recognizer is None or recognizer.model is None:
+    if not init_recognizer():
+        return jsonify({
+            'success': False,
+            'message': 'Система ещё загружается'
+        }), 503
+    if config.model_snapshot is None:
         return jsonify({
             'success': False,
             'message': 'Модель не обучена'
@@ -88,9 +145,10 @@ def recognize_image():
         file = request.files['image']
         
         # Читаем изображение
-        image_bytes = file.read()
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        with timing("decode"):
+            image_bytes = file.read()
+            nparr = np.frombuffer(image_bytes, np.uint8)
+            image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
         
         if image is None:
             return jsonify({
@@ -99,11 +157,13 @@ def recognize_image():
             })
         
         # Распознаем лица
-        processed_image, results = recognizer.recognize_faces_in_frame(image)
+        with timing("recognize"):
+            processed_image, results = recognizer.recognize_faces_in_frame(image)
         
         # Кодируем обработанное изображение обратно в base64
-        _, buffer = cv2.imencode('.jpg', processed_image)
-        processed_image_b64 = base64.b64encode(buffer).decode('utf-8')
+        with timing("encode"):
+            _, buffer = cv2.imencode('.jpg', processed_image)
+            processed_image_b64 = base64.b64encode(buffer).decode('utf-8')
         
         return jsonify({
             'success': True,
@@ -119,11 +179,17 @@ def recognize_image():
         })
 
 @recognition_bp.route('/api/recognize_base64', methods=['POST'])
+@profiled("requests")
 def recognize_base64():
     """Распознавание лиц в изображении, переданном как base64"""
     global recognizer
     
-    if recognizer is None or recognizer.model is None:
+    if not init_recognizer():
+        return jsonify({
+            'success': False,
+            'message': 'Система ещё загружается'
+        }), 503
+    if config.model_snapshot is None:
         return jsonify({
             'success': False,
             'message': 'Модель не обучена'
@@ -140,9 +206,10 @@ def recognize_base64():
             })
         
         # Декодируем base64
-        image_data = base64.b64decode(image_b64)
-        nparr = np.frombuffer(image_data, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        with timing("decode"):
+            image_data = base64.b64decode(image_b64)
+            nparr = np.frombuffer(image_data, np.uint8)
+            image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
         
         if image is None:
             return jsonify({
@@ -151,11 +218,13 @@ def recognize_base64():
             })
         
         # Распознаем лица
-        processed_image, results = recognizer.recognize_faces_in_frame(image)
+        with timing("recognize"):
+            processed_image, results = recognizer.recognize_faces_in_frame(image)
         
         # Кодируем обработанное изображение обратно в base64
-        _, buffer = cv2.imencode('.jpg', processed_image)
-        processed_image_b64 = base64.b64encode(buffer).decode('utf-8')
+        with timing("encode"):
+            _, buffer = cv2.imencode('.jpg', processed_image)
+            processed_image_b64 = base64.b64encode(buffer).decode('utf-8')
         
         return jsonify({
             'success': True,
@@ -175,6 +244,9 @@ def update_threshold():
     try:
         data = request.get_json()
         config.CONFIDENCE_THRESHOLD = int(data["threshold"])
+        models.refresh_thresholds()
+        if config.camera_manager is not None:
+            config.camera_manager.sync_settings()
         return jsonify({
             'status': 'success',
             'CONFIDENCE_THRESHOLD': config.CONFIDENCE_THRESHOLD
@@ -192,6 +264,9 @@ def update_unknown_threshold():
     try:
         data = request.get_json()
         config.UNKNOWN_THRESHOLD = int(data["value"])
+        models.refresh_thresholds()
+        if config.camera_manager is not None:
+            config.camera_manager.sync_settings()
         return jsonify({
             "status": "success", 
             "UNKNOWN_THRESHOLD": config.UNKNOWN_THRESHOLD})
@@ -200,38 +275,64 @@ def update_unknown_threshold():
     
 
 
-@recognition_bp.route('/api/test_accuracy', methods=['POST'])
-def test_accuracy():
-    """Тестирование точности модели"""
-    global recognizer
-    
-    if config.model is None:
+@recognition_bp.route('/api/model/rollback', methods=['POST'])
+def rollback_model():
+    """Вернуть предыдущий снимок модели (файл на диске не меняется)"""
+    if not models.rollback():
         return jsonify({
             'success': False,
-            'message': 'Модель не обучена'
+            'message': 'Нет предыдущей модели для отката'
         })
-    
+    if config.camera_manager is not None:
+        config.camera_manager.rollback_models()
+    return jsonify({
+        'success': True,
+        'message': 'Модель возвращена к предыдущей версии',
+        'current': models.snapshot_info(config.model_snapshot),
+        'previous': models.snapshot_info(config.previous_snapshot)
+    })
+
+
+@recognition_bp.route('/api/test_accuracy', methods=['POST'])
+def test_accuracy():
+    """
+    Оценка точности в фоне: k-fold (folds) или отложенная доля (holdout) по
+    кропам каждого человека; результат - /api/test_accuracy/<id>
+    """
     try:
-        data = request.get_json() or {}
-        test_images_per_person = data.get('test_images_per_person', 5)
-        
-        results = recognizer.test_recognition_accuracy(test_images_per_person)
-        
-        if results:
-            return jsonify({
-                'success': True,
-                'results': results
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'message': 'Не удалось провести тестирование'
-            })
-    
-    except Exception as e:
+        data = request.get_json(silent=True) or {}
+        params = {}
+        if data.get('folds') is not None:
+            params['folds'] = int(data['folds'])
+        if data.get('holdout') is not None:
+            params['holdout'] = float(data['holdout'])
+        if data.get('workers') is not None:
+            params['workers'] = int(data['workers'])
+        if params.get('folds', 2) < 2 or ('holdout' in params and not 0 < params['holdout'] < 1):
+            raise ValueError("folds >= 2, 0 < holdout < 1")
+    except (TypeError, ValueError) as e:
         return jsonify({
             'success': False,
-            'message': f'Ошибка тестирования: {str(e)}'
+            'message': f'Неверные параметры: {str(e)}'
         })
 
-init_recognizer()
\ No newline at end of file
+    job = get_evaluation_runner().submit(**params)
+    return jsonify({
+        'success': True,
+        'message': 'Оценка точности запущена',
+        'job': job.to_dict()
+    })
+
+@recognition_bp.route('/api/test_accuracy/<job_id>', methods=['GET'])
+def get_test_accuracy_job(job_id):
+    """Состояние и результат оценки точности"""
+    job = get_evaluation_runner().get(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'message': 'Задание не найдено'
+        }), 404
+    return jsonify({
+        'success': True,
+        'job': job.to_dict()
+    })
@@ -1,11 +1,17 @@
-from flask import Blueprint, request, jsonify
-import os, cv2, shutil
+from flask import Blueprint, request, jsonify, Response
+import os, shutil
 from datetime import datetime
 
 from app import config
 from app.utils.transliterate import sanitize_filename, get_original_name
-from app.services.models import train_model
+from app.services.models import model_file, snapshot_info
+from app.services.training_jobs import get_training_queue
 from app.services.init_system import init_camera
+from app.services.dataset_writer import get_dataset_writer
+from app.services.dataset_manifest import get_dataset_manifest
+from app.services.subsystems import get_subsystems
+from app.services.camera_manager import get_camera_manager
+from app.utils import metrics, profiler
 
 system_api = Blueprint("system_api", __name__)
 
@@ -13,6 +19,8 @@ system_api = Blueprint("system_api", __name__)
 def toggle_eye_requirement():
     data = request.json
     config.require_eyes_for_face = bool(data.get("enabled", False))
+    if config.camera_manager is not None:
+        config.camera_manager.sync_settings()
     return jsonify({"success": True, "require_eyes_for_face": config.require_eyes_for_face})
 
 @system_api.route("/api/update_cascade_params", methods=["POST"])
@@ -21,12 +29,29 @@ def update_cascade_params():
         data = request.json
         config.cascade_params["scaleFactor"] = float(data.get("scaleFactor", 1.1))
         config.cascade_params["minNeighbors"] = int(data.get("minNeighbors", 5))
-        config.cascade_params["minSize"] = (int(data.get("minSize", 30)), int(data.get("minSize", 30)))
+        config.cascade_params["minSize"] = (int(data.get("minSize", 40)), int(data.get("minSize", 40)))
         config.cascade_params["maxSize"] = (int(data.get("maxSize", 500)), int(data.get("maxSize", 500)))
+        config.cascade_params["detectionScale"] = min(max(float(data.get("detectionScale", 0.5)), 0.1), 1.0)
+        if config.camera_manager is not None:
+            config.camera_manager.sync_settings()
         return jsonify(success=True)
     except Exception as e:
         return jsonify(success=False, message=str(e))
 
+@system_api.route("/api/update_tracking_params", methods=["POST"])
+def update_tracking_params():
+    try:
+        data = request.json
+        config.tracking_params["enabled"] = bool(data.get("enabled", config.tracking_params["enabled"]))
+        config.tracking_params["detect_interval"] = max(1, int(data.get("detect_interval", config.tracking_params["detect_interval"])))
+        config.tracking_params["max_missed"] = max(0, int(data.get("max_missed", config.tracking_params["max_missed"])))
+        config.tracking_params["iou_threshold"] = float(data.get("iou_threshold", config.tracking_params["iou_threshold"]))
+        if config.camera_manager is not None:
+            config.camera_manager.sync_settings()
+        return jsonify(success=True, tracking_params=config.tracking_params)
+    except Exception as e:
+        return jsonify(success=False, message=str(e))
+
 @system_api.route("/api/update_camera", methods=["POST"])
 def update_camera():
     try:
@@ -37,11 +62,48 @@ def update_camera():
             "height": int(data.get("height", 480)),
             "fps": int(data.get("fps", 30)),
         })
-        init_camera()
+        if config.capture_worker is not None and config.capture_worker.is_alive():
+            # Камерой владеет поток захвата, он сам переоткроет устройство
+            config.capture_worker.request_reopen()
+        else:
+            init_camera()
         return jsonify(success=True)
     except Exception as e:
         return jsonify(success=False, message=str(e))
 
+@system_api.route("/api/cameras", methods=["GET"])
+def list_cameras():
+    """Именованные камеры и статистика их процессов"""
+    return jsonify(get_camera_manager().status())
+
+@system_api.route("/api/cameras", methods=["POST"])
+def add_camera():
+    """Добавить камеру без перезапуска остальных"""
+    try:
+        data = request.json
+        camera_id = str(data["id"]).strip()
+        source = data["source"]
+        if isinstance(source, str) and source.isdigit():
+            source = int(source)
+        spec = {
+            "source": source,
+            "width": int(data.get("width", 640)),
+            "height": int(data.get("height", 480)),
+            "fps": int(data.get("fps", 30)),
+            "loop": bool(data.get("loop", True)),
+        }
+        get_camera_manager().add(camera_id, spec)
+        return jsonify(success=True, camera_id=camera_id)
+    except Exception as e:
+        return jsonify(success=False, message=str(e))
+
+@system_api.route("/api/cameras/<camera_id>", methods=["DELETE"])
+def remove_camera(camera_id):
+    """Остановить процесс камеры, остальные продолжают работу"""
+    if get_camera_manager().remove(camera_id):
+        return jsonify(success=True)
+    return jsonify(success=False, message="Камера не найдена")
+
 @system_api.route("/start_collection", methods=["POST"])
 def start_collection():
     """Начать сбор данных"""
@@ -54,8 +116,11 @@ def start_collection():
     sanitized = sanitize_filename(person_name)
     person_path = os.path.join(config.DATASET_DIR, sanitized)
     os.makedirs(person_path, exist_ok=True)
+    get_dataset_manifest().scan_person(sanitized)
 
     config.original_names[sanitized] = person_name
+    # Каталог определяется один раз, дальше кропы пишет фоновый поток
+    get_dataset_writer().begin(person_path)
     config.is_collecting_data, config.current_person_name, config.collected_count = True, person_name, 0
 
     return jsonify({"success": True, "message": f"Начат сбор данных для {person_name}"})
@@ -67,48 +132,68 @@ def stop_collection():
 
 @system_api.route("/train_model", methods=["POST"])
 def train_model_endpoint():
-    success = train_model()
+    """Обучение в фоне: ответ сразу, прогресс - /api/train_jobs/<id>"""
+    job = get_training_queue().submit("train")
     return jsonify({
-        "success": success,
-        "message": "Модель успешно обучена и сохранена" if success else "Ошибка обучения модели"
+        "success": True,
+        "message": "Обучение модели поставлено в очередь",
+        "job": job.to_dict()
+    })
+
+@system_api.route("/enroll_person", methods=["POST"])
+def enroll_person_endpoint():
+    """Добавить в модель одного человека (по умолчанию - последнего собранного) без полного переобучения"""
+    data = request.get_json(silent=True) or {}
+    person_name = data.get("name", "").strip() or config.current_person_name
+    if not person_name:
+        return jsonify({"success": False, "message": "Имя не может быть пустым"})
+
+    directory_name = next((s for s, o in config.original_names.items() if o == person_name), sanitize_filename(person_name))
+    if not os.path.isdir(os.path.join(config.DATASET_DIR, directory_name)):
+        return jsonify({"success": False, "message": "Человек не найден в базе"})
+    job = get_training_queue().submit("enroll", directory_name)
+    return jsonify({
+        "success": True,
+        "message": f"Добавление {person_name} в модель поставлено в очередь",
+        "job": job.to_dict()
     })
 
 @system_api.route("/get_status")
 def get_status():
     """Получить статус"""
     try:
-        camera_ready = False
-        if config.camera is not None:
-            try:
-                current_pos = config.camera.get(cv2.CAP_PROP_POS_FRAMES)
-                ret, _ = config.camera.read()
-                camera_ready = ret
-                if current_pos >= 0:
-                    config.camera.set(cv2.CAP_PROP_POS_FRAMES, current_pos)
-            except Exception:
-                camera_ready = False
-
-        total_data_count = sum(
-            len([f for f in os.listdir(os.path.join(config.DATASET_DIR, d))
-                 if f.endswith((".jpg", ".jpeg", ".png", ".bmp"))])
-            for d in os.listdir(config.DATASET_DIR) if os.path.isdir(os.path.join(config.DATASET_DIR, d))
-        ) if os.path.exists(config.DATASET_DIR) else 0
-
-        model_exists = os.path.exists(config.MODEL_FILE)
+        camera_status = config.capture_worker.status() if config.capture_worker else {}
+        camera_ready = camera_status.get("camera_ready", False)
+
+        # Из сводки набора данных, без обхода каталогов
+        total_data_count = get_dataset_manifest().total_images()
+
+        writer_status = config.dataset_writer.status() if config.dataset_writer else {}
+
+        model_exists = os.path.exists(model_file())
         return jsonify({
             "is_collecting": config.is_collecting_data,
-            "collected_count": config.collected_count,
+            "collected_count": writer_status.get("saved", 0),
+            "queued_count": writer_status.get("pending", 0),
+            "failed_count": writer_status.get("failed", 0),
             "total_data_count": total_data_count,
             "current_person": config.current_person_name,
             "model_trained": config.model is not None,
             "model_exists": model_exists,
+            "model": snapshot_info(config.model_snapshot),
+            "training": config.training_queue.status() if config.training_queue else None,
+            "previous_model": snapshot_info(config.previous_snapshot),
             "people_count": len(config.names),
             "people_names": list(config.names.values()),
             "camera_ready": camera_ready,
+            "camera_fps": camera_status.get("processing_fps", 0),
+            "stream_clients": camera_status.get("subscribers", 0),
             "face_cascade_loaded": config.face_cascade is not None,
             "eye_cascade_loaded": config.eye_cascade is not None,
             "timestamp": datetime.now().isoformat(),
             "require_eyes_for_face": config.require_eyes_for_face,
+            "serial": config.actuator.status() if config.actuator else None,
+            "subsystems": get_subsystems().status(),
         })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -116,16 +201,14 @@ def get_status():
 @system_api.route("/get_people_list")
 def get_people_list():
     people = []
-    if os.path.exists(config.DATASET_DIR):
-        for subdir in os.listdir(config.DATASET_DIR):
-            subpath = os.path.join(config.DATASET_DIR, subdir)
-            if os.path.isdir(subpath):
-                count = len([f for f in os.listdir(subpath) if f.lower().endswith((".png", ".jpg", ".jpeg"))])
-                people.append({
-                    "name": get_original_name(subdir),
-                    "directory": subdir,
-                    "image_count": count
-                })
+    for subdir, entry in sorted(get_dataset_manifest().people().items()):
+        people.append({
+            "name": get_original_name(subdir),
+            "directory": subdir,
+            "image_count": entry["count"],
+            "total_bytes": entry["bytes"],
+            "last_modified": datetime.fromtimestamp(entry["newest_mtime"] / 1e9).isoformat() if entry["count"] else None
+        })
     return jsonify(people)
 
 @system_api.route("/delete_person", methods=["POST"])
@@ -141,26 +224,78 @@ def delete_person():
     if os.path.exists(person_path):
         try:
             shutil.rmtree(person_path)
+            get_dataset_manifest().remove_person(directory_name)
             config.original_names.pop(directory_name, None)
-            if train_model():
-                return jsonify({"success": True, "message": f"Удалено {person_name}, модель переобучена"})
-            return jsonify({"success": True, "message": f"Удалено {person_name}, модель не переобучена"})
+            # Из модели убираются только образцы этого человека (в фоне, несколько удалений - одно задание)
+            job = get_training_queue().submit("remove", directory_name)
+            return jsonify({"success": True, "message": f"Удалено {person_name}, модель обновляется", "job": job.to_dict()})
         except Exception as e:
             return jsonify({"success": False, "message": f"Ошибка удаления: {str(e)}"})
     return jsonify({"success": False, "message": "Человек не найден в базе"})
 
+@system_api.route("/get_faces")
+def get_faces():
+    """Лица на последнем обработанном кадре видео потока с идентификаторами треков"""
+    camera_id = request.args.get("camera")
+    worker = get_camera_manager().get(camera_id) if camera_id else config.capture_worker
+    if worker is None:
+        return jsonify({"timestamp": None, "faces": []})
+    return jsonify({"timestamp": worker.latest_results_time, "faces": worker.latest_results})
+
 @system_api.route('/get_stats') 
 def get_stats(): 
     """Получить статистику распознавания""" 
-    return jsonify(config.recognition_stats) 
+    return jsonify(metrics.stats_snapshot()) 
 
 @system_api.route('/reset_stats', methods=['POST']) 
 def reset_stats():
      """Сбросить статистику""" 
-     config.recognition_stats = {
-          'total_faces_detected': 0, 
-          'known_faces': 0, 
-          'unknown_faces': 0, 
-          'last_recognized': None 
-          } 
-     return jsonify({'success': True, 'message': 'Статистика сброшена'})
\ No newline at end of file
+     metrics.reset_stats()
+     return jsonify({'success': True, 'message': 'Статистика сброшена'})
+
+@system_api.route('/metrics')
+def metrics_endpoint():
+    """Метрики в текстовом формате Prometheus, включая процессы именованных камер"""
+    remote = {camera_id: handle.stats["metrics"]
+              for camera_id, handle in list(get_camera_manager().cameras.items())
+              if "metrics" in handle.stats}
+    return Response(metrics.render_all(remote), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+@system_api.route('/healthz')
+def healthz():
+    """Процесс жив и отвечает; состояние подсистем - для справки"""
+    return jsonify({"status": "ok", "subsystems": get_subsystems().status()})
+
+@system_api.route('/readyz')
+def readyz():
+    """Готовность принимать запросы распознавания: 503, пока не загружены каскады и модель"""
+    registry = get_subsystems()
+    ready = registry.ready()
+    return jsonify({
+        "ready": ready,
+        "model_trained": config.model_snapshot is not None,
+        "subsystems": registry.status(),
+    }), 200 if ready else 503
+
+@system_api.route('/api/admin/profile', methods=['POST'])
+def start_profile():
+    """
+    Включить профилирование следующих N кадров видео потока (target=frames)
+    или N запросов распознавания (target=requests). Выключается само
+    """
+    data = request.json or {}
+    target = data.get("target", "frames")
+    try:
+        started = profiler.start(target, data.get("count", 100), bool(data.get("tracemalloc", False)))
+    except (TypeError, ValueError) as e:
+        return jsonify({"success": False, "message": f"Неверные параметры: {str(e)}"})
+    if not started:
+        return jsonify({"success": False, "message": "Профилирование уже выполняется", **profiler.status()})
+    return jsonify({"success": True, "message": f"Профилирование {target} включено", **profiler.status()})
+
+@system_api.route('/api/admin/profile')
+def get_profile():
+    """Состояние профилировщика и последний отчёт (?format=text - только отчёт)"""
+    if request.args.get("format") == "text":
+        return Response(profiler.last_report or "", mimetype="text/plain; charset=utf-8")
+    return jsonify({**profiler.status(), "report": profiler.last_report})
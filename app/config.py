@@ -1,16 +1,26 @@
+import os
 from pathlib import Path
 
-import serial
-
-SERIAL_PORT = "COM8"   # или "/dev/ttyUSB0" под Linux
+SERIAL_PORT = "COM8"   # или "/dev/ttyUSB0" под Linux, "loop://" для проверки без устройства
 SERIAL_BAUD = 115200
+SERIAL_WRITE_TIMEOUT = 0.5
+SERIAL_COMMAND = b"SERVO:120\n"
+SERIAL_RECONNECT_INTERVAL = 5.0  # секунд между попытками переподключения порта
+ACTUATOR_HOLDOFF = 5.0  # секунд между командами для одного и того же человека
+ACTUATOR_QUEUE_SIZE = 16
 serial_port = None
+actuator = None
 # Базовые пути
 BASE_DIR = Path(__file__).parent.parent
 APP_DIR = Path(__file__).parent
 
 # Directory settings
 DATASET_DIR = BASE_DIR / 'data' / 'datasets'
+DATASET_CACHE_DIR = BASE_DIR / 'data' / 'dataset_cache'  # упакованные кропы людей (см. app.services.dataset_cache)
+# Открывать кеш через memory-map; в Windows отображённый файл нельзя заменить при перепаковке
+DATASET_CACHE_MMAP = os.name != "nt"
+DATASET_LOAD_WORKERS = 8  # потоков декодирования изображений набора данных
+DATASET_MANIFEST_FILE = BASE_DIR / 'data' / 'dataset_manifest.json'  # сводка по людям (см. app.services.dataset_manifest)
 LOGS_DIR = BASE_DIR / 'logs'
 STATIC_DIR = BASE_DIR / 'static'
 UPLOADS_DIR = STATIC_DIR / 'uploads'
@@ -21,10 +31,29 @@ HAARCASCADES_DIR = BASE_DIR / 'data' / 'haarcascades'
 face_cascade = None
 eye_cascade = None
 model = None
+# Текущий и предыдущий (для отката) снимки модели, см. app.services.models.ModelSnapshot;
+# model и names выше - их зеркала для чтения
+model_snapshot = None
+previous_snapshot = None
+model_watcher = None
+MODEL_WATCH_INTERVAL = 2.0  # секунд между проверками файла модели на замену другим процессом
+# Журнал добавлений/удалений людей после последнего полного сохранения модели
+MODEL_DELTA_DIR = BASE_DIR / 'data' / 'model_delta'
+MODEL_DELTA_MAX = 20  # операций в журнале, после которых модель сохраняется целиком (в фоне)
 HAAR_FILE = HAARCASCADES_DIR / 'haarcascade_frontalface_default.xml'
 EYE_FILE = HAARCASCADES_DIR / 'haarcascade_eye.xml'
 MODEL_FILE = BASE_DIR / 'data' / 'face_model.xml'
+EMBEDDING_MODEL_FILE = BASE_DIR / 'data' / 'face_embeddings.npz'
 METADATA_FILE = BASE_DIR / 'data' / 'model_metadata.json'
+# Формат файла модели: "bundle" - один бинарный файл (массивы модели, имена, пороги
+# и метаданные), открывается через memory-map; "xml" - прежний (XML OpenCV или .npz
+# и model_metadata.json). Модель прежнего формата переводится в бинарный при загрузке
+MODEL_FORMAT = "bundle"
+MODEL_BUNDLE_FILE = BASE_DIR / 'data' / 'face_model.bin'
+EMBEDDING_BUNDLE_FILE = BASE_DIR / 'data' / 'face_embeddings.bin'
+# Под Windows отображённый в память файл нельзя подменить os.replace,
+# поэтому там бинарный файл читается в память целиком
+MODEL_BUNDLE_MMAP = os.name != "nt"
 LOGS_FILE = LOGS_DIR / 'activity.json'
 
 # Image processing settings
@@ -41,19 +70,104 @@ camera_settings = {
     "height": 480,
     "fps": 30
 }
+capture_worker = None
+
+# Именованные камеры, каждая обрабатывается в своём процессе (/video_feed/<camera_id>).
+# source - индекс устройства, путь к видеофайлу или URL потока
+CAMERA_SOURCES = {
+    # "entrance": {"source": 0, "width": 640, "height": 480, "fps": 30},
+    # "lobby": {"source": "data/videos/lobby.mp4", "loop": True},
+}
+camera_manager = None
+CAPTURE_IDLE_TIMEOUT = 30  # секунд без подписчиков до остановки потока захвата
+CAMERA_STALE_TIMEOUT = 2  # секунд без нового кадра, после которых камера считается неготовой
+
+# Адаптивная отдача MJPEG: уровни качества и ширины кадра для клиентов /video_feed
+STREAM_MAX_FPS = 30
+STREAM_QUALITY_LEVELS = [85, 70, 55, 40]
+STREAM_WIDTHS = [1280, 960, 640, 480, 320]
+STREAM_ADAPT_COOLDOWN = 2.0  # секунд между сменами уровня клиента
 
 # Server settings
 DEFAULT_HOST = '0.0.0.0'
 DEFAULT_PORT = 5000
 DEBUG_MODE = False
+# Быстрый старт: сервер принимает запросы сразу, каскады, модель, Serial и камеры
+# загружаются в фоне (или при первом обращении); состояние - /healthz и /readyz
+FAST_START = True
+SUBSYSTEM_WAIT_TIMEOUT = 30.0  # секунд, которые запрос ждёт загрузки нужной ему подсистемы
 THREADED_MODE = True
 
 # Cascade detection settings
 cascade_params = {
     "scaleFactor": 1.1,
     "minNeighbors": 5,
+    "minSize": (40, 40),    # в копии 0.5x это 20 пикселей - окно каскада; меньший minSize поднимет масштаб копии
+    "maxSize": (500, 500),
+    "detectionScale": 0.5  # каскад на копии 0.5x (~4 раза меньше пикселей), рамки в полном разрешении
+}
+
+# Режим «обнаружить, затем отслеживать» для видео потока
+tracking_params = {
+    "enabled": True,
+    "detect_interval": 5,   # полный каскад раз в N кадров
+    "max_missed": 2,        # сколько обнаружений трек может пропустить до удаления
+    "iou_threshold": 0.3,   # минимальное перекрытие для сопоставления с треком
+    "min_points": 4         # минимум точек оптического потока для сопровождения
+}
+
+# Кеш распознавания по трекам и голосование за имя
+track_recognition_params = {
+    "reverify_interval": 15,        # кадров между повторными predict для одного трека
+    "crop_change_threshold": 12.0,  # средняя разница миниатюр лица, при которой predict повторяется
+    "vote_window": 7,               # K последних предсказаний для голосования
+    "min_votes": 3                  # голосов до учёта человека в статистике
+}
+
+# Обнаружение лиц на загруженных изображениях (FaceRecognizer)
+upload_detection_params = {
+    "passes": 1,               # 1 - один проход с параметрами ниже; 2-3 - первые прежние наборы FaceRecognizer.DETECTION_PASSES
+    # Один проход на копии 0.67x (minSize 30 -> окно каскада 20): на тестовом наборе
+    # находит не меньше лиц, чем три прежних прохода в полном разрешении, в ~2.5 раза быстрее
+    "scaleFactor": 1.07,
+    "minNeighbors": 2,
     "minSize": (30, 30),
-    "maxSize": (500, 500)
+    "overlapThreshold": 0.5    # доля пересечения от меньшей рамки, при которой рамки сливаются
+}
+
+# Улучшение изображения (CLAHE + медианный фильтр) для FaceRecognizer
+preprocessing_params = {
+    "claheClipLimit": 2.0,
+    "claheTileGrid": (8, 8),
+    "medianBlur": 3
+}
+
+# Бэкенд модели распознавания: "opencv" (cv2.face LBPH), "numpy" (app.services.lbph)
+# или "embedding" (эмбеддинги face_recognition/dlib, app.services.embedding).
+# В бинарном формате (MODEL_FORMAT = "bundle") модель opencv сохраняется галереей
+# и после загрузки выполняется NumpyLBPH с теми же расстояниями
+MODEL_BACKEND = "opencv"
+lbph_params = {
+    "chunk_elements": 131072,     # размер блока галереи при расчёте расстояний (помещается в кеш)
+    # Двухступенчатый поиск: сначала центроиды людей, затем точное сравнение
+    # только с образцами candidate_identities ближайших (больше - точнее, меньше - быстрее)
+    "candidate_identities": 20,
+    "index_min_identities": 100   # при меньшем числе людей всегда полный перебор (проверяется при обучении/загрузке)
+}
+embedding_params = {
+    "tolerance": 0.6,      # расстояние эмбеддингов, соответствующее CONFIDENCE_THRESHOLD
+    "per_person": False,   # True - один усреднённый эмбеддинг на человека вместо каждого образца
+    "num_jitters": 1,
+    "landmarks": "small"   # модель ключевых точек dlib: "small" (5 точек) или "large" (68)
+}
+
+# Оценка точности (app.services.evaluation): кропы каждого человека делятся на части
+evaluation_params = {
+    "folds": 5,
+    "holdout": None,       # доля тестовых кропов человека вместо k-fold, например 0.2
+    "workers": 0,          # процессов пула (0 - по числу ядер)
+    "seed": 0,
+    "dense_confusion_max_people": 50  # полная матрица ошибок в ответе - только до стольких людей
 }
 
 # Log cleanup settings
@@ -70,6 +184,9 @@ FONT_PATHS = [
     "/System/Library/Fonts/Supplemental/Arial.ttf"
 ]
 
+# Размер кеша отрисованных надписей оверлея
+OVERLAY_SPRITE_CACHE_SIZE = 512
+
 # Haar cascade URLs
 HAAR_FILE_URL = 'https://raw.githubusercontent.com/opencv/opencv/master/data/haarcascades/haarcascade_frontalface_default.xml'
 EYE_FILE_URL = 'https://raw.githubusercontent.com/opencv/opencv/master/data/haarcascades/haarcascade_eye.xml'
@@ -80,7 +197,18 @@ original_names = {}
 is_collecting_data = False
 require_eyes_for_face = True
 current_person_name = ""
-collected_count = 0
+collected_count = 0  # поставлено в очередь записи, сохранённые - в dataset_writer.saved
+dataset_writer = None
+dataset_manifest = None
+subsystems = None
+evaluation_runner = None
+DATASET_WRITER_QUEUE_SIZE = 64
+training_queue = None
+TRAINING_JOB_HISTORY = 20  # сколько последних заданий обучения хранить для /api/train_jobs
+
+# Profiler (/api/admin/profile)
+PROFILER_MAX_COUNT = 1000  # кадров или запросов за одну сессию
+PROFILER_MAX_SECONDS = 120  # сессия выключается сама, даже если замеров не набралось
 recognition_stats = {
     'total_faces_detected': 0,
     'known_faces': 0,
@@ -1,5 +1,6 @@
-from flask import Blueprint, render_template, Response
+from flask import Blueprint, render_template, Response, request, abort
 from app.services.frame_generator import generate_frames
+from app.services.camera_manager import get_camera_manager
 
 main_router = Blueprint("main", __name__)
 
@@ -17,6 +18,21 @@ def recognize_page():
 
 @main_router.route("/video_feed")
 def video_feed():
-    """Видео поток"""
-    return Response(generate_frames(),
-                    mimetype="multipart/x-mixed-replace; boundary=frame")
\ No newline at end of file
+    """Видео поток. Параметры: fps (макс. частота), width (ширина), quality (качество JPEG)"""
+    max_fps = request.args.get("fps", type=float)
+    width = request.args.get("width", type=int)
+    quality = request.args.get("quality", type=int)
+    return Response(generate_frames(max_fps, width, quality),
+                    mimetype="multipart/x-mixed-replace; boundary=frame")
+
+@main_router.route("/video_feed/<camera_id>")
+def camera_video_feed(camera_id):
+    """Видео поток именованной камеры из config.CAMERA_SOURCES"""
+    handle = get_camera_manager().get(camera_id)
+    if handle is None:
+        abort(404)
+    max_fps = request.args.get("fps", type=float)
+    width = request.args.get("width", type=int)
+    quality = request.args.get("quality", type=int)
+    return Response(generate_frames(max_fps, width, quality, worker=handle),
+                    mimetype="multipart/x-mixed-replace; boundary=frame")
@@ -0,0 +1,139 @@
+import queue
+import threading
+import time
+
+from app import config
+
+
+class ActuatorChannel:
+    """
+    Неблокирующий канал команд исполнительному устройству (Serial).
+    Поток обработки кадров только ставит команду в очередь; отдельный поток
+    пишет её в порт, переподключает порт при ошибках и ведёт счётчики.
+    Повторные срабатывания одного человека гасятся окном удержания,
+    одинаковые команды, ещё ожидающие в очереди, объединяются
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=config.ACTUATOR_QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._last_trigger = {}
+        self._thread = None
+        self._last_connect_attempt = 0.0
+
+        self.sent = 0
+        self.failed = 0
+        self.debounced = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.reconnects = 0
+        self.last_latency_ms = None
+        self.max_latency_ms = 0.0
+        self._total_latency_ms = 0.0
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="serial-actuator", daemon=True)
+            self._thread.start()
+
+    def trigger(self, identity, command=None):
+        """Запросить команду для распознанного человека, False если она погашена"""
+        command = command or config.SERIAL_COMMAND
+        now = time.monotonic()
+        with self._lock:
+            last = self._last_trigger.get(identity)
+            if last is not None and now - last < config.ACTUATOR_HOLDOFF:
+                self.debounced += 1
+                return False
+
+            # Окно удержания начинается, только если команда поставлена в очередь
+            # или объединена: отброшенная при полной очереди повторится со следующим кадром
+            if command in self._pending:
+                self.coalesced += 1
+                self._last_trigger[identity] = now
+                return True
+            try:
+                self._queue.put_nowait(command)
+            except queue.Full:
+                self.dropped += 1
+                return False
+            self._pending.add(command)
+            self._last_trigger[identity] = now
+        self.start()
+        return True
+
+    def _connect(self):
+        """Открыть config.SERIAL_PORT не чаще SERIAL_RECONNECT_INTERVAL"""
+        from app.services.init_system import init_serial
+
+        now = time.monotonic()
+        if now - self._last_connect_attempt < config.SERIAL_RECONNECT_INTERVAL:
+            return False
+        self._last_connect_attempt = now
+        if init_serial():
+            self.reconnects += 1
+            return True
+        return False
+
+    def _run(self):
+        while True:
+            command = self._queue.get()
+            with self._lock:
+                self._pending.discard(command)
+
+            port = config.serial_port
+            if port is None or not port.is_open:
+                if not self._connect():
+                    self.failed += 1
+                    continue
+                port = config.serial_port
+
+            started = time.perf_counter()
+            try:
+                port.write(command)
+                port.flush()
+            except Exception as e:
+                print(f"Ошибка отправки в Serial: {e}")
+                self.failed += 1
+                try:
+                    port.close()
+                except Exception:
+                    pass
+                config.serial_port = None
+                continue
+
+            latency_ms = (time.perf_counter() - started) * 1000
+            self.sent += 1
+            self.last_latency_ms = latency_ms
+            self.max_latency_ms = max(self.max_latency_ms, latency_ms)
+            self._total_latency_ms += latency_ms
+            print(f"Команда отправлена: {command.decode(errors='replace').strip()}")
+
+    def status(self):
+        port = config.serial_port
+        return {
+            "port": config.SERIAL_PORT,
+            "connected": bool(port is not None and port.is_open),
+            "queue_depth": self._queue.qsize(),
+            "sent": self.sent,
+            "failed": self.failed,
+            "debounced": self.debounced,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "reconnects": self.reconnects,
+            "last_latency_ms": round(self.last_latency_ms, 2) if self.last_latency_ms is not None else None,
+            "avg_latency_ms": round(self._total_latency_ms / self.sent, 2) if self.sent else None,
+            "max_latency_ms": round(self.max_latency_ms, 2),
+        }
+
+
+_actuator_lock = threading.Lock()
+
+
+def get_actuator():
+    """Общий канал исполнительного устройства"""
+    with _actuator_lock:
+        if config.actuator is None:
+            config.actuator = ActuatorChannel()
+        return config.actuator
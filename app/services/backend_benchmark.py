@@ -0,0 +1,100 @@
+"""
+Сравнение бэкендов распознавания на собранном наборе данных: время обучения,
+задержка распознавания одного кропа и пакета, память галереи и точность.
+
+    python -m app.services.backend_benchmark
+    python -m app.services.backend_benchmark --backends numpy embedding --test-every 4
+
+Из каталога каждого человека каждый N-й кроп (--test-every) уходит в тестовую
+выборку, остальные - в обучение. Бэкенд без установленных зависимостей пропускается.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app import config
+from app.services.lbph import predict_batch
+from app.services.models import create_model, load_training_data
+
+BACKENDS = ("opencv", "numpy", "embedding")
+
+
+def gallery_bytes(model):
+    """Память, занимаемая галереей модели"""
+    if hasattr(model, "getHistograms"):
+        return sum(h.nbytes for h in model.getHistograms())
+    total = model.gallery.nbytes
+    if getattr(model, "centroids", None) is not None:
+        total += model.centroids.nbytes
+    return total
+
+
+def split(images, labels, test_every):
+    test = np.zeros(len(labels), dtype=bool)
+    for label in np.unique(labels):
+        indices = np.flatnonzero(labels == label)
+        test[indices[::test_every]] = True
+    return (images[~test], labels[~test]), (images[test], labels[test])
+
+
+def run_backend(backend, train, test, batch):
+    config.MODEL_BACKEND = backend
+    model = create_model()
+
+    started = time.perf_counter()
+    model.train(list(train[0]), train[1])
+    train_time = time.perf_counter() - started
+
+    images, labels = list(test[0]), test[1]
+    started = time.perf_counter()
+    single = [model.predict(image)[0] for image in images]
+    single_time = (time.perf_counter() - started) / len(images)
+
+    started = time.perf_counter()
+    batched = []
+    for first in range(0, len(images), batch):
+        batched += [label for label, _ in predict_batch(model, images[first:first + batch])]
+    batch_time = (time.perf_counter() - started) / len(images)
+
+    return {
+        "backend": backend,
+        "train_s": train_time,
+        "single_ms": single_time * 1000,
+        "batch_ms": batch_time * 1000,
+        "gallery_mb": gallery_bytes(model) / 2 ** 20,
+        "accuracy": float(np.mean(np.asarray(single) == labels)),
+        "batch_agrees": bool(np.array_equal(single, batched)),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сравнение бэкендов распознавания лиц")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--test-every", type=int, default=5, help="каждый N-й кроп человека - тестовый")
+    parser.add_argument("--batch", type=int, default=8, help="размер пакета (лиц в кадре)")
+    args = parser.parse_args(argv)
+
+    images, labels, names = load_training_data()
+    if images is None:
+        return 1
+    train, test = split(images, labels, args.test_every)
+    print(f"Людей: {len(names)}, обучение: {len(train[1])}, тест: {len(test[1])}")
+
+    print(f"{'бэкенд':>10} {'обучение с':>11} {'мс/кроп':>8} {'мс/кроп пакетом':>16} "
+          f"{'галерея МБ':>11} {'точность':>9}")
+    for backend in args.backends:
+        try:
+            row = run_backend(backend, train, test, args.batch)
+        except (RuntimeError, AttributeError) as e:
+            print(f"{backend:>10} пропущен: {e}")
+            continue
+        print(f"{row['backend']:>10} {row['train_s']:11.2f} {row['single_ms']:8.2f} {row['batch_ms']:16.2f} "
+              f"{row['gallery_mb']:11.2f} {row['accuracy']:9.3f}")
+        if not row["batch_agrees"]:
+            print(f"{'':>10} ВНИМАНИЕ: пакетное распознавание разошлось с поштучным")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
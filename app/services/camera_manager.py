@@ -0,0 +1,423 @@
+import multiprocessing
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from app import config
+from app.services.capture_worker import FrameBroadcast
+from app.utils.metrics import REGISTRY, stats_snapshot
+
+# Слотов кадров в разделяемой памяти на одну камеру
+FRAME_SLOTS = 4
+
+# Настройки, которые передаются в процессы камер при изменении через API
+SYNCED_SETTINGS = (
+    "CONFIDENCE_THRESHOLD",
+    "UNKNOWN_THRESHOLD",
+    "cascade_params",
+    "tracking_params",
+    "track_recognition_params",
+    "require_eyes_for_face",
+)
+
+
+def settings_snapshot():
+    return {name: getattr(config, name) for name in SYNCED_SETTINGS}
+
+
+def _apply_settings(settings):
+    from app.services.models import refresh_thresholds
+
+    for name, value in settings.items():
+        if name in SYNCED_SETTINGS:
+            setattr(config, name, value)
+    # Пороги входят в снимок модели
+    refresh_thresholds()
+
+
+# ---------------------------------------------------------------------------
+# Сторона процесса камеры
+# ---------------------------------------------------------------------------
+
+class PacedCapture:
+    """Видеофайл как источник реального времени: темп по FPS файла и повтор с начала"""
+
+    def __init__(self, capture, loop=True):
+        self.capture = capture
+        self.loop = loop
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        self.interval = 1.0 / fps if fps and fps > 0 else 1.0 / 25
+        self._next_time = time.monotonic()
+
+    def read(self):
+        delay = self._next_time - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self._next_time = max(self._next_time + self.interval, time.monotonic())
+
+        success, frame = self.capture.read()
+        if not success and self.loop:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            success, frame = self.capture.read()
+        return success, frame
+
+    def __getattr__(self, name):
+        return getattr(self.capture, name)
+
+
+def open_source(spec):
+    """Открыть источник камеры: индекс устройства, видеофайл или URL потока"""
+    source = spec["source"]
+    capture = cv2.VideoCapture(source)
+    if isinstance(source, int):
+        capture.set(cv2.CAP_PROP_FRAME_WIDTH, spec.get("width", 640))
+        capture.set(cv2.CAP_PROP_FRAME_HEIGHT, spec.get("height", 480))
+        capture.set(cv2.CAP_PROP_FPS, spec.get("fps", 30))
+        capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return capture
+    if "://" not in str(source):
+        return PacedCapture(capture, loop=spec.get("loop", True))
+    return capture
+
+
+class ActuatorProxy:
+    """
+    Замена канала Serial в процессе камеры: команды уходят в главный процесс.
+    Окно удержания применяется уже здесь, иначе каждый кадр с распознанным
+    лицом становился бы событием в очереди главного процесса
+    """
+
+    def __init__(self, event_queue, camera_id):
+        self.event_queue = event_queue
+        self.camera_id = camera_id
+        self._last_trigger = {}
+
+    def trigger(self, identity, command=None):
+        now = time.monotonic()
+        last = self._last_trigger.get(identity)
+        if last is not None and now - last < config.ACTUATOR_HOLDOFF:
+            return False
+        self._last_trigger[identity] = now
+        self.event_queue.put(("actuate", identity, command))
+        return True
+
+
+class SharedFramePublisher:
+    """
+    Публикация кадров процесса камеры в главный процесс: кадр копируется
+    в кольцо слотов разделяемой памяти, по очереди передаётся только
+    номер слота, результаты и (раз в секунду) статистика
+    """
+
+    def __init__(self, frame_queue):
+        self.frame_queue = frame_queue
+        self.worker = None
+        self.subscribers = 0
+        self._shm = None
+        self._retired = {}  # прежние сегменты, на которые ещё могут ссылаться кадры в очереди
+        self._memory_lock = threading.Lock()
+        self._slot_bytes = 0
+        self._seq = 0
+        self._last_stats_time = 0.0
+        self.transfer_dropped = 0
+
+    def _ensure_memory(self, nbytes):
+        if self._shm is not None and self._slot_bytes == nbytes:
+            return
+        # Размер кадра изменился: старый сегмент удаляется, когда главный
+        # процесс перейдёт на новый (release_memory), а не сразу
+        with self._memory_lock:
+            if self._shm is not None:
+                self._retired[self._shm.name] = self._shm
+            self._shm = shared_memory.SharedMemory(create=True, size=nbytes * FRAME_SLOTS)
+        self._slot_bytes = nbytes
+
+    def release_memory(self, current_name):
+        """Главный процесс читает сегмент current_name - более старые больше не нужны"""
+        with self._memory_lock:
+            for name in [name for name in self._retired if name != current_name]:
+                _unlink(self._retired.pop(name))
+
+    def publish(self, frame):
+        # Главный процесс не успевает забирать кадры - этот пропускаем,
+        # не трогая слоты, на которые ещё ссылаются сообщения в очереди
+        if self.frame_queue.full():
+            self.transfer_dropped += 1
+            return
+
+        frame = np.ascontiguousarray(frame)
+        self._ensure_memory(frame.nbytes)
+        slot = self._seq % FRAME_SLOTS
+        target = np.ndarray(frame.shape, dtype=frame.dtype, buffer=self._shm.buf,
+                            offset=slot * self._slot_bytes)
+        target[:] = frame
+        self._seq += 1
+
+        stats = None
+        now = time.time()
+        if self.worker is not None and now - self._last_stats_time >= 1.0:
+            self._last_stats_time = now
+            stats = self.worker.status()
+            stats["recognition_stats"] = stats_snapshot()
+            stats["metrics"] = REGISTRY.snapshot()
+
+        results = self.worker.latest_results if self.worker is not None else []
+        try:
+            self.frame_queue.put_nowait(("frame", self._shm.name, slot * self._slot_bytes,
+                                         frame.shape, results, stats))
+        except queue.Full:
+            self.transfer_dropped += 1
+
+    def status(self):
+        return {"transfer_dropped": self.transfer_dropped}
+
+    def close(self):
+        with self._memory_lock:
+            for shm in [self._shm, *self._retired.values()]:
+                if shm is not None:
+                    _unlink(shm)
+            self._shm = None
+            self._retired = {}
+
+
+def _unlink(shm):
+    try:
+        shm.close()
+        shm.unlink()
+    except Exception:
+        pass
+
+
+def run_camera_process(camera_id, spec, settings, frame_queue, event_queue, control_queue):
+    """Точка входа процесса камеры: свои каскады, модель и поток захвата"""
+    from app.services.capture_worker import CaptureWorker
+    from app.services.frame_generator import process_frame
+    from app.services.init_system import init_face_cascade, init_eye_cascade
+    from app.services.models import load_model, rollback
+
+    _apply_settings(settings)
+    config.actuator = ActuatorProxy(event_queue, camera_id)
+    print(f"[{camera_id}] Запуск процесса камеры: {spec['source']}")
+
+    # Модель и каскады загружаются один раз на процесс
+    init_face_cascade()
+    init_eye_cascade()
+    load_model()
+
+    config.camera = open_source(spec)
+    publisher = SharedFramePublisher(frame_queue)
+    worker = CaptureWorker(process_frame, broadcast=publisher)
+    publisher.worker = worker
+    worker.start()
+
+    try:
+        while True:
+            try:
+                command = control_queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            if command[0] == "stop":
+                break
+            elif command[0] == "reload_model":
+                load_model()
+                print(f"[{camera_id}] Модель перезагружена")
+            elif command[0] == "rollback_model":
+                rollback()
+            elif command[0] == "settings":
+                _apply_settings(command[1])
+            elif command[0] == "release_memory":
+                publisher.release_memory(command[1])
+    finally:
+        worker.stop()
+        time.sleep(0.2)
+        if config.camera is not None:
+            config.camera.release()
+        publisher.close()
+        print(f"[{camera_id}] Процесс камеры остановлен")
+
+
+# ---------------------------------------------------------------------------
+# Сторона главного процесса
+# ---------------------------------------------------------------------------
+
+class CameraHandle:
+    """Процесс одной именованной камеры и его буфер кадров для /video_feed/<camera_id>"""
+
+    def __init__(self, camera_id, spec):
+        self.camera_id = camera_id
+        self.spec = spec
+        self.broadcast = FrameBroadcast()
+        self.closed = False
+        self.restarts = 0
+        self.latest_results = []
+        self.latest_results_time = None
+        self.stats = {}
+        self.receive_errors = 0
+        self._process = None
+        self._receiver = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.closed or self.is_alive():
+                return
+            if self._process is not None:
+                self.restarts += 1
+
+            ctx = multiprocessing.get_context("spawn")
+            self._frame_queue = ctx.Queue(maxsize=2)
+            self._event_queue = ctx.Queue()
+            self._control_queue = ctx.Queue()
+            self._process = ctx.Process(
+                target=run_camera_process,
+                name=f"camera-{self.camera_id}",
+                args=(self.camera_id, self.spec, settings_snapshot(),
+                      self._frame_queue, self._event_queue, self._control_queue),
+                daemon=True
+            )
+            self._process.start()
+            self._receiver = threading.Thread(target=self._receive_loop, args=(self._process,),
+                                              name=f"camera-{self.camera_id}-receiver", daemon=True)
+            self._receiver.start()
+
+    def is_alive(self):
+        return self._process is not None and self._process.is_alive()
+
+    def send(self, *command):
+        if self.is_alive():
+            self._control_queue.put(command)
+
+    def stop(self):
+        self.closed = True
+        process = self._process
+        if process is None:
+            return
+        self.send("stop")
+        process.join(timeout=5)
+        if process.is_alive():
+            process.terminate()
+
+    def _receive_loop(self, process):
+        from app.services.actuator import get_actuator
+
+        frame_queue, event_queue = self._frame_queue, self._event_queue
+        memory = {}
+        last_error = None
+        try:
+            while process.is_alive() or not frame_queue.empty():
+                try:
+                    message = frame_queue.get(timeout=0.5)
+                except queue.Empty:
+                    message = None
+
+                # Ошибка в одном сообщении отбрасывает только этот кадр
+                if message is not None:
+                    try:
+                        self._receive_frame(message, memory)
+                    except Exception as e:
+                        self.receive_errors += 1
+                        if str(e) != last_error:
+                            print(f"[{self.camera_id}] Ошибка приёма кадра, кадр пропущен: {e}")
+                        last_error = str(e)
+
+                # Команды исполнительному устройству от процесса камеры
+                while True:
+                    try:
+                        _, identity, command = event_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    try:
+                        get_actuator().trigger(f"{self.camera_id}:{identity}", command)
+                    except Exception as e:
+                        print(f"[{self.camera_id}] Ошибка команды исполнительному устройству: {e}")
+        finally:
+            for shm in memory.values():
+                shm.close()
+
+    def _receive_frame(self, message, memory):
+        """Скопировать кадр из разделяемой памяти процесса камеры и опубликовать его"""
+        _, shm_name, offset, shape, results, stats = message
+        shm = memory.get(shm_name)
+        if shm is None:
+            # Кадры прежнего сегмента в очереди идут раньше кадров нового,
+            # поэтому после перехода процесс камеры может удалить прежние
+            shm = shared_memory.SharedMemory(name=shm_name)
+            for old in memory.values():
+                old.close()
+            memory.clear()
+            memory[shm_name] = shm
+            self.send("release_memory", shm_name)
+        frame = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=offset).copy()
+        self.latest_results, self.latest_results_time = results, time.time()
+        if stats is not None:
+            self.stats = stats
+        self.broadcast.publish(frame)
+
+    def status(self):
+        return {
+            "camera_id": self.camera_id,
+            "source": self.spec["source"],
+            "alive": self.is_alive(),
+            "pid": self._process.pid if self._process is not None else None,
+            "restarts": self.restarts,
+            "receive_errors": self.receive_errors,
+            "subscribers": self.broadcast.subscribers,
+            "stats": {k: v for k, v in self.stats.items() if k != "metrics"},
+        }
+
+
+class CameraManager:
+    """Набор именованных камер, каждая в своём процессе"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.cameras = {}
+
+    def add(self, camera_id, spec):
+        with self._lock:
+            if camera_id in self.cameras:
+                raise ValueError(f"Камера {camera_id} уже существует")
+            handle = self.cameras[camera_id] = CameraHandle(camera_id, spec)
+        handle.start()
+        return handle
+
+    def remove(self, camera_id):
+        with self._lock:
+            handle = self.cameras.pop(camera_id, None)
+        if handle is None:
+            return False
+        handle.stop()
+        return True
+
+    def get(self, camera_id):
+        return self.cameras.get(camera_id)
+
+    def reload_models(self):
+        for handle in list(self.cameras.values()):
+            handle.send("reload_model")
+
+    def rollback_models(self):
+        for handle in list(self.cameras.values()):
+            handle.send("rollback_model")
+
+    def sync_settings(self):
+        snapshot = settings_snapshot()
+        for handle in list(self.cameras.values()):
+            handle.send("settings", snapshot)
+
+    def status(self):
+        return {camera_id: handle.status() for camera_id, handle in list(self.cameras.items())}
+
+
+_manager_lock = threading.Lock()
+
+
+def get_camera_manager():
+    with _manager_lock:
+        if config.camera_manager is None:
+            config.camera_manager = CameraManager()
+        return config.camera_manager
@@ -0,0 +1,252 @@
+import cv2
+import threading
+import time
+
+from app import config
+from app.utils.metrics import stage_timer, FRAME_LATENCY_SECONDS, FRAMES_TOTAL
+from app.services.stream_encoder import EncoderPool, frame_signature
+from app.utils.profiler import profile_scope
+
+
+class FrameBroadcast:
+    """
+    Последний аннотированный кадр, общий для всех подписчиков /video_feed.
+    JPEG кодируется по требованию один раз на уровень качества (см. EncoderPool)
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._frame = None
+        self._signature = None
+        self._seq = 0
+        self.subscribers = 0
+        self.encoders = EncoderPool()
+
+    def publish(self, frame):
+        """Опубликовать новый кадр и разбудить всех ожидающих клиентов"""
+        signature = frame_signature(frame)
+        with self._condition:
+            self._frame = frame
+            self._signature = signature
+            self._seq += 1
+            self._condition.notify_all()
+
+    def wait_for_frame(self, last_seq, timeout=1.0):
+        """Дождаться кадра новее last_seq, возвращает (seq, frame, signature)"""
+        with self._condition:
+            self._condition.wait_for(lambda: self._seq != last_seq, timeout=timeout)
+            return self._seq, self._frame, self._signature
+
+    def subscribe(self):
+        with self._condition:
+            self.subscribers += 1
+
+    def unsubscribe(self):
+        with self._condition:
+            self.subscribers = max(0, self.subscribers - 1)
+
+    def status(self):
+        return {
+            "subscribers": self.subscribers,
+            "stream_tiers": self.encoders.stats(),
+        }
+
+
+class CaptureWorker:
+    """
+    Единственный владелец config.camera: один поток читает камеру и хранит
+    только самый свежий кадр, второй обрабатывает его и публикует подписчикам
+    """
+
+    def __init__(self, process_frame, broadcast=None, idle_timeout=None):
+        self.process_frame = process_frame
+        self.broadcast = broadcast or FrameBroadcast()
+        # None - поток не останавливается без подписчиков (процессы камер)
+        self.idle_timeout = idle_timeout
+
+        self._latest_frame = None
+        self._latest_seq = 0
+        self._frame_condition = threading.Condition()
+        self._reopen_requested = False
+        self._stop_event = threading.Event()
+        self._threads = []
+        self.closed = False
+
+        self.camera_ready = False
+        self.last_frame_time = None
+        self.frames_captured = 0
+        self.frames_processed = 0
+        self.frames_dropped = 0
+        self.processing_fps = 0.0
+        self.latest_results = []
+        self.latest_results_time = None
+
+    def start(self):
+        if self.is_alive():
+            return
+        self._stop_event.clear()
+        self._threads = [
+            threading.Thread(target=self._capture_loop, name="camera-capture", daemon=True),
+            threading.Thread(target=self._process_loop, name="frame-process", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        print("Поток захвата камеры запущен")
+
+    def stop(self):
+        self._stop_event.set()
+        with self._frame_condition:
+            self._frame_condition.notify_all()
+
+    def is_alive(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def request_reopen(self):
+        """Переоткрыть камеру с текущими config.camera_settings из потока захвата"""
+        self._reopen_requested = True
+
+    def _open_camera(self):
+        from app.services.init_system import init_camera
+
+        if self._reopen_requested:
+            self._reopen_requested = False
+            init_camera()
+        elif config.camera is None:
+            config.camera = probe_camera()
+
+        if config.camera is not None:
+            # Минимальный буфер драйвера, чтобы не отдавать устаревшие кадры
+            config.camera.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return config.camera is not None and config.camera.isOpened()
+
+    def _capture_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                if self._reopen_requested or config.camera is None:
+                    if not self._open_camera():
+                        print("Ошибка: не удалось инициализировать камеру")
+                        self.camera_ready = False
+                        time.sleep(1.0)
+                        continue
+
+                with stage_timer("capture"):
+                    success, frame = config.camera.read()
+                captured_at = time.perf_counter()
+                if not success or frame is None:
+                    self.camera_ready = False
+                    print("Не удалось прочитать кадр")
+                    time.sleep(0.1)
+                    continue
+
+                with self._frame_condition:
+                    if self._latest_frame is not None:
+                        # Предыдущий кадр так и не был обработан
+                        self.frames_dropped += 1
+                        FRAMES_TOTAL.inc(1, "dropped")
+                    self._latest_frame = (frame, captured_at)
+                    self._latest_seq += 1
+                    self._frame_condition.notify()
+
+                self.camera_ready = True
+                self.last_frame_time = time.time()
+                self.frames_captured += 1
+
+            except Exception as e:
+                self.camera_ready = False
+                print(f"Ошибка камеры: {e}")
+                time.sleep(0.1)
+
+    def _process_loop(self):
+        idle_since = None
+        fps_window_start = time.time()
+        fps_window_frames = 0
+
+        while not self._stop_event.is_set():
+            # Без подписчиков и сбора данных поток завершается по таймауту
+            if (self.idle_timeout is not None and self.broadcast.subscribers == 0
+                    and not config.is_collecting_data):
+                idle_since = idle_since or time.time()
+                if time.time() - idle_since > self.idle_timeout:
+                    print("Нет подписчиков видео потока, поток захвата остановлен")
+                    self.stop()
+                    break
+            else:
+                idle_since = None
+
+            with self._frame_condition:
+                self._frame_condition.wait_for(
+                    lambda: self._latest_frame is not None or self._stop_event.is_set(),
+                    timeout=1.0
+                )
+                latest = self._latest_frame
+                self._latest_frame = None
+            if latest is None:
+                continue
+            frame, captured_at = latest
+
+            try:
+                self.frames_processed += 1
+                with profile_scope("frames"):
+                    frame, results = self.process_frame(frame, self.frames_processed)
+                    self.latest_results, self.latest_results_time = results, time.time()
+
+                    self.broadcast.publish(frame)
+                FRAME_LATENCY_SECONDS.observe(time.perf_counter() - captured_at)
+                FRAMES_TOTAL.inc(1, "processed")
+
+                fps_window_frames += 1
+                elapsed = time.time() - fps_window_start
+                if elapsed >= 1.0:
+                    self.processing_fps = fps_window_frames / elapsed
+                    fps_window_start, fps_window_frames = time.time(), 0
+
+            except Exception as e:
+                print(f"Ошибка обработки кадра: {e}")
+                time.sleep(0.1)
+
+    def status(self):
+        """Состояние камеры без обращения к устройству"""
+        stale = (self.last_frame_time is None or
+                 time.time() - self.last_frame_time > config.CAMERA_STALE_TIMEOUT)
+        status = {
+            "camera_ready": self.is_alive() and self.camera_ready and not stale,
+            "last_frame_time": self.last_frame_time,
+            "frames_captured": self.frames_captured,
+            "frames_processed": self.frames_processed,
+            "frames_dropped": self.frames_dropped,
+            "processing_fps": round(self.processing_fps, 1),
+        }
+        status.update(self.broadcast.status())
+        return status
+
+
+def probe_camera():
+    """Поиск первой рабочей камеры по индексам 0-2"""
+    print("Инициализация камеры...")
+    for idx in range(3):
+        test_camera = cv2.VideoCapture(idx)
+        if test_camera.isOpened():
+            ret, test_frame = test_camera.read()
+            if ret and test_frame is not None:
+                print(f"Камера инициализирована по индексу {idx}")
+                test_camera.set(cv2.CAP_PROP_FRAME_WIDTH, config.camera_settings["width"])
+                test_camera.set(cv2.CAP_PROP_FRAME_HEIGHT, config.camera_settings["height"])
+                test_camera.set(cv2.CAP_PROP_FPS, config.camera_settings["fps"])
+                return test_camera
+        test_camera.release()
+    return None
+
+
+_worker_lock = threading.Lock()
+
+
+def get_capture_worker(start=True):
+    """Вернуть общий поток захвата, при необходимости запустив его"""
+    from app.services.frame_generator import process_frame
+
+    with _worker_lock:
+        if config.capture_worker is None:
+            config.capture_worker = CaptureWorker(process_frame, idle_timeout=config.CAPTURE_IDLE_TIMEOUT)
+        if start and not config.capture_worker.is_alive():
+            config.capture_worker.start()
+        return config.capture_worker
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from app import config
+from app.services.dataset_manifest import IMAGE_EXTENSIONS
+
+# Упакованный набор данных: для каждого каталога человека - один файл
+# <каталог>.npy с кропами (N, высота, ширина) uint8 и <каталог>.json с подписью
+# содержимого каталога (имена, размеры и mtime файлов) и именами файлов по порядку.
+# Файл .npy открывается через memory-map; каталог перепаковывается, только
+# когда его подпись изменилась
+
+
+def _listing(path):
+    """
+    [(имя, размер, mtime_ns)] изображений каталога человека по имени - без чтения
+    самих файлов. Отбор по расширению тот же, что в сводке набора данных
+    """
+    entries = []
+    for entry in os.scandir(path):
+        if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+            stat = entry.stat()
+            entries.append((entry.name, stat.st_size, stat.st_mtime_ns))
+    return sorted(entries)
+
+
+def _signature(entries):
+    return hashlib.sha1(repr(entries).encode("utf-8")).hexdigest()
+
+
+def _cache_paths(directory_name):
+    base = os.path.join(config.DATASET_CACHE_DIR, directory_name)
+    return base + ".npy", base + ".json"
+
+
+def _read_cached(directory_name, signature):
+    """
+    Кропы человека из кеша (memory-map при DATASET_CACHE_MMAP, иначе копия
+    в памяти) или None, если кеша нет или он устарел
+    """
+    images_path, meta_path = _cache_paths(directory_name)
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("signature") != signature:
+            return None
+        if meta.get("count", 0) == 0:
+            return np.empty((0, config.IMAGE_SIZE[1], config.IMAGE_SIZE[0]), dtype=np.uint8)
+        return np.load(images_path, mmap_mode="r" if config.DATASET_CACHE_MMAP else None)
+    except (OSError, ValueError):
+        return None
+
+
+def _decode(path):
+    """Серый кроп размера IMAGE_SIZE (кропы другого размера приводятся к нему) или None"""
+    image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if image is not None and image.shape != (config.IMAGE_SIZE[1], config.IMAGE_SIZE[0]):
+        image = cv2.resize(image, config.IMAGE_SIZE)
+    return image
+
+
+def _pack(directory_name, signature, files, images):
+    """Записать кропы человека в кеш (через временные файлы) и вернуть их memory-map"""
+    os.makedirs(config.DATASET_CACHE_DIR, exist_ok=True)
+    images_path, meta_path = _cache_paths(directory_name)
+    array = (np.stack(images) if images
+             else np.empty((0, config.IMAGE_SIZE[1], config.IMAGE_SIZE[0]), dtype=np.uint8))
+    suffix = f".tmp{os.getpid()}"
+    with open(images_path + suffix, "wb") as f:
+        np.save(f, array)
+    with open(meta_path + suffix, "w", encoding="utf-8") as f:
+        json.dump({"name": directory_name, "signature": signature, "count": len(files),
+                   "shape": list(array.shape[1:]), "files": files}, f, ensure_ascii=False)
+    # Подпись - последней: пока она старая, кеш считается устаревшим
+    os.replace(images_path + suffix, images_path)
+    os.replace(meta_path + suffix, meta_path)
+    return _read_cached(directory_name, signature)
+
+
+def load_people(directory_names, progress=None):
+    """
+    Кропы людей {каталог: массив (N, высота, ширина) uint8}. Неизменившиеся
+    каталоги открываются из кеша через memory-map, остальные декодируются
+    пулом потоков (cv2.imread отпускает GIL) и перепаковываются.
+    progress(people_done=..., images_loaded=...) вызывается по мере готовности людей
+    """
+    listings, result, stale = {}, {}, []
+    for name in directory_names:
+        listings[name] = _listing(os.path.join(config.DATASET_DIR, name))
+        cached = _read_cached(name, _signature(listings[name]))
+        if cached is None:
+            stale.append(name)
+        else:
+            result[name] = cached
+
+    loaded = 0
+
+    def report(name):
+        nonlocal loaded
+        loaded += len(result[name])
+        if progress is not None:
+            progress(people_done=len(result), images_loaded=loaded)
+
+    for name in result:
+        report(name)
+
+    if stale:
+        with ThreadPoolExecutor(max_workers=config.DATASET_LOAD_WORKERS) as pool:
+            # Все файлы всех устаревших каталогов декодируются одним пулом
+            futures = {name: [pool.submit(_decode, os.path.join(config.DATASET_DIR, name, filename))
+                              for filename, _, _ in listings[name]]
+                       for name in stale}
+            for name in stale:
+                decoded = [(filename, future.result())
+                           for (filename, _, _), future in zip(listings[name], futures[name])]
+                decoded = [(filename, image) for filename, image in decoded if image is not None]
+                result[name] = _pack(name, _signature(listings[name]),
+                                     [filename for filename, _ in decoded], [image for _, image in decoded])
+                report(name)
+
+    return {name: result[name] for name in directory_names}
+
+
+def cached_files(directory_name):
+    """Имена файлов человека в порядке кропов в кеше (кеш должен быть актуален - после load_people)"""
+    _, meta_path = _cache_paths(directory_name)
+    with open(meta_path, "r", encoding="utf-8") as f:
+        return json.load(f)["files"]
+
+
+def load_person(directory_name):
+    """Кропы одного человека (из кеша, если каталог не менялся)"""
+    return load_people([directory_name])[directory_name]
+
+
+def prune(directory_names):
+    """Удалить из кеша каталоги, которых больше нет в наборе данных"""
+    if not os.path.isdir(config.DATASET_CACHE_DIR):
+        return
+    keep = set(directory_names)
+    for filename in os.listdir(config.DATASET_CACHE_DIR):
+        name, ext = os.path.splitext(filename)
+        if ext in (".npy", ".json") and name not in keep:
+            os.remove(os.path.join(config.DATASET_CACHE_DIR, filename))
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+import threading
+
+from app import config
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+_HASH_MASK = (1 << 64) - 1
+
+
+def _file_digest(name, size, mtime_ns):
+    """64-битный отпечаток файла по имени, размеру и mtime"""
+    digest = hashlib.sha1(f"{name}\0{size}\0{mtime_ns}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "little")
+
+
+def _empty_entry():
+    return {"count": 0, "bytes": 0, "newest_mtime": 0, "hash": 0, "dir_mtime": 0}
+
+
+class DatasetManifest:
+    """
+    Сводка набора данных по людям: число изображений, их общий размер,
+    mtime самого нового файла и хеш содержимого каталога (сумма отпечатков
+    файлов, поэтому запись одного файла учитывается без перечитывания каталога).
+    Сбор, удаление и сверка обновляют её на месте, статус и список людей
+    читают её без обхода каталогов. Хранится в DATASET_MANIFEST_FILE
+    """
+
+    def __init__(self, path=None):
+        self.path = path or config.DATASET_MANIFEST_FILE
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._people = {}
+        self._total = 0
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                people = json.load(f).get("people", {})
+        except (OSError, ValueError):
+            return
+        self._people = {name: dict(_empty_entry(), **entry) for name, entry in people.items()}
+        self._total = sum(entry["count"] for entry in self._people.values())
+
+    def _set(self, name, entry):
+        """Заменить запись человека (вызывается под _lock)"""
+        previous = self._people.get(name)
+        self._total += entry["count"] - (previous["count"] if previous else 0)
+        self._people[name] = entry
+        self._dirty = True
+
+    def scan_person(self, name):
+        """Пересчитать запись человека по его каталогу (один обход каталога)"""
+        path = os.path.join(config.DATASET_DIR, name)
+        entry = _empty_entry()
+        try:
+            entry["dir_mtime"] = os.stat(path).st_mtime_ns
+            for item in os.scandir(path):
+                if item.is_file() and item.name.lower().endswith(IMAGE_EXTENSIONS):
+                    stat = item.stat()
+                    entry["count"] += 1
+                    entry["bytes"] += stat.st_size
+                    entry["newest_mtime"] = max(entry["newest_mtime"], stat.st_mtime_ns)
+                    entry["hash"] = (entry["hash"] + _file_digest(item.name, stat.st_size,
+                                                                  stat.st_mtime_ns)) & _HASH_MASK
+        except FileNotFoundError:
+            self.remove_person(name)
+            return None
+        with self._lock:
+            self._set(name, entry)
+        return entry
+
+    def reconcile(self):
+        """
+        Сверить сводку с диском: перечитываются только каталоги, которых в ней
+        нет или чей mtime изменился (файлы добавлены или удалены в обход
+        приложения), пропавшие каталоги удаляются. Возвращает изменившиеся имена
+        """
+        on_disk = {}
+        if os.path.isdir(config.DATASET_DIR):
+            for item in os.scandir(config.DATASET_DIR):
+                if item.is_dir():
+                    on_disk[item.name] = item.stat().st_mtime_ns
+        with self._lock:
+            gone = [name for name in self._people if name not in on_disk]
+            stale = [name for name, mtime in on_disk.items()
+                     if name not in self._people or self._people[name]["dir_mtime"] != mtime]
+            for name in gone:
+                self._total -= self._people.pop(name)["count"]
+                self._dirty = True
+        for name in stale:
+            self.scan_person(name)
+        self.flush()
+        return gone + stale
+
+    def record_write(self, path, previous=None):
+        """
+        Учесть записанный файл path (кроп в каталоге человека). previous -
+        os.stat_result файла, который запись заменила, или None
+        """
+        directory, filename = os.path.split(path)
+        name = os.path.basename(directory)
+        stat = os.stat(path)
+        dir_mtime = os.stat(directory).st_mtime_ns
+        with self._lock:
+            entry = dict(self._people.get(name) or _empty_entry())
+            if previous is not None:
+                entry["count"] -= 1
+                entry["bytes"] -= previous.st_size
+                entry["hash"] -= _file_digest(filename, previous.st_size, previous.st_mtime_ns)
+            entry["count"] += 1
+            entry["bytes"] += stat.st_size
+            entry["newest_mtime"] = max(entry["newest_mtime"], stat.st_mtime_ns)
+            entry["hash"] = (entry["hash"] + _file_digest(filename, stat.st_size, stat.st_mtime_ns)) & _HASH_MASK
+            entry["dir_mtime"] = dir_mtime
+            self._set(name, entry)
+
+    def remove_person(self, name):
+        with self._lock:
+            entry = self._people.pop(name, None)
+            if entry is not None:
+                self._total -= entry["count"]
+                self._dirty = True
+        self.flush()
+
+    def people(self):
+        """{каталог: запись} - копия сводки"""
+        with self._lock:
+            return {name: dict(entry) for name, entry in self._people.items()}
+
+    def total_images(self):
+        return self._total
+
+    def hashes(self):
+        """{каталог: хеш} людей, у которых есть изображения"""
+        with self._lock:
+            return {name: f"{entry['hash']:016x}" for name, entry in self._people.items() if entry["count"]}
+
+    def flush(self):
+        """Записать сводку на диск, если она изменилась (через временный файл)"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                data = {"people": {name: dict(entry) for name, entry in self._people.items()}}
+                self._dirty = False
+            os.makedirs(os.path.dirname(str(self.path)), exist_ok=True)
+            tmp = f"{self.path}.tmp{os.getpid()}"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+
+
+_manifest_lock = threading.Lock()
+
+
+def get_dataset_manifest():
+    """Общая сводка набора данных"""
+    with _manifest_lock:
+        if config.dataset_manifest is None:
+            config.dataset_manifest = DatasetManifest()
+        return config.dataset_manifest
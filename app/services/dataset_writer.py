@@ -0,0 +1,132 @@
+import os
+import queue
+import threading
+
+import cv2
+
+from app import config
+from app.services.dataset_manifest import get_dataset_manifest
+
+
+class DatasetWriter:
+    """
+    Фоновая запись собранных лиц на диск.
+    Поток обработки кадров только кладёт кроп в ограниченную очередь, а
+    cv2.imwrite выполняется в отдельном потоке. Каталог человека задаётся
+    один раз в начале сбора, счётчик saved растёт только после записи файла.
+    Записанные файлы сразу учитываются в сводке набора данных, на диск она
+    сохраняется, когда очередь опустела
+    """
+
+    def __init__(self, maxsize=None):
+        self._queue = queue.Queue(maxsize=maxsize or config.DATASET_WRITER_QUEUE_SIZE)
+        self._condition = threading.Condition()
+        self._thread = None
+        self._session = 0
+        self.directory = None
+        self.enqueued = 0
+        self.saved = 0
+        self.failed = 0
+        self.dropped = 0
+        self._pending = 0
+
+    def begin(self, directory):
+        """Начать новую сессию сбора в уже созданный каталог"""
+        with self._condition:
+            self._session += 1
+            self.directory = directory
+            self.enqueued = self.saved = self.failed = self.dropped = 0
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="dataset-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, index, image):
+        """Поставить кроп в очередь без блокировки, False если очередь заполнена"""
+        if self.directory is None:
+            return False
+        filename = os.path.join(self.directory, f"{index}.png")
+        # Счётчик растёт до постановки в очередь: иначе поток записи может
+        # уменьшить его раньше, и wait_idle не дождётся уведомления
+        with self._condition:
+            session = self._session
+            self._pending += 1
+        try:
+            self._queue.put_nowait((session, filename, image))
+        except queue.Full:
+            with self._condition:
+                self._pending -= 1
+                self.dropped += 1
+                self._condition.notify_all()
+            return False
+        with self._condition:
+            self.enqueued += 1
+        return True
+
+    def _run(self):
+        manifest = get_dataset_manifest()
+        while True:
+            session, filename, image = self._queue.get()
+            try:
+                # Новый сбор под тем же именем перезаписывает прежние кропы
+                try:
+                    previous = os.stat(filename)
+                except FileNotFoundError:
+                    previous = None
+                success = cv2.imwrite(filename, image)
+                if success:
+                    manifest.record_write(filename, previous)
+                    print(f"Сохранено: {filename}")
+                else:
+                    print(f"Не удалось сохранить: {filename}")
+            except Exception as e:
+                success = False
+                print(f"Ошибка записи {filename}: {e}")
+
+            with self._condition:
+                if session == self._session:
+                    if success:
+                        self.saved += 1
+                    else:
+                        self.failed += 1
+                self._pending -= 1
+                idle = self._pending == 0
+                self._condition.notify_all()
+            if idle:
+                try:
+                    manifest.flush()
+                except OSError as e:
+                    print(f"Ошибка записи сводки набора данных: {e}")
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def wait_idle(self, timeout=None):
+        """Дождаться записи всех файлов из очереди, True если очередь пуста"""
+        with self._condition:
+            return self._condition.wait_for(lambda: self._pending == 0, timeout=timeout)
+
+    def status(self):
+        with self._condition:
+            return {
+                "directory": self.directory,
+                "enqueued": self.enqueued,
+                "saved": self.saved,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "pending": self._pending,
+            }
+
+
+_writer_lock = threading.Lock()
+
+
+def get_dataset_writer():
+    """Общий фоновый писатель набора данных"""
+    with _writer_lock:
+        if config.dataset_writer is None:
+            config.dataset_writer = DatasetWriter()
+        return config.dataset_writer
@@ -0,0 +1,105 @@
+import cv2
+import numpy as np
+
+from app import config
+
+
+def downscale(gray, scale):
+    """Уменьшенная копия кадра для обнаружения (scale <= 1)"""
+    if scale >= 1.0:
+        return gray
+    return cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+def _scaled_kwargs(scale, scaleFactor, minNeighbors, minSize, maxSize):
+    kwargs = {
+        "scaleFactor": scaleFactor,
+        "minNeighbors": minNeighbors,
+        "minSize": (max(1, int(minSize[0] * scale)), max(1, int(minSize[1] * scale))),
+        "flags": cv2.CASCADE_SCALE_IMAGE,
+    }
+    if maxSize:
+        kwargs["maxSize"] = (int(maxSize[0] * scale), int(maxSize[1] * scale))
+    return kwargs
+
+
+def _to_full_resolution(faces, scale, shape):
+    faces = np.round(np.asarray(faces, dtype=np.float32) / scale).astype(np.int32)
+    # Обрезка по границам полного кадра после обратного масштабирования
+    height, width = shape[:2]
+    faces[:, 2] = np.minimum(faces[:, 2], width - faces[:, 0])
+    faces[:, 3] = np.minimum(faces[:, 3], height - faces[:, 1])
+    return faces
+
+
+def _resolve_scale(cascade, scale, minSize):
+    """
+    Масштаб копии кадра: не меньше того, при котором minSize в уменьшенной копии
+    ещё не меньше окна каскада - иначе самые мелкие лица каскад не находит
+    """
+    if scale is None:
+        scale = config.cascade_params.get("detectionScale", 1.0)
+    window_width, window_height = cascade.getOriginalWindowSize()
+    scale = max(float(scale), 0.1, window_width / max(minSize[0], 1), window_height / max(minSize[1], 1))
+    return min(scale, 1.0)
+
+
+def detect_multiscale(cascade, gray, scale=None, scaleFactor=1.1, minNeighbors=5,
+                      minSize=(30, 30), maxSize=None):
+    """
+    detectMultiScale на уменьшенной копии кадра.
+    Прямоугольники возвращаются в координатах исходного изображения,
+    minSize/maxSize задаются тоже в исходных координатах; копия уменьшается
+    не сильнее, чем позволяет minSize (см. _resolve_scale)
+    """
+    scale = _resolve_scale(cascade, scale, minSize)
+    small = downscale(gray, scale)
+    faces = cascade.detectMultiScale(small, **_scaled_kwargs(scale, scaleFactor, minNeighbors, minSize, maxSize))
+    if len(faces) == 0:
+        return np.empty((0, 4), dtype=np.int32)
+    return _to_full_resolution(faces, scale, gray.shape)
+
+
+def detect_multiscale_weighted(cascade, gray, scale=None, scaleFactor=1.1, minNeighbors=3,
+                               minSize=(30, 30), maxSize=None):
+    """
+    detectMultiScale3 с outputRejectLevels: рамки и их веса (уверенность
+    последней стадии каскада) для слияния кандидатов через NMS
+    """
+    scale = _resolve_scale(cascade, scale, minSize)
+    small = downscale(gray, scale)
+    faces, _, weights = cascade.detectMultiScale3(
+        small, outputRejectLevels=True,
+        **_scaled_kwargs(scale, scaleFactor, minNeighbors, minSize, maxSize)
+    )
+    if len(faces) == 0:
+        return np.empty((0, 4), dtype=np.int32), np.empty(0, dtype=np.float32)
+    return _to_full_resolution(faces, scale, gray.shape), np.asarray(weights, dtype=np.float32).reshape(-1)
+
+
+def non_max_suppression(boxes, scores, overlap_threshold=0.5):
+    """
+    Векторизованное подавление немаксимумов: рамки перебираются по убыванию
+    веса, рамка отбрасывается, если её пересечение с уже оставленной больше
+    overlap_threshold от площади меньшей из двух. Возвращает индексы оставленных
+    """
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    boxes = np.asarray(boxes, dtype=np.float32)
+    x1, y1 = boxes[:, 0], boxes[:, 1]
+    x2, y2 = x1 + boxes[:, 2], y1 + boxes[:, 3]
+    areas = boxes[:, 2] * boxes[:, 3]
+
+    order = np.argsort(-np.asarray(scores, dtype=np.float32), kind="stable")
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        dx = np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest])
+        dy = np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest])
+        intersection = np.clip(dx, 0, None) * np.clip(dy, 0, None)
+        overlap = intersection / np.minimum(areas[i], areas[rest])
+        order = rest[overlap <= overlap_threshold]
+    return np.asarray(keep, dtype=np.int64)
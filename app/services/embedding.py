@@ -0,0 +1,136 @@
+import copy
+
+import cv2
+import numpy as np
+
+from app import config
+
+EMBEDDING_SIZE = 128
+
+
+def _face_recognition():
+    """face_recognition (dlib) импортируется только для этого бэкенда"""
+    try:
+        import face_recognition
+    except ImportError as e:
+        raise RuntimeError("face_recognition/dlib не установлены: pip install face-recognition") from e
+    return face_recognition
+
+
+def encode_faces(images):
+    """
+    128-мерные эмбеддинги dlib для кропов лиц (серых или BGR).
+    Кроп уже вырезан каскадом, поэтому рамкой лица считается весь кроп
+    """
+    face_recognition = _face_recognition()
+    model = config.embedding_params["landmarks"]
+    jitters = config.embedding_params["num_jitters"]
+    result = np.empty((len(images), EMBEDDING_SIZE), dtype=np.float32)
+    for index, image in enumerate(images):
+        if image.ndim == 2:
+            rgb = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+        else:
+            rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        height, width = rgb.shape[:2]
+        encoding = face_recognition.face_encodings(rgb, known_face_locations=[(0, width, height, 0)],
+                                                   num_jitters=jitters, model=model)
+        result[index] = encoding[0]
+    return result
+
+
+class EmbeddingRecognizer:
+    """
+    Распознавание по эмбеддингам face_recognition/dlib с интерфейсом модели
+    LBPH (train/update/predict/save/read). Галерея - матрица (N, 128) float32,
+    по одному эмбеддингу на образец или на человека (embedding_params["per_person"]),
+    поиск ближайшего - одно матрично-векторное произведение.
+
+    confidence, как у LBPH: меньше - лучше; евклидово расстояние масштабируется
+    так, что embedding_params["tolerance"] соответствует CONFIDENCE_THRESHOLD
+    """
+
+    def __init__(self):
+        self.gallery = np.empty((0, EMBEDDING_SIZE), dtype=np.float32)
+        self.labels = np.empty(0, dtype=np.int32)
+        self._sample_counts = np.empty(0, dtype=np.int64)
+        self._norms = np.empty(0, dtype=np.float32)
+
+    def _set_gallery(self, embeddings, labels, counts=None):
+        self.gallery = np.ascontiguousarray(embeddings, dtype=np.float32).reshape(-1, EMBEDDING_SIZE)
+        self.labels = np.asarray(labels, dtype=np.int32).reshape(-1)
+        self._sample_counts = (np.ones(len(self.labels), dtype=np.int64) if counts is None
+                               else np.asarray(counts, dtype=np.int64))
+        self._norms = np.einsum("ij,ij->i", self.gallery, self.gallery)
+
+    def train(self, images, labels):
+        self._set_gallery(np.empty((0, EMBEDDING_SIZE)), [])
+        self.update(images, labels)
+
+    def update(self, images, labels):
+        labels = np.asarray(labels, dtype=np.int32).reshape(-1)
+        if len(images) != len(labels):
+            raise ValueError("Число изображений и меток не совпадает")
+        if len(labels) == 0:
+            return
+        embeddings = encode_faces(images)
+        if not config.embedding_params["per_person"]:
+            self._set_gallery(np.vstack([self.gallery, embeddings]), np.concatenate([self.labels, labels]))
+            return
+
+        # Один усреднённый эмбеддинг на человека, с учётом уже накопленных образцов
+        sums = {int(l): self.gallery[i] * self._sample_counts[i] for i, l in enumerate(self.labels)}
+        counts = {int(l): int(self._sample_counts[i]) for i, l in enumerate(self.labels)}
+        for label in np.unique(labels):
+            mask = labels == label
+            sums[int(label)] = sums.get(int(label), 0) + embeddings[mask].sum(axis=0)
+            counts[int(label)] = counts.get(int(label), 0) + int(mask.sum())
+        order = sorted(sums)
+        self._set_gallery([sums[l] / counts[l] for l in order], order, [counts[l] for l in order])
+
+    def remove(self, labels):
+        """Удалить эмбеддинги людей с метками labels"""
+        keep = np.isin(self.labels, labels, invert=True)
+        if not keep.all():
+            self._set_gallery(self.gallery[keep], self.labels[keep], self._sample_counts[keep])
+
+    def copy(self):
+        """Копия для изменения в стороне: update/remove заменяют массивы, а не меняют их"""
+        return copy.copy(self)
+
+    def empty(self):
+        return len(self.labels) == 0
+
+    def predict_batch(self, images):
+        if len(images) == 0:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float64)
+        if self.empty():
+            raise ValueError("Модель не обучена")
+        query = encode_faces(images)
+        # |g - q|^2 = |g|^2 - 2 g.q + |q|^2 для всей галереи одним произведением
+        squared = self._norms[None, :] - 2.0 * (query @ self.gallery.T) + np.einsum("ij,ij->i", query, query)[:, None]
+        nearest = squared.argmin(axis=1)
+        distances = np.sqrt(np.maximum(squared[np.arange(len(query)), nearest], 0.0)).astype(np.float64)
+        scale = config.CONFIDENCE_THRESHOLD / config.embedding_params["tolerance"]
+        return self.labels[nearest].copy(), distances * scale
+
+    def predict(self, image):
+        labels, confidences = self.predict_batch([image])
+        return int(labels[0]), float(confidences[0])
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            np.savez(f, gallery=self.gallery, labels=self.labels, counts=self._sample_counts)
+
+    def read(self, path):
+        with np.load(path) as data:
+            self._set_gallery(data["gallery"], data["labels"], data["counts"])
+
+    def to_bundle(self):
+        """Массивы модели для бинарного файла (см. app.services.model_bundle)"""
+        return {"gallery": self.gallery, "labels": self.labels, "counts": self._sample_counts}, {}
+
+    @classmethod
+    def from_bundle(cls, arrays, params):
+        engine = cls()
+        engine._set_gallery(arrays["gallery"], arrays["labels"], arrays["counts"])
+        return engine
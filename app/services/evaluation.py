@@ -0,0 +1,366 @@
+"""
+Оценка точности распознавания без утечки: модель каждой части обучается
+только на кропах, которых нет в её тесте. Кропы каждого человека - соседние
+кадры видео, почти одинаковые, поэтому они делятся в порядке съёмки на k
+сплошных блоков (или один отложенный блок), части обучаются и проверяются
+параллельно в пуле процессов пакетным распознаванием. Результат - матрица
+ошибок, точность и полнота по людям и пропускная способность.
+
+    python -m app.services.evaluation
+    python -m app.services.evaluation --folds 10 --workers 4
+    python -m app.services.evaluation --holdout 0.2
+
+Процессы пула читают упакованный набор данных (app.services.dataset_cache)
+через memory-map, между процессами передаются только номера кропов.
+"""
+import argparse
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+import numpy as np
+
+from app import config
+from app.services import dataset_cache
+from app.services.dataset_manifest import get_dataset_manifest
+from app.services.lbph import predict_batch
+from app.services.training_jobs import TrainingJob
+
+# Кропы и метки набора данных в процессе пула (заполняются _init_worker)
+_samples = None
+_labels = None
+
+# Настройки, которые процесс пула (spawn) берёт из родительского процесса
+_WORKER_SETTINGS = ("DATASET_DIR", "DATASET_CACHE_DIR", "DATASET_CACHE_MMAP", "DATASET_LOAD_WORKERS", "IMAGE_SIZE",
+                    "MODEL_BACKEND", "CONFIDENCE_THRESHOLD", "lbph_params", "embedding_params")
+_PREDICT_CHUNK = 256
+
+
+def _capture_index(filename):
+    """Номер кадра сбора по имени файла (<номер>.png), файлы с другими именами - в конце"""
+    stem = os.path.splitext(filename)[0]
+    return (int(stem), "") if stem.isdigit() else (float("inf"), filename)
+
+
+def load_samples(subdirs, expected_counts=None):
+    """
+    Кропы людей subdirs списком видов в упакованный кеш (без копирования),
+    их метки - номера в subdirs - и порядковые номера кропов в порядке съёмки
+    внутри человека (кеш хранит файлы по имени, а не по номеру кадра)
+    """
+    people = dataset_cache.load_people(subdirs)
+    counts = [len(people[subdir]) for subdir in subdirs]
+    if expected_counts is not None and counts != list(expected_counts):
+        raise ValueError("Набор данных изменился во время оценки")
+    samples = [image for subdir in subdirs for image in people[subdir]]
+    positions = []
+    for subdir, count in zip(subdirs, counts):
+        files = dataset_cache.cached_files(subdir) if count else []
+        order = sorted(range(count), key=lambda i: _capture_index(files[i]))
+        position = np.empty(count, dtype=np.int64)
+        position[order] = np.arange(count)
+        positions.append(position)
+    positions = np.concatenate(positions) if positions else np.empty(0, dtype=np.int64)
+    return samples, np.repeat(np.arange(len(subdirs)), counts).astype(np.int32), positions
+
+
+def make_splits(labels, folds=5, holdout=None, seed=0, positions=None):
+    """
+    Стратифицированное разбиение [(обучение, тест)] номеров кропов. Кропы
+    каждого человека упорядочиваются по positions (порядок съёмки) и делятся
+    на folds сплошных блоков соседних кадров - почти одинаковые соседи тестового
+    кадра не попадают в обучение, кроме кадров на границе блока. seed задаёт,
+    какой блок в какой части. При holdout тест - последние по времени кадры
+    человека, их доля holdout. Человек с одним кропом участвует только в обучении
+    """
+    rng = np.random.default_rng(seed)
+    if positions is None:
+        positions = np.arange(len(labels))
+    parts = 1 if holdout else folds
+    assignment = np.full(len(labels), -1)  # часть, в тесте которой кроп
+    for label in np.unique(labels):
+        indices = np.flatnonzero(labels == label)
+        indices = indices[np.argsort(positions[indices], kind="stable")]
+        if len(indices) < 2:
+            continue
+        if holdout:
+            assignment[indices[-min(len(indices) - 1, max(1, round(len(indices) * holdout))):]] = 0
+        else:
+            for part, block in zip(rng.permutation(folds), np.array_split(indices, folds)):
+                assignment[block] = part
+    return [(np.flatnonzero(assignment != part), np.flatnonzero(assignment == part)) for part in range(parts)]
+
+
+def _init_worker(subdirs, counts, settings):
+    """Инициализация процесса пула: настройки родителя и набор данных (memory-map)"""
+    global _samples, _labels
+
+    # Параллелизм даёт пул процессов, внутренние потоки OpenCV только мешают
+    cv2.setNumThreads(1)
+    for name, value in settings.items():
+        setattr(config, name, value)
+    _samples, _labels, _ = load_samples(subdirs, counts)
+
+
+def _run_fold(part, train, test):
+    """Обучить модель на кропах train и распознать кропы test"""
+    from app.services.models import create_model
+
+    model = create_model()
+    started = time.perf_counter()
+    model.train([_samples[i] for i in train], _labels[train])
+    train_seconds = time.perf_counter() - started
+
+    predicted = np.empty(len(test), dtype=np.int32)
+    confidences = np.empty(len(test), dtype=np.float64)
+    started = time.perf_counter()
+    for first in range(0, len(test), _PREDICT_CHUNK):
+        chunk = test[first:first + _PREDICT_CHUNK]
+        results = predict_batch(model, [_samples[i] for i in chunk])
+        predicted[first:first + len(chunk)] = [label for label, _ in results]
+        confidences[first:first + len(chunk)] = [confidence for _, confidence in results]
+    predict_seconds = time.perf_counter() - started
+    return part, test, predicted, confidences, train_seconds, predict_seconds
+
+
+def _summary(subdirs, labels, folds_results, threshold, wall_seconds, workers):
+    """Матрица ошибок, точность и полнота по людям и пропускная способность"""
+    people = len(subdirs)
+    # Последний столбец - «неизвестный»: уверенность не прошла порог
+    confusion = np.zeros((people, people + 1), dtype=np.int64)
+    nearest_correct = 0
+    train_seconds = predict_seconds = 0.0
+    for _, test, predicted, confidences, fold_train, fold_predict in folds_results:
+        truth = labels[test]
+        accepted = (confidences < threshold) & (predicted >= 0) & (predicted < people)
+        np.add.at(confusion, (truth, np.where(accepted, predicted, people)), 1)
+        nearest_correct += int(np.sum(predicted == truth))
+        train_seconds += fold_train
+        predict_seconds += fold_predict
+
+    total = int(confusion.sum())
+    correct = np.diag(confusion[:, :people])
+    support = confusion.sum(axis=1)
+    predicted_as = confusion[:, :people].sum(axis=0)
+    names = [config.original_names.get(subdir, subdir) for subdir in subdirs]
+
+    per_person = []
+    for index, subdir in enumerate(subdirs):
+        per_person.append({
+            "name": names[index],
+            "directory": subdir,
+            "support": int(support[index]),
+            "correct": int(correct[index]),
+            "precision": float(correct[index] / predicted_as[index]) if predicted_as[index] else None,
+            "recall": float(correct[index] / support[index]) if support[index] else None,
+        })
+
+    # Самые частые ошибки, включая отказы («неизвестный»)
+    errors = confusion.copy()
+    errors[np.arange(people), np.arange(people)] = 0
+    count = min(20, errors.size)
+    top = np.argpartition(errors, -count, axis=None)[-count:]
+    top = top[np.argsort(errors.ravel()[top])[::-1]]
+    top_confusions = [{"true": names[t], "predicted": names[p] if p < people else "Неизвестный",
+                       "count": int(errors[t, p])}
+                      for t, p in zip(*np.unravel_index(top, errors.shape)) if errors[t, p]]
+
+    result = {
+        "people": people,
+        "total_tests": total,
+        "correct_predictions": int(correct.sum()),
+        "overall_accuracy": float(correct.sum() / total) if total else 0.0,
+        "nearest_accuracy": nearest_correct / total if total else 0.0,  # без учёта порога
+        "unknown_rate": float(confusion[:, people].sum() / total) if total else 0.0,
+        "false_accept_rate": float((predicted_as.sum() - correct.sum()) / total) if total else 0.0,
+        "confidence_threshold": threshold,
+        "per_person": per_person,
+        "top_confusions": top_confusions,
+        "throughput": {
+            "workers": workers,
+            "wall_seconds": round(wall_seconds, 3),
+            "train_seconds": round(train_seconds, 3),
+            "predict_seconds": round(predict_seconds, 3),
+            # кропов в секунду на один процесс и всего за время оценки
+            "predict_per_second": round(total / predict_seconds, 1) if predict_seconds else None,
+            "tests_per_wall_second": round(total / wall_seconds, 1) if wall_seconds else None,
+        },
+    }
+    # Полная матрица - только для небольшого числа людей
+    if people <= config.evaluation_params["dense_confusion_max_people"]:
+        result["confusion"] = {"labels": names + ["Неизвестный"], "matrix": confusion.tolist()}
+    return result
+
+
+def evaluate(folds=None, holdout=None, workers=None, seed=None, progress=None):
+    """
+    Оценить точность бэкенда config.MODEL_BACKEND на собранном наборе данных.
+    progress(**поля) получает stage и folds_done/folds_total
+    """
+    global _samples, _labels
+    params = config.evaluation_params
+    folds = folds or params["folds"]
+    holdout = params["holdout"] if holdout is None else holdout
+    seed = params["seed"] if seed is None else seed
+    if holdout is not None and not 0 < holdout < 1:
+        raise ValueError("Доля тестовых кропов holdout должна быть между 0 и 1")
+    if not holdout and folds < 2:
+        raise ValueError("Нужно не меньше двух частей")
+    started = time.perf_counter()
+    if progress is not None:
+        progress(stage="loading")
+
+    # Дожидаемся записи кропов, которые ещё в очереди фонового писателя
+    if config.dataset_writer is not None and not config.dataset_writer.wait_idle(timeout=30):
+        print("ВНИМАНИЕ: часть собранных изображений ещё не записана на диск")
+    manifest = get_dataset_manifest()
+    manifest.reconcile()
+    subdirs = sorted(name for name, entry in manifest.people().items() if entry["count"])
+    # Кеш упаковывается здесь один раз, процессы пула только открывают его
+    samples, labels, positions = load_samples(subdirs)
+    if len(samples) == 0:
+        raise ValueError("Данные для обучения не найдены")
+    counts = np.bincount(labels, minlength=len(subdirs)).tolist()
+
+    splits = make_splits(labels, folds, holdout, seed, positions)
+    workers = max(1, min(len(splits), workers or params["workers"] or os.cpu_count() or 1))
+    if progress is not None:
+        progress(stage="evaluating", folds_done=0, folds_total=len(splits), images_total=len(samples))
+
+    results = []
+    if workers == 1:
+        _samples, _labels = samples, labels
+        try:
+            for part, (train, test) in enumerate(splits):
+                results.append(_run_fold(part, train, test))
+                if progress is not None:
+                    progress(folds_done=len(results))
+        finally:
+            _samples = _labels = None
+    else:
+        settings = {name: getattr(config, name) for name in _WORKER_SETTINGS}
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(subdirs, counts, settings)) as pool:
+            futures = [pool.submit(_run_fold, part, train, test) for part, (train, test) in enumerate(splits)]
+            for future in as_completed(futures):
+                results.append(future.result())
+                if progress is not None:
+                    progress(folds_done=len(results))
+
+    results.sort(key=lambda item: item[0])
+    summary = _summary(subdirs, labels, results, config.CONFIDENCE_THRESHOLD,
+                       time.perf_counter() - started, workers)
+    summary.update(backend=config.MODEL_BACKEND, folds=len(splits), holdout=holdout or None)
+    return summary
+
+
+class EvaluationJob(TrainingJob):
+    """Задание оценки точности: параметры evaluate и результат"""
+
+    def __init__(self, params):
+        super().__init__()
+        self.operations = [("evaluate", None)]
+        self.params = params
+        self.result = None
+
+    def _eta(self):
+        if self.status != "running":
+            return None
+        done, total = self.progress.get("folds_done"), self.progress.get("folds_total")
+        if done and total:
+            return (time.time() - self.started_at) / done * (total - done)
+        return None
+
+    def to_dict(self):
+        data = super().to_dict()
+        data.update(params=self.params, result=self.result)
+        return data
+
+
+class EvaluationRunner:
+    """
+    Оценки точности в фоне, по одной: каждая и так занимает все ядра.
+    Обучение и распознавание всё это время работают как обычно -
+    оценка обучает свои модели и не трогает опубликованную
+    """
+
+    def __init__(self, history=None):
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._history = history or config.TRAINING_JOB_HISTORY
+
+    def submit(self, **params):
+        job = EvaluationJob(params)
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self._history:
+                self._jobs.popitem(last=False)
+        threading.Thread(target=self._run, args=(job,), name="evaluation", daemon=True).start()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job):
+        with self._run_lock:
+            job.status, job.started_at = "running", time.time()
+            try:
+                job.result = evaluate(progress=job.report, **job.params)
+                job.success = True
+                job.message = (f"Точность {job.result['overall_accuracy'] * 100:.1f}% "
+                               f"на {job.result['total_tests']} тестах")
+            except Exception as e:
+                job.success, job.message = False, f"Ошибка оценки: {e}"
+            job.status = "done" if job.success else "failed"
+            job.finished_at = time.time()
+        print(f"Оценка точности {job.id}: {job.message}")
+
+
+_runner_lock = threading.Lock()
+
+
+def get_evaluation_runner():
+    """Общий исполнитель оценок точности"""
+    with _runner_lock:
+        if config.evaluation_runner is None:
+            config.evaluation_runner = EvaluationRunner()
+        return config.evaluation_runner
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Оценка точности распознавания (k-fold)")
+    parser.add_argument("--folds", type=int, default=None, help="число частей k-fold")
+    parser.add_argument("--holdout", type=float, default=None, help="доля тестовых кропов человека вместо k-fold")
+    parser.add_argument("--workers", type=int, default=None, help="процессов пула (по умолчанию - по числу ядер)")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    try:
+        result = evaluate(args.folds, args.holdout, args.workers, args.seed)
+    except ValueError as e:
+        print(e)
+        return 1
+    throughput = result["throughput"]
+    print(f"Бэкенд: {result['backend']}, частей: {result['folds']}, людей: {result['people']}, "
+          f"тестов: {result['total_tests']}")
+    print(f"Точность: {result['overall_accuracy']:.3f} (без порога: {result['nearest_accuracy']:.3f}), "
+          f"неизвестные: {result['unknown_rate']:.3f}, ложные принятия: {result['false_accept_rate']:.3f}")
+    print(f"Процессов: {throughput['workers']}, время: {throughput['wall_seconds']:.2f} с, "
+          f"распознавание: {throughput['predict_per_second']} кропов/с на процесс")
+    print(f"{'человек':>20} {'тестов':>7} {'точность':>9} {'полнота':>8}")
+    for person in result["per_person"]:
+        precision = "-" if person["precision"] is None else f"{person['precision']:.3f}"
+        recall = "-" if person["recall"] is None else f"{person['recall']:.3f}"
+        print(f"{person['name']:>20} {person['support']:7d} {precision:>9} {recall:>8}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
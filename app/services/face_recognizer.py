@@ -3,8 +3,21 @@ import numpy as np
 import os
 import json
 from app import config
+from app.services.detection import detect_multiscale_weighted, non_max_suppression
+from app.services.preprocessing import FrameContext, enhance, to_gray
+from app.services.lbph import predict_batch
+from app.utils.metrics import stage_timer, LBPH_PREDICTIONS_TOTAL
 
 class FaceRecognizer:
+    # Прежние наборы параметров каскада в прежнем порядке; при
+    # config.upload_detection_params["passes"] > 1 используются первые passes из них,
+    # при passes = 1 - один проход с параметрами из upload_detection_params
+    DETECTION_PASSES = [
+        {'scaleFactor': 1.05, 'minNeighbors': 5, 'minSize': (30, 30)},
+        {'scaleFactor': 1.1, 'minNeighbors': 3, 'minSize': (40, 40)},
+        {'scaleFactor': 1.2, 'minNeighbors': 7, 'minSize': (50, 50)}
+    ]
+
     def __init__(self):
         self.model_file = 'face_model.pkl'
 
@@ -13,37 +26,22 @@ class FaceRecognizer:
         self._initialize_cascades()
     
     def _initialize_cascades(self):
-        """Инициализация всех каскадов для обнаружения лиц и особенностей"""
+        """Каскады лиц и глаз общие для всей системы и загружаются один раз (подсистема cascades)"""
+        from app.services.subsystems import get_subsystems
+
+        get_subsystems().ensure("cascades")
         # Основной каскад для лиц
-        if os.path.exists(config.HAAR_FILE):
-            config.face_cascade = cv2.CascadeClassifier(config.HAAR_FILE)
-        else:
+        if config.face_cascade is None or config.face_cascade.empty():
             raise FileNotFoundError(f"Haar cascade file {config.HAAR_FILE} не найден")
         
         # Каскад для глаз (для верификации лиц)
-        eye_cascade_path = config.EYE_FILE
-        if os.path.exists(eye_cascade_path):
-            config.eye_cascade = cv2.CascadeClassifier(eye_cascade_path)
-        else:
+        if config.eye_cascade is None or config.eye_cascade.empty():
             print("Предупреждение: каскад для глаз не найден, верификация лиц отключена")
             config.eye_cascade = None
     
     def _enhance_image_quality(self, image):
-        """Улучшение качества изображения для лучшего обнаружения"""
-        # Гистограммная эквализация
-        if len(image.shape) == 3:
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        else:
-            gray = image
-        
-        # Контрастное ограниченное адаптивное выравнивание гистограммы (CLAHE)
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-        enhanced = clahe.apply(gray)
-        
-        # Медианный фильтр для уменьшения шума
-        denoised = cv2.medianBlur(enhanced, 3)
-        
-        return denoised
+        """Улучшение качества изображения для лучшего обнаружения (CLAHE + медианный фильтр)"""
+        return enhance(to_gray(image))
     
     def _verify_face(self, gray_image, face_rect):
         """Верификация что обнаруженный объект действительно является лицом"""
@@ -70,57 +68,54 @@ class FaceRecognizer:
         
         return True  # Если каскад глаз не доступен, принимаем все обнаружения
     
-    def _detect_faces_advanced(self, frame):
-        """Расширенное обнаружение лиц с несколькими техниками"""
-        # Улучшение качества изображения
-        enhanced = self._enhance_image_quality(frame)
-        
-        # Обнаружение лиц с разными параметрами
-        faces = []
-        
-        # Попробуем несколько комбинаций параметров
-        param_combinations = [
-            {'scaleFactor': 1.05, 'minNeighbors': 5, 'minSize': (30, 30)},
-            {'scaleFactor': 1.1, 'minNeighbors': 3, 'minSize': (40, 40)},
-            {'scaleFactor': 1.2, 'minNeighbors': 7, 'minSize': (50, 50)}
-        ]
-        
-        for params in param_combinations:
-            detected_faces = config.face_cascade.detectMultiScale(
+    def _detect_faces_advanced(self, frame, context=None):
+        """
+        Обнаружение лиц: до upload_detection_params["passes"] проходов каскада
+        (по умолчанию один быстрый проход), кандидаты всех проходов сливаются векторизованным
+        NMS по весам detectMultiScale3, глаза проверяются только у оставшихся.
+        Как и прежде, рамка без глаз не подавляет пересекающиеся с ней: она
+        исключается, и NMS повторяется по остальным кандидатам
+        """
+        # Улучшенный кадр считается один раз и переиспользуется распознаванием
+        if context is None:
+            context = FrameContext(frame)
+        enhanced = context.enhanced
+
+        passes = min(max(int(config.upload_detection_params.get("passes", 1)), 1), len(self.DETECTION_PASSES))
+        if passes == 1:
+            detection_passes = [config.upload_detection_params]
+        else:
+            detection_passes = self.DETECTION_PASSES[:passes]
+        boxes, scores = [], []
+        for params in detection_passes:
+            # Обнаружение на уменьшенной копии, верификация по полному разрешению
+            detected, weights = detect_multiscale_weighted(
+                config.face_cascade,
                 enhanced,
                 scaleFactor=params['scaleFactor'],
                 minNeighbors=params['minNeighbors'],
                 minSize=params['minSize']
             )
-            
-            for face in detected_faces:
-                # Верификация лица
-                if self._verify_face(enhanced, face):
-                    # Проверяем дубликаты (перекрывающиеся прямоугольники)
-                    is_duplicate = False
-                    for existing_face in faces:
-                        # Проверка пересечения прямоугольников
-                        x1, y1, w1, h1 = existing_face
-                        x2, y2, w2, h2 = face
-                        
-                        # Вычисляем площадь пересечения
-                        dx = min(x1 + w1, x2 + w2) - max(x1, x2)
-                        dy = min(y1 + h1, y2 + h2) - max(y1, y2)
-                        
-                        if dx > 0 and dy > 0:
-                            intersection = dx * dy
-                            area1 = w1 * h1
-                            area2 = w2 * h2
-                            
-                            # Если пересечение значительное, пропускаем дубликат
-                            if intersection > min(area1, area2) * 0.5:
-                                is_duplicate = True
-                                break
-                    
-                    if not is_duplicate:
-                        faces.append(face)
-        
-        return np.array(faces)
+            boxes.append(detected)
+            scores.append(weights)
+
+        boxes = np.concatenate(boxes)
+        scores = np.concatenate(scores)
+        overlap = config.upload_detection_params.get("overlapThreshold", 0.5)
+        candidates = np.arange(len(boxes))
+        verified = {}
+
+        with stage_timer("eye_verification"):
+            while True:
+                keep = candidates[non_max_suppression(boxes[candidates], scores[candidates], overlap)]
+                for i in keep:
+                    if i not in verified:
+                        verified[i] = self._verify_face(enhanced, boxes[i])
+                rejected = [i for i in keep if not verified[i]]
+                if not rejected:
+                    break
+                candidates = np.setdiff1d(candidates, rejected)
+        return np.array([boxes[i] for i in keep])
     
     def _align_face(self, face_image, eyes=None):
         """Выравнивание лица по глазам"""
@@ -153,7 +148,7 @@ class FaceRecognizer:
     
     def recognize_face(self, face_image):
         """Распознавание лица на изображении"""
-        if config.model is None:
+        if config.model_snapshot is None:
             return None, 0
         
         # Улучшение качества и подготовка изображения
@@ -161,36 +156,56 @@ class FaceRecognizer:
         
         # Изменение размера
         face_resized = cv2.resize(enhanced, config.IMAGE_SIZE)
-        
-        # Распознавание
-        label, confidence = config.model.predict(face_resized)
+        return self._predict(face_resized)
+    
+    def _predict(self, face_resized):
+        """Распознавание уже улучшенного лица размера IMAGE_SIZE"""
+        snapshot = config.model_snapshot
+        if snapshot is None:
+            return None, 0
+        return self._predict_batch([face_resized], snapshot)[0]
+    
+    def _predict_batch(self, faces_resized, snapshot=None):
+        """Распознавание набора лиц одним вызовом (NumPy LBPH считает их пакетом) по одному снимку модели"""
+        if not faces_resized:
+            return []
+        snapshot = snapshot or config.model_snapshot
+        with stage_timer("lbph_predict"):
+            predictions = predict_batch(snapshot.model, faces_resized)
+        LBPH_PREDICTIONS_TOTAL.inc(len(faces_resized))
         
         # Возвращаем результат
-        if confidence < config.CONFIDENCE_THRESHOLD:
-            return config.names.get(label, "Неизвестно"), confidence
-        else:
-            return "Не распознан", confidence
+        results = []
+        for label, confidence in predictions:
+            if confidence < snapshot.confidence_threshold:
+                results.append((snapshot.names.get(label, "Неизвестно"), confidence))
+            else:
+                results.append(("Не распознан", confidence))
+        return results
     
     def recognize_faces_in_frame(self, frame):
         """Распознавание всех лиц в кадре с улучшенным обнаружением"""
         if config.face_cascade is None:
             return frame, []
         
-        # Используем расширенное обнаружение лиц
-        faces = self._detect_faces_advanced(frame)
+        # Серое и улучшенное изображения общие для обнаружения, проверки глаз и распознавания
+        context = FrameContext(frame)
+        faces = self._detect_faces_advanced(frame, context)
         
         results = []
         
-        for (x, y, w, h) in faces:
+        # Все лица кадра распознаются одним пакетом по кропам уже улучшенного кадра (до отрисовки рамок)
+        crops = [context.face(face, enhanced=True, size=config.IMAGE_SIZE) for face in faces]
+        snapshot = config.model_snapshot
+        if snapshot is not None:
+            predictions = self._predict_batch(crops, snapshot)
+        else:
+            predictions = [(None, 0)] * len(crops)
+        
+        for (x, y, w, h), (name, confidence) in zip(faces, predictions):
             # Рисуем прямоугольник вокруг лица
             cv2.rectangle(frame, (x, y), (x+w, y+h), (255, 0, 0), 2)
             
-            # Извлекаем лицо
-            face_roi = frame[y:y+h, x:x+w]
-            
-            # Распознаем лицо
-            name, confidence = self.recognize_face(face_roi)
-            
             # Определяем цвет текста в зависимости от уверенности
             if name != "Не распознан":
                 color = (0, 255, 0)  # Зеленый для распознанных
@@ -218,10 +233,15 @@ class FaceRecognizer:
     
     def get_model_info(self):
         """Получить информацию о модели"""
+        snapshot = config.model_snapshot
+        names = snapshot.names if snapshot is not None else {}
         info = {
-            'model_trained': config.model is not None,
-            'names_count': len(config.names),
-            'names': list(config.names.values()),
+            'model_trained': snapshot is not None,
+            'model_version': snapshot.version if snapshot is not None else None,
+            'model_backend': snapshot.backend if snapshot is not None else None,
+            'model_class': type(snapshot.model).__name__ if snapshot is not None else None,
+            'names_count': len(names),
+            'names': list(names.values()),
             'confidence_threshold': config.CONFIDENCE_THRESHOLD,
             'image_size': config.IMAGE_SIZE
         }
@@ -235,66 +255,6 @@ class FaceRecognizer:
                 pass
         
         return info
-    
-    def test_recognition_accuracy(self, test_images_per_person=5):
-        """Тестирование точности распознавания"""
-        if not os.path.exists(config.DATASET_DIR) or config.model is None:
-            print(f"[DEBUG] Dataset directory {config.DATASET_DIR} не найден")
-            return None
-        if config.model is None:
-            print("[DEBUG] Модель не загружена")
-            return None
-        
-        results = {}
-        total_tests = 0
-        correct_predictions = 0
-        
-        for person_name in os.listdir(config.DATASET_DIR):
-            person_path = os.path.join(config.DATASET_DIR, person_name)
-            if not os.path.isdir(person_path):
-                continue
-            
-            images = [f for f in os.listdir(person_path) 
-                     if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-            
-            # Берем случайные изображения для тестирования
-            test_images = np.random.choice(images, 
-                                         min(test_images_per_person, len(images)), 
-                                         replace=False)
-            
-            person_correct = 0
-            person_total = 0
-            
-            for img_file in test_images:
-                img_path = os.path.join(person_path, img_file)
-                img = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
-                
-                if img is not None:
-                    predicted_name, confidence = self.recognize_face(img)
-                    
-                    if predicted_name == person_name:
-                        person_correct += 1
-                        correct_predictions += 1
-                    
-                    person_total += 1
-                    total_tests += 1
-            
-            if person_total > 0:
-                accuracy = person_correct / person_total
-                results[person_name] = {
-                    'correct': person_correct,
-                    'total': person_total,
-                    'accuracy': accuracy
-                }
-        
-        overall_accuracy = correct_predictions / total_tests if total_tests > 0 else 0
-        
-        return {
-            'overall_accuracy': overall_accuracy,
-            'total_tests': total_tests,
-            'correct_predictions': correct_predictions,
-            'per_person': results
-        }
 
 if __name__ == "__main__":
     recognizer = FaceRecognizer()
@@ -0,0 +1,192 @@
+import itertools
+
+import cv2
+import numpy as np
+
+from app import config
+
+
+class Track:
+    """Отслеживаемое лицо со стабильным идентификатором"""
+
+    def __init__(self, track_id, bbox, eyes_detected):
+        self.id = track_id
+        self.bbox = np.array(bbox, dtype=np.float32)
+        self.eyes_detected = eyes_detected
+        self.points = None
+        self.missed = 0
+        self.age = 0
+        self.detected = True  # рамка обновлена обнаружением на последнем кадре
+        self.counted = False           # учтено в total_faces_detected
+        self.counted_identity = False  # учтено в known_faces или unknown_faces (раз за время жизни трека)
+        self.identity = None  # кеш распознавания, см. track_recognition.TrackIdentity
+
+    def rect(self, frame_shape):
+        """Целочисленный прямоугольник (x, y, w, h), обрезанный по кадру"""
+        x, y, w, h = self.bbox
+        x0 = int(max(0, round(x)))
+        y0 = int(max(0, round(y)))
+        x1 = int(min(frame_shape[1], round(x + w)))
+        y1 = int(min(frame_shape[0], round(y + h)))
+        return x0, y0, max(0, x1 - x0), max(0, y1 - y0)
+
+
+def _iou_matrix(boxes_a, boxes_b):
+    """Матрица IoU между двумя наборами прямоугольников (x, y, w, h)"""
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    ax1, ay1 = a[:, 0:1], a[:, 1:2]
+    ax2, ay2 = ax1 + a[:, 2:3], ay1 + a[:, 3:4]
+    bx1, by1 = b[:, 0], b[:, 1]
+    bx2, by2 = bx1 + b[:, 2], by1 + b[:, 3]
+
+    inter_w = np.clip(np.minimum(ax2, bx2) - np.maximum(ax1, bx1), 0, None)
+    inter_h = np.clip(np.minimum(ay2, by2) - np.maximum(ay1, by1), 0, None)
+    intersection = inter_w * inter_h
+    union = a[:, 2:3] * a[:, 3:4] + b[:, 2] * b[:, 3] - intersection
+    return intersection / np.maximum(union, 1e-6)
+
+
+class FaceTracker:
+    """
+    Режим «обнаружить, затем отслеживать»: каскад запускается раз в
+    detect_interval кадров или при потере сопровождения, а в промежутках
+    лица сопровождаются оптическим потоком Лукаса-Канаде по серому кадру
+    """
+
+    def __init__(self):
+        self.tracks = []
+        self._ids = itertools.count(1)
+        self._prev_gray = None
+        self._frames_since_detect = 0
+
+    def reset(self):
+        self.tracks = []
+        self._prev_gray = None
+        self._frames_since_detect = 0
+
+    def update(self, gray, detect, force_detection=False):
+        """
+        Обновить треки по новому серому кадру.
+        detect(gray) возвращает список ((x, y, w, h), eyes_detected)
+        """
+        params = config.tracking_params
+        if self._prev_gray is not None and self._prev_gray.shape != gray.shape:
+            self.reset()
+
+        need_detection = (
+            force_detection
+            or not params["enabled"]
+            or not self.tracks
+            or self._prev_gray is None
+            or self._frames_since_detect + 1 >= params["detect_interval"]
+        )
+
+        for track in self.tracks:
+            track.detected = False
+
+        if not need_detection:
+            need_detection = not self._follow(gray)
+
+        if need_detection:
+            self._associate(detect(gray), gray)
+            self._frames_since_detect = 0
+        else:
+            self._frames_since_detect += 1
+
+        for track in self.tracks:
+            track.age += 1
+        self._prev_gray = gray
+        return self.tracks
+
+    def _seed_points(self, track, gray):
+        x, y, w, h = track.rect(gray.shape)
+        if w < 8 or h < 8:
+            track.points = None
+            return
+        points = cv2.goodFeaturesToTrack(gray[y:y+h, x:x+w], maxCorners=30,
+                                         qualityLevel=0.01, minDistance=5)
+        if points is None:
+            track.points = None
+            return
+        track.points = points.reshape(-1, 1, 2) + np.array([x, y], dtype=np.float32)
+
+    def _follow(self, gray):
+        """Сдвиг треков оптическим потоком, False если сопровождение потеряно"""
+        min_points = config.tracking_params["min_points"]
+        lost = False
+
+        for track in self.tracks:
+            if track.points is None or len(track.points) < min_points:
+                lost = True
+                continue
+
+            new_points, status, _ = cv2.calcOpticalFlowPyrLK(
+                self._prev_gray, gray, track.points, None,
+                winSize=(15, 15), maxLevel=2
+            )
+            good = status.reshape(-1) == 1
+            if good.sum() < min_points:
+                lost = True
+                track.points = None
+                continue
+
+            old = track.points[good].reshape(-1, 2)
+            new = new_points[good].reshape(-1, 2)
+            dx, dy = np.median(new - old, axis=0)
+
+            # Масштаб по изменению разброса точек относительно их центра
+            old_spread = np.linalg.norm(old - old.mean(axis=0), axis=1)
+            new_spread = np.linalg.norm(new - new.mean(axis=0), axis=1)
+            valid = old_spread > 1e-3
+            scale = float(np.median(new_spread[valid] / old_spread[valid])) if valid.any() else 1.0
+
+            x, y, w, h = track.bbox
+            cx, cy = x + w / 2 + dx, y + h / 2 + dy
+            w, h = w * scale, h * scale
+            track.bbox = np.array([cx - w / 2, cy - h / 2, w, h], dtype=np.float32)
+            track.points = new.reshape(-1, 1, 2)
+
+            if len(track.points) < 2 * min_points:
+                self._seed_points(track, gray)
+
+        return not lost
+
+    def _associate(self, detections, gray):
+        """Сопоставление обнаружений с треками по IoU (жадно)"""
+        params = config.tracking_params
+        matched_tracks, matched_detections = set(), set()
+
+        if self.tracks and detections:
+            iou = _iou_matrix([t.bbox for t in self.tracks], [d[0] for d in detections])
+            for flat in np.argsort(iou, axis=None)[::-1]:
+                ti, di = (int(i) for i in np.unravel_index(flat, iou.shape))
+                if iou[ti, di] < params["iou_threshold"]:
+                    break
+                if ti in matched_tracks or di in matched_detections:
+                    continue
+                matched_tracks.add(ti)
+                matched_detections.add(di)
+
+                track = self.tracks[ti]
+                track.bbox = np.array(detections[di][0], dtype=np.float32)
+                track.eyes_detected = detections[di][1]
+                track.missed = 0
+                track.detected = True
+                self._seed_points(track, gray)
+
+        survivors = []
+        for ti, track in enumerate(self.tracks):
+            if ti not in matched_tracks:
+                track.missed += 1
+                if track.missed > params["max_missed"]:
+                    continue
+            survivors.append(track)
+
+        for di, (bbox, eyes_detected) in enumerate(detections):
+            if di not in matched_detections:
+                track = Track(next(self._ids), bbox, eyes_detected)
+                self._seed_points(track, gray)
+                survivors.append(track)
+
+        self.tracks = survivors
@@ -1,277 +1,271 @@
 import cv2
-import numpy as np
-import os
-from PIL import Image, ImageDraw, ImageFont
 import time
 
-from app.utils.transliterate import sanitize_filename, get_original_name
+from app.utils.transliterate import get_original_name
 from app.services.init_system import init_face_cascade
+from app.services.capture_worker import get_capture_worker
+from app.services.overlay import OverlayRenderer
+from app.services.detection import detect_multiscale
+from app.services.preprocessing import FrameContext
+from app.services.stream_encoder import ClientStream
+from app.services.dataset_writer import get_dataset_writer
+from app.services.actuator import get_actuator
+from app.services.face_tracker import FaceTracker
+from app.services.track_recognition import TrackRecognizer
+from app.utils.metrics import stage_timer, increment_stat, set_stat, FRAME_STAGE_SECONDS
 from app import config
 
-def draw_text_with_russian(frame, text, position, color=(0, 255, 0), font_size=20):
-    """
-    Рисует русский текст на кадре с использованием Pillow
-    """
-    # Конвертируем BGR (OpenCV) в RGB (Pillow)
-    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    pil_image = Image.fromarray(frame_rgb)
-    
-    # Создаем объект для рисования
-    draw = ImageDraw.Draw(pil_image)
-    
-    # Пытаемся найти подходящий шрифт с поддержкой кириллицы
-    font = None
-    font_paths = [
-        # Windows шрифты
-        "C:/Windows/Fonts/arial.ttf",
-        "C:/Windows/Fonts/tahoma.ttf",
-        "C:/Windows/Fonts/verdana.ttf",
-        # Linux шрифты
-        "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-        "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
-        # macOS шрифты
-        "/Library/Fonts/Arial.ttf",
-        "/System/Library/Fonts/Supplemental/Arial.ttf"
-    ]
-    
-    for font_path in font_paths:
-        try:
-            if os.path.exists(font_path):
-                font = ImageFont.truetype(font_path, font_size)
-                break
-        except:
-            continue
-    
-    # Если не нашли подходящий шрифт, используем стандартный (может не поддерживать кириллицу)
-    if font is None:
-        try:
-            font = ImageFont.truetype("arial.ttf", font_size)
-        except:
-            font = ImageFont.load_default()
-    
-    # Рисуем текст
-    draw.text(position, text, font=font, fill=color)
-    
-    # Конвертируем обратно в BGR
-    return cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
+overlay = OverlayRenderer()
+tracker = FaceTracker()
+track_recognizer = TrackRecognizer()
 
-def generate_frames():
-    """Генератор кадров для видео потока"""    
-    try:
-        if config.camera is None:
-            print("Инициализация камеры...")
-            for idx in range(3):
-                test_camera = cv2.VideoCapture(idx)
-                if test_camera.isOpened():
-                    ret, test_frame = test_camera.read()
-                    if ret and test_frame is not None:
-                        config.camera = test_camera
-                        print(f"Камера инициализирована по индексу {idx}")
-                        config.camera.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-                        config.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-                        config.camera.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-                        config.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-                        config.camera.set(cv2.CAP_PROP_FPS, 30)
-                        break
-                    else:
-                        test_camera.release()
-                else:
-                    test_camera.release()
+def detect_faces(gray):
+    """Полное обнаружение каскадом с проверкой глаз: список ((x, y, w, h), eyes_detected)"""
+    # Каскад работает на уменьшенной копии, рамки и ROI глаз - в полном разрешении
+    with stage_timer("detection"):
+        faces = detect_multiscale(
+            config.face_cascade,
+            gray,
+            scale=config.cascade_params["detectionScale"],
+            scaleFactor=config.cascade_params["scaleFactor"],
+            minNeighbors=config.cascade_params["minNeighbors"],
+            minSize=config.cascade_params["minSize"],
+            maxSize=config.cascade_params["maxSize"]
+        )
+    
+    detections = []
+    eyes_started = time.perf_counter()
+    for (x, y, w, h) in faces:
+        # Проверка наличия глаз в обнаруженном лице
+        eyes_detected = False
+        if config.eye_cascade and not config.eye_cascade.empty():
+            roi_gray = gray[y:y+h, x:x+w]
+            eyes = config.eye_cascade.detectMultiScale(roi_gray, 1.1, 3)
+            eyes_detected = len(eyes) > 0
             
-            if config.camera is None:
-                print("Ошибка: не удалось инициализировать камеру")
-                return
+            # Если требуется обязательное наличие глаз
+            if config.require_eyes_for_face and not eyes_detected:
+                continue  # Пропускаем это обнаружение лица
         
-    except Exception as e:
-        print(f"Ошибка камеры: {e}")
-        return
-    
-    frame_count = 0
-    
-    while True:
-        try:
-            success, frame = config.camera.read()
-            if not success or frame is None:
-                print("Не удалось прочитать кадр")
-                time.sleep(0.1)
+        detections.append(((int(x), int(y), int(w), int(h)), eyes_detected))
+    if len(faces):
+        FRAME_STAGE_SECONDS.observe(time.perf_counter() - eyes_started, "eye_verification")
+    return detections
+
+def process_frame(frame, frame_count):
+    """
+    Обнаружение, распознавание и отрисовка результатов на одном кадре.
+    Возвращает аннотированный кадр и список результатов по лицам
+    """
+    results = []
+    if config.face_cascade is None or config.face_cascade.empty():
+        overlay.clear_layer("stats")
+        overlay.clear_layer("status")
+        tracker.reset()
+        overlay.add_text("Каскад лиц не загружен - попытка перезагрузки...", (10, 30), (0, 0, 255), 20)
+        
+        if frame_count % 30 == 0:
+            print("Попытка повторной инициализации каскада лиц...")
+            init_face_cascade()
+    else:
+        # Один снимок модели на кадр: переобучение не меняет модель, имена и пороги посреди кадра
+        snapshot = config.model_snapshot
+        
+        # Серое изображение считается один раз и общее для трекера, каскадов и кропов лиц
+        context = FrameContext(frame)
+        gray = context.gray
+        
+        # Каскад запускается только на кадрах обнаружения, между ними лица сопровождаются трекером.
+        # При сборе данных обнаружение выполняется на каждом кадре, чтобы кадрирование было точным
+        tracks = tracker.update(gray, detect_faces, force_detection=config.is_collecting_data)
+        
+        if frame_count % 60 == 0:
+            print(f"Кадр {frame_count}: Обнаружено {len(tracks)} лиц")
+        
+        for track in tracks:
+            x, y, w, h = track.rect(gray.shape)
+            if w == 0 or h == 0:
                 continue
+            # При сборе данных сохраняются только лица, найденные (и проверенные по глазам)
+            # на этом кадре: рамки несопоставленных треков устарели и могут захватить фон
+            if config.is_collecting_data and not track.detected:
+                continue
+            # Статистика считает людей (треки), а не кадры
+            if not track.counted:
+                track.counted = True
+                increment_stat('total_faces_detected')
+            eyes_detected = track.eyes_detected
+            name, confidence = None, None
             
-            frame_count += 1
+            # Цвет рамки по умолчанию (красный для неизвестных)
+            box_color = (0, 0, 255)  # Красный по умолчанию
+            text_color = (255, 255, 255)
+            status_text = "НЕИЗВЕСТНЫЙ"
             
-            if config.face_cascade is None or config.face_cascade.empty():
-                frame = draw_text_with_russian(frame, "Каскад лиц не загружен - попытка перезагрузки...",
-                                             (10, 30), (0, 0, 255))
+            if config.is_collecting_data and config.collected_count < config.MAX_IMAGES:
+                face_resize = context.face((x, y, w, h), size=config.IMAGE_SIZE)
                 
-                if frame_count % 30 == 0:
-                    print("Попытка повторной инициализации каскада лиц...")
-                    init_face_cascade()
-            else:
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                # Запись на диск выполняет фоновый писатель, каталог задан в /start_collection
+                writer = get_dataset_writer()
+                if writer.submit(config.collected_count + 1, face_resize):
+                    config.collected_count += 1
                 
-                faces = config.face_cascade.detectMultiScale(
-                    gray,
-                    scaleFactor=config.cascade_params["scaleFactor"],
-                    minNeighbors=config.cascade_params["minNeighbors"],
-                    minSize=config.cascade_params["minSize"],
-                    maxSize=config.cascade_params["maxSize"],
-                    flags=cv2.CASCADE_SCALE_IMAGE
-                )
+                # Синяя рамка для сбора данных
+                box_color = (255, 0, 0)
+                status_text = f"Сбор данных: {writer.saved}/{config.MAX_IMAGES}"
                 
-                if frame_count % 60 == 0:
-                    print(f"Кадр {frame_count}: Обнаружено {len(faces)} лиц")
+                if config.collected_count >= config.MAX_IMAGES:
+                    config.is_collecting_data = False
+                    print(f"Коллекция завершена для {config.current_person_name}")
+            
+            elif snapshot is not None and not config.is_collecting_data:
+                face_resize = context.face((x, y, w, h), size=config.IMAGE_SIZE)
                 
-                for (x, y, w, h) in faces:
-                    config.recognition_stats['total_faces_detected'] += 1
-                    
-                    # Проверка наличия глаз в обнаруженном лице
-                    eyes_detected = False
-                    if config.eye_cascade and not config.eye_cascade.empty():
-                        roi_gray = gray[y:y+h, x:x+w]
-                        eyes = config.eye_cascade.detectMultiScale(roi_gray, 1.1, 3)
-                        eyes_detected = len(eyes) > 0
-                        
-                        # Если требуется обязательное наличие глаз
-                        if config.require_eyes_for_face and not eyes_detected:
-                            continue  # Пропускаем это обнаружение лица
-                    
-                    # Цвет рамки по умолчанию (красный для неизвестных)
-                    box_color = (0, 0, 255)  # Красный по умолчанию
-                    text_color = (255, 255, 255)
-                    status_text = "НЕИЗВЕСТНЫЙ"
+                try:
+                    # Повторный predict только периодически или при изменении лица, имя - по голосованию
+                    label, confidence = track_recognizer.recognize(track, face_resize, frame_count, snapshot.model)
+                    settled = track_recognizer.is_settled(track)
                     
-                    if config.is_collecting_data and config.collected_count < config.MAX_IMAGES:
-                        face_roi = gray[y:y+h, x:x+w]
-                        face_resize = cv2.resize(face_roi, config.IMAGE_SIZE)
-                        
-                        # Используем транслитерированное имя для директории
-                        sanitized_name = sanitize_filename(config.current_person_name)
-                        person_path = os.path.join(config.DATASET_DIR, sanitized_name)
-                        os.makedirs(person_path, exist_ok=True)
-                        
-                        filename = os.path.join(person_path, f"{config.collected_count + 1}.png")
+                    if confidence < snapshot.confidence_threshold:
+                        # Известное лицо - зеленая рамка
+                        sanitized_name = snapshot.names.get(label, 'Неизвестный')
+                        name = sanitized_name
+                        # Получаем оригинальное русское имя для отображения
+                        config.original_name = get_original_name(sanitized_name)
+                        status_text = f"{config.original_name}"
+                        box_color = (0, 255, 0)  # Зеленый
+                        text_color = (0, 0, 0)
+                        # Трек учитывается один раз - смена модели или голосования его не пересчитывает
+                        if settled and not track.counted_identity:
+                            track.counted_identity = True
+                            increment_stat('known_faces')
+                        set_stat('last_recognized', config.original_name)
+
+                        # Команда уходит через очередь с окном удержания на человека
+                        get_actuator().trigger(sanitized_name)
                         
-                        if cv2.imwrite(filename, face_resize):
-                            config.collected_count += 1
-                            print(f"Сохранено: {filename}")
+                        # Добавляем уровень уверенности
+                        confidence_text = f"Уверенность: {100-confidence:.0f}%"
+                        overlay.add_text(confidence_text, (x, y+h+20), (0, 255, 0), 14)
                         
-                        # Синяя рамка для сбора данных
-                        box_color = (255, 0, 0)
-                        status_text = f"Сбор данных: {config.collected_count}/{config.MAX_IMAGES}"
+                    elif confidence < snapshot.unknown_threshold:
+                        # Возможно знакомое лицо - желтая рамка
+                        sanitized_name = snapshot.names.get(label, 'Неизвестный')
+                        config.original_name = get_original_name(sanitized_name)
+                        status_text = f"{config.original_name}?"
+                        box_color = (0, 255, 255)  # Желтый
+                        text_color = (0, 0, 0)
                         
-                        if config.collected_count >= config.MAX_IMAGES:
-                            config.is_collecting_data = False
-                            print(f"Коллекция завершена для {config.current_person_name}")
-                    
-                    elif config.model is not None and not config.is_collecting_data:
-                        face_roi = gray[y:y+h, x:x+w]
-                        face_resize = cv2.resize(face_roi, config.IMAGE_SIZE)
-                        
-                        try:
-                            label, confidence = config.model.predict(face_resize)
-                            
-                            if confidence < config.CONFIDENCE_THRESHOLD:
-                                # Известное лицо - зеленая рамка
-                                sanitized_name = config.names.get(label, 'Неизвестный')
-                                # Получаем оригинальное русское имя для отображения
-                                config.original_name = get_original_name(sanitized_name)
-                                status_text = f"{config.original_name}"
-                                box_color = (0, 255, 0)  # Зеленый
-                                text_color = (0, 0, 0)
-                                config.recognition_stats['known_faces'] += 1
-                                config.recognition_stats['last_recognized'] = config.original_name
-
-                                try:
-                                    if config.serial_port and config.serial_port.is_open:
-                                        config.serial_port.write(b"SERVO:120\n")
-                                        print("Команда отправлена: SERVO:120")
-                                except Exception as e:
-                                    print(f"Ошибка отправки в Serial: {e}")
-                                
-                                # Добавляем уровень уверенности
-                                confidence_text = f"Уверенность: {100-confidence:.0f}%"
-                                frame = draw_text_with_russian(frame, confidence_text,
-                                                             (x, y+h+20), (0, 255, 0), 14)
-                                
-                            elif confidence < config.UNKNOWN_THRESHOLD:
-                                # Возможно знакомое лицо - желтая рамка
-                                sanitized_name = config.names.get(label, 'Неизвестный')
-                                config.original_name = get_original_name(sanitized_name)
-                                status_text = f"{config.original_name}?"
-                                box_color = (0, 255, 255)  # Желтый
-                                text_color = (0, 0, 0)
-                                
-                            else:
-                                # Неизвестное лицо - красная рамка
-                                status_text = "НЕИЗВЕСТНЫЙ"
-                                box_color = (0, 0, 255)  # Красный
-                                text_color = (255, 255, 255)
-                                config.recognition_stats['unknown_faces'] += 1
-                                
-                        except Exception as e:
-                            status_text = f"Ошибка: {str(e)[:15]}"
-                            box_color = (0, 0, 255)
-                            text_color = (255, 255, 255)
-                    
                     else:
-                        status_text = "Модель не обучена"
-                        box_color = (128, 128, 128)
+                        # Неизвестное лицо - красная рамка
+                        status_text = "НЕИЗВЕСТНЫЙ"
+                        box_color = (0, 0, 255)  # Красный
                         text_color = (255, 255, 255)
-                    
-                    # Добавляем информацию об обнаружении глаз
-                    if eyes_detected:
-                        status_text += " (глаза обнаружены)"
-                    else:
-                        status_text += " (глаза не обнаружены)"
-                    
-                    # Рисуем рамку с увеличенной толщиной
-                    cv2.rectangle(frame, (x, y), (x+w, y+h), box_color, 3)
-                    
-                    # Рисуем фон для текста
-                    text_width = len(status_text) * 10  # Примерная ширина текста
-                    cv2.rectangle(frame, (x, y-35), (x + text_width + 10, y), box_color, -1)
-                    
-                    # Рисуем текст статуса с поддержкой русского
-                    frame = draw_text_with_russian(frame, status_text, (x + 5, y - 30), text_color, 16)
-                
-                # Добавляем статистику на кадр
-                info_texts = [
-                    f"Всего лиц: {config.recognition_stats['total_faces_detected']}",
-                    f"Известных: {config.recognition_stats['known_faces']}",
-                    f"Неизвестных: {config.recognition_stats['unknown_faces']}"
-                ]
-                
-                if config.recognition_stats['last_recognized']:
-                    info_texts.append(f"Последний: {config.recognition_stats['last_recognized']}")
-                
-                for i, text in enumerate(info_texts):
-                    frame = draw_text_with_russian(frame, text, (10, 30 + i*25), (255, 255, 255), 16)
-                
-                # Статус системы
-                cascade_status = "Каскад лиц: ОК" if config.face_cascade and not config.face_cascade.empty() else "Каскад лиц: ОШИБКА"
-                eye_cascade_status = "Каскад глаз: ОК" if config.eye_cascade and not config.eye_cascade.empty() else "Каскад глаз: ОШИБКА"
-                model_status = "Модель: ОК" if config.model else "Модель: НЕ ОБУЧЕНА"
-                
-                frame = draw_text_with_russian(frame, cascade_status,
-                                             (10, frame.shape[0] - 75),
-                                             (0, 255, 0) if config.face_cascade and not config.face_cascade.empty() else (0, 0, 255),
-                                             14)
-                
-                frame = draw_text_with_russian(frame, eye_cascade_status,
-                                             (10, frame.shape[0] - 50),
-                                             (0, 255, 0) if config.eye_cascade and not config.eye_cascade.empty() else (0, 0, 255),
-                                             14)
-                
-                frame = draw_text_with_russian(frame, model_status,
-                                             (10, frame.shape[0] - 25),
-                                             (0, 255, 0) if config.model else (0, 0, 255),
-                                             14)
+                        if settled and not track.counted_identity:
+                            track.counted_identity = True
+                            increment_stat('unknown_faces')
+                        
+                except Exception as e:
+                    status_text = f"Ошибка: {str(e)[:15]}"
+                    box_color = (0, 0, 255)
+                    text_color = (255, 255, 255)
+            
+            else:
+                status_text = "Модель не обучена"
+                box_color = (128, 128, 128)
+                text_color = (255, 255, 255)
+            
+            # Добавляем информацию об обнаружении глаз
+            if eyes_detected:
+                status_text += " (глаза обнаружены)"
+            else:
+                status_text += " (глаза не обнаружены)"
+            
+            results.append({
+                'track_id': track.id,
+                'track_age': track.age,
+                'name': name,
+                'confidence': float(confidence) if confidence is not None else None,
+                'bbox': (x, y, w, h),
+                'recognized': name is not None,
+                'eyes_detected': eyes_detected
+            })
             
-            ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-            if ret:
-                frame_bytes = buffer.tobytes()
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+            # Рисуем рамку с увеличенной толщиной
+            cv2.rectangle(frame, (x, y), (x+w, y+h), box_color, 3)
             
-        except Exception as e:
-            print(f"Ошибка обработки кадра: {e}")
-            time.sleep(0.1)
\ No newline at end of file
+            # Рисуем фон для текста по реальной ширине надписи
+            text_width, _ = overlay.text_size(status_text, 16)
+            cv2.rectangle(frame, (x, y-35), (x + text_width + 10, y), box_color, -1)
+            
+            # Надпись статуса с поддержкой русского, накладывается вместе с остальными
+            overlay.add_text(status_text, (x + 5, y - 30), text_color, 16)
+        
+        # Добавляем статистику на кадр
+        info_texts = [
+            f"Всего лиц: {config.recognition_stats['total_faces_detected']}",
+            f"Известных: {config.recognition_stats['known_faces']}",
+            f"Неизвестных: {config.recognition_stats['unknown_faces']}"
+        ]
+        
+        if config.recognition_stats['last_recognized']:
+            info_texts.append(f"Последний: {config.recognition_stats['last_recognized']}")
+        
+        overlay.set_layer("stats", [
+            (text, (10, 30 + i*25), (255, 255, 255), 16) for i, text in enumerate(info_texts)
+        ])
+        
+        # Статус системы: слой перерисовывается только при смене состояния
+        face_ok = config.face_cascade is not None and not config.face_cascade.empty()
+        eye_ok = config.eye_cascade is not None and not config.eye_cascade.empty()
+        model_ok = snapshot is not None
+        height = frame.shape[0]
+        
+        overlay.set_layer("status", [
+            ("Каскад лиц: ОК" if face_ok else "Каскад лиц: ОШИБКА",
+             (10, height - 75), (0, 255, 0) if face_ok else (0, 0, 255), 14),
+            ("Каскад глаз: ОК" if eye_ok else "Каскад глаз: ОШИБКА",
+             (10, height - 50), (0, 255, 0) if eye_ok else (0, 0, 255), 14),
+            ("Модель: ОК" if model_ok else "Модель: НЕ ОБУЧЕНА",
+             (10, height - 25), (0, 255, 0) if model_ok else (0, 0, 255), 14),
+        ])
+
+    with stage_timer("overlay"):
+        frame = overlay.compose(frame)
+    return frame, results
+
+
+def generate_frames(max_fps=None, width=None, quality=None, worker=None):
+    """
+    Генератор кадров для видео потока: читает общий буфер потока захвата
+    (или процесса именованной камеры, если передан worker).
+    Кадры не копятся в очереди - клиент всегда получает самый свежий, а при
+    медленной отдаче понижается качество/разрешение его уровня
+    """
+    client = ClientStream(max_fps, width, quality)
+    worker = worker or get_capture_worker()
+    worker.broadcast.subscribe()
+    last_seq = 0
+    try:
+        while not worker.closed:
+            if not worker.is_alive():
+                worker.start()
+
+            client.wait_for_slot()
+            seq, frame, signature = worker.broadcast.wait_for_frame(last_seq, timeout=1.0)
+            if frame is None or seq == last_seq:
+                continue
+            last_seq = seq
+
+            tier = client.current_tier(frame.shape[1])
+            frame_bytes = worker.broadcast.encoders.get_jpeg(tier, seq, frame, signature)
+            if frame_bytes is None:
+                continue
+
+            # Время до возврата из yield - время записи кадра в сокет клиента
+            started = time.monotonic()
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+            client.on_sent(len(frame_bytes), time.monotonic() - started)
+    finally:
+        worker.broadcast.unsubscribe()
@@ -0,0 +1,30 @@
+"""
+Распознавание без веб-сервера, камер и Serial - для пакетных заданий и скриптов.
+Импорт не требует Flask и pyserial, загружаются только каскады и модель:
+
+    from app.services.inference import load_recognizer
+    recognizer = load_recognizer()
+    annotated, results = recognizer.recognize_faces_in_frame(cv2.imread("photo.jpg"))
+"""
+from app import config
+from app.services.subsystems import get_subsystems
+
+
+def init_headless():
+    """
+    Загрузить каскады и сохранённую модель (без переобучения, наблюдателя
+    за файлом модели и процессов камер). True, если модель загружена
+    """
+    from app.services.models import load_model
+
+    get_subsystems().ensure("cascades")
+    return config.model_snapshot is not None or load_model()
+
+
+def load_recognizer():
+    """FaceRecognizer с загруженными каскадами и моделью"""
+    from app.services.face_recognizer import FaceRecognizer
+
+    if not init_headless():
+        print("Модель не найдена. Требуется обучение.")
+    return FaceRecognizer()
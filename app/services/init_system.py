@@ -1,15 +1,21 @@
 from app import config
 from app.utils.download_cascade import download_and_load_cascade
 from app.utils.logs import save_logs
-from app.services.models import load_model, train_model
+from app.services.models import load_model, train_model, start_model_watcher, current_snapshot
+from app.services.dataset_manifest import get_dataset_manifest
 
 import os
+import threading
 import cv2
-import serial
 
 def init_serial():
+    # pyserial нужен только здесь: без него работают распознавание и пакетные задания
+    import serial
+
     try:
-        config.serial_port = serial.Serial(config.SERIAL_PORT, config.SERIAL_BAUD, timeout=1)
+        # serial_for_url понимает и пути устройств, и URL вида "loop://" для проверки без железа
+        config.serial_port = serial.serial_for_url(config.SERIAL_PORT, baudrate=config.SERIAL_BAUD,
+                                                   timeout=1, write_timeout=config.SERIAL_WRITE_TIMEOUT)
         print(f"Serial порт {config.SERIAL_PORT} открыт")
         return True
     except Exception as e:
@@ -101,11 +107,8 @@ def init_eye_cascade():
         return False
     
 
-def initialize_system():
-    """Инициализация системы при запуске"""    
-    print("Инициализация системы распознавания лиц...")
-
-    # Инициализация каскадов
+def init_cascades():
+    """Каскады лиц и глаз; без каскада глаз распознавание работает, без каскада лиц - нет"""
     if init_face_cascade():
         print("Каскад лиц успешно инициализирован")
     else:
@@ -115,30 +118,24 @@ def initialize_system():
         print("Каскад глаз успешно инициализирован")
     else:
         print("ВНИМАНИЕ: не удалось инициализировать каскад глаз")
-    
-    if init_serial():
-        print("Serial port успешно инициализирован")
-    else:
-        print("ВНИМАНИЕ: не удалось инициализировать Serial port")
-    
+    return config.face_cascade is not None and not config.face_cascade.empty()
+
+def init_model():
+    """Сверка набора данных, загрузка модели и, если данные изменились, переобучение"""
+    # Сводка набора данных: перечитываются только каталоги, изменённые с прошлого запуска
+    manifest = get_dataset_manifest()
+    rescanned = manifest.reconcile()
+    print(f"Сводка набора данных: людей {len(manifest.people())}, изображений {manifest.total_images()}, "
+          f"перечитано каталогов {len(rescanned)}")
+
     # Восстанавливаем оригинальные имена из существующих директорий
-    if os.path.exists(config.DATASET_DIR):
-        for subdir in os.listdir(config.DATASET_DIR):
-            subpath = os.path.join(config.DATASET_DIR, subdir)
-            if os.path.isdir(subpath):
-                # Если это транслитерированное имя, сохраняем его как есть
-                config.original_names[subdir] = subdir
+    for subdir in manifest.people():
+        # Если это транслитерированное имя, сохраняем его как есть
+        config.original_names[subdir] = subdir
     
     # Проверяем наличие данных для обучения
-    training_data_exists = False
-    if os.path.exists(config.DATASET_DIR):
-        for subdir in os.listdir(config.DATASET_DIR):
-            subpath = os.path.join(config.DATASET_DIR, subdir)
-            if os.path.isdir(subpath):
-                images = [f for f in os.listdir(subpath) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-                if images:
-                    training_data_exists = True
-                    break
+    current_data = manifest.hashes()
+    training_data_exists = bool(current_data)
     
     print(f"Существуют данные обучения: {training_data_exists}")
     
@@ -154,28 +151,72 @@ def initialize_system():
         else:
             print("✗ Не удалось обучить новую модель")
     elif training_data_exists and model_loaded:
-        # Проверяем, нужно ли переобучить модель
-        current_people = set()
-        if os.path.exists(config.DATASET_DIR):
-            for subdir in os.listdir(config.DATASET_DIR):
-                subpath = os.path.join(config.DATASET_DIR, subdir)
-                if os.path.isdir(subpath):
-                    images = [f for f in os.listdir(subpath) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-                    if images:
-                        current_people.add(subdir)
+        # Проверяем, нужно ли переобучить модель: сравниваем сводку с метаданными модели
+        snapshot = current_snapshot()
+        current_people = set(current_data)
+        model_people = set(snapshot.names.values())
+        # Хеш известен, если модель сохранена с ним (модели прежних версий - без хешей)
+        changed = sorted(name for name, value in current_data.items()
+                         if snapshot.dataset.get(name, value) != value)
         
-        model_people = set(config.names.values()) if config.names else set()
-        
-        if current_people != model_people:
-            print(f"Обнаружено несоответствие данных. Текущее: {current_people}, Model: {model_people}")
+        if current_people != model_people or changed:
+            print(f"Обнаружено несоответствие данных. Текущее: {current_people}, Model: {model_people}, "
+                  f"изменены: {changed}")
             print("Переобучение модели с обновленными данными...")
             if train_model():
                 print("✓ Модель успешно переобучена")
             else:
                 print("✗ Не удалось переобучить модель")
     
-    print(f"Система инициализирована. Модель готова: {config.model is not None}")
+    # Замена файла модели внешним процессом обучения подхватывается на лету
+    start_model_watcher()
+
+    print(f"Модель готова: {config.model is not None}")
     print(f"Люди в системе: {list(config.names.values()) if config.names else 'None'}")
     print(f"Исходное сопоставление имен: {config.original_names}")
+    # Модель может быть ещё не обучена - система всё равно готова собирать данные
+    return True
+
+def init_cameras():
+    """Процессы именованных камер: каждый загружает каскады и модель сам"""
+    if config.CAMERA_SOURCES:
+        from app.services.camera_manager import get_camera_manager
+        manager = get_camera_manager()
+        for camera_id, spec in config.CAMERA_SOURCES.items():
+            manager.add(camera_id, spec)
+        print(f"Запущены камеры: {list(config.CAMERA_SOURCES)}")
+    return True
+
+def register_subsystems(registry):
+    """Подсистемы и их загрузчики. Serial и камеры не обязательны: порт переподключается при отправке команды"""
+    registry.register("cascades", init_cascades)
+    registry.register("model", init_model)
+    registry.register("serial", init_serial, required=False)
+    registry.register("cameras", init_cameras, required=False)
+    return registry
+
+def _log_when_ready(registry):
+    registry.ensure("cascades", "model")
+    print("Создание лога")
+    save_logs()
+
+def initialize_system(background=None):
+    """
+    Инициализация системы при запуске. В режиме быстрого старта
+    (config.FAST_START) подсистемы загружаются в фоне, и сервер принимает
+    запросы сразу; готовность - /readyz
+    """
+    from app.services.subsystems import get_subsystems
+
+    print("Инициализация системы распознавания лиц...")
+    registry = get_subsystems()
+    if config.FAST_START if background is None else background:
+        registry.start_all()
+        print("Подсистемы загружаются в фоне")
+        threading.Thread(target=_log_when_ready, args=(registry,), name="init-log", daemon=True).start()
+        return
+
+    registry.load_all()
+    print(f"Система инициализирована. Модель готова: {config.model is not None}")
     print("Создание лога")
     save_logs()
\ No newline at end of file
@@ -0,0 +1,463 @@
+import copy
+import math
+
+import cv2
+import numpy as np
+
+from app import config
+
+_FLOAT_EPSILON = np.finfo(np.float32).eps
+# Запас буфера галереи при дописывании образцов (доля от заполненной части)
+_GROWTH = 1.25
+
+
+class _AppendBuffer:
+    """
+    Массив с запасом по оси axis, чтобы новые образцы дописывались без
+    копирования всей галереи. Копии модели делят буфер, дописывать на месте
+    может только та, чей вид кончается на заполненной части буфера
+    (остальные, например после отката, копируют данные в новый буфер)
+    """
+
+    def __init__(self, data, axis, used):
+        self.data = data
+        self.axis = axis
+        self.used = used
+
+    def _span(self, start, stop):
+        return (slice(None),) * self.axis + (slice(start, stop),)
+
+
+def _append_along(view, buffer, extra, axis):
+    """Вид view, дополненный extra по оси axis, и буфер, в котором он лежит"""
+    size, added = view.shape[axis], extra.shape[axis]
+    if (buffer is None or buffer.used != size or buffer.data.shape[axis] < size + added
+            or not np.may_share_memory(view, buffer.data)):
+        shape = list(view.shape)
+        shape[axis] = int((size + added) * _GROWTH) + 1
+        buffer = _AppendBuffer(np.empty(shape, dtype=view.dtype), axis, size)
+        buffer.data[buffer._span(0, size)] = view
+    buffer.data[buffer._span(size, size + added)] = extra
+    buffer.used = size + added
+    return buffer.data[buffer._span(0, size + added)], buffer
+
+
+class NumpyLBPH:
+    """
+    LBPH на NumPy с тем же интерфейсом, что у cv2.face.LBPHFaceRecognizer
+    (train/update/predict/save/read), и пакетным predict_batch.
+
+    LBP-коды и гистограммы считаются сразу для пакета кропов, галерея хранится
+    одной непрерывной float32 матрицей, расстояния хи-квадрат (HISTCMP_CHISQR_ALT,
+    как в OpenCV) от кропа считаются сразу до всех образцов галереи.
+    Файл модели совместим с OpenCV в обе стороны.
+
+    Для больших галерей (от config.lbph_params["index_min_identities"] людей)
+    поиск двухступенчатый: по центроидам людей выбираются candidate_identities
+    ближайших, точное расстояние считается только до их образцов
+    """
+
+    def __init__(self, radius=1, neighbors=8, grid_x=8, grid_y=8, threshold=float("inf")):
+        self.radius = radius
+        self.neighbors = neighbors
+        self.grid_x = grid_x
+        self.grid_y = grid_y
+        self.threshold = threshold
+        self._reset_gallery()
+
+    @property
+    def bins(self):
+        return self.grid_x * self.grid_y * (1 << self.neighbors)
+
+    def _reset_gallery(self):
+        self._set_gallery(np.empty((0, self.bins), dtype=np.float32), [])
+
+    def sample_histograms(self):
+        """Гистограммы образцов построчно (N, бины) независимо от раскладки галереи"""
+        return self.gallery if self.gallery_by_rows else self.gallery.T
+
+    def _set_gallery(self, histograms, labels):
+        """
+        histograms - (N, бины) построчно, как getHistograms() в OpenCV.
+        Столбцы галереи упорядочиваются по меткам, чтобы образцы одного
+        человека шли подряд (load_training_data уже выдаёт их в таком порядке).
+
+        Раскладка галереи зависит от режима поиска: при полном переборе
+        (бины x образцы) - из неё подряд читаются строки непустых бинов запроса;
+        при двухступенчатом (образцы x бины) - подряд читаются образцы кандидатов
+        """
+        histograms = np.asarray(histograms, dtype=np.float32).reshape(-1, self.bins)
+        labels = np.asarray(labels, dtype=np.int32).reshape(-1)
+        if np.any(np.diff(labels) < 0):
+            order = np.argsort(labels, kind="stable")
+            histograms, labels = histograms[order], labels[order]
+        self.labels = labels
+        self._build_index(histograms)
+        self._gallery_buffer = self._centroid_buffer = None
+
+        self.gallery_by_rows = self._index_enabled()
+        self.gallery = np.ascontiguousarray(histograms if self.gallery_by_rows else histograms.T)
+        self._gallery_sums = histograms.sum(axis=1, dtype=np.float64)
+
+    def _index_enabled(self, identities=None):
+        params = config.lbph_params
+        if identities is None:
+            identities = len(self.identities)
+        return params["candidate_identities"] > 0 and identities >= params["index_min_identities"]
+
+    def _identity_centroids(self, histograms, labels):
+        """Люди, диапазоны их строк и центроиды (бины x люди) для упорядоченных по меткам образцов"""
+        identities, starts, counts = np.unique(labels, return_index=True, return_counts=True)
+        centroids = np.empty((self.bins, len(identities)), dtype=np.float32)
+        # Блоками по людям, чтобы промежуточные суммы не занимали размер всей галереи
+        for first in range(0, len(identities), 256):
+            stop = min(first + 256, len(identities))
+            rows_stop = starts[stop] if stop < len(starts) else len(histograms)
+            sums = np.add.reduceat(histograms[starts[first]:rows_stop], starts[first:stop] - starts[first],
+                                   axis=0, dtype=np.float64)
+            centroids[:, first:stop] = (sums / counts[first:stop, None]).T
+        return identities, np.stack([starts, starts + counts], axis=1), centroids
+
+    def _build_index(self, histograms):
+        """
+        Первая ступень поиска: центроид (средняя гистограмма) каждого человека
+        и диапазон его столбцов в галерее
+        """
+        self.identities, self._identity_ranges, self.centroids = self._identity_centroids(histograms, self.labels)
+        self._centroid_sums = self.centroids.sum(axis=0, dtype=np.float64)
+
+    def _append_gallery(self, histograms, labels):
+        """
+        Дописать образцы людей с метками больше уже известных: центроиды,
+        суммы и диапазоны остальных людей не пересчитываются, а галерея
+        и центроиды дописываются в запас буфера без копирования
+        """
+        order = np.argsort(labels, kind="stable")
+        histograms, labels = histograms[order], labels[order]
+        identities, ranges, centroids = self._identity_centroids(histograms, labels)
+        offset = len(self.labels)
+        self.labels = np.concatenate([self.labels, labels])
+        self.identities = np.concatenate([self.identities, identities])
+        self._identity_ranges = np.concatenate([self._identity_ranges, ranges + offset])
+        self.centroids, self._centroid_buffer = _append_along(self.centroids, self._centroid_buffer, centroids, 1)
+        self._centroid_sums = np.concatenate([self._centroid_sums, centroids.sum(axis=0, dtype=np.float64)])
+        if self.gallery_by_rows:
+            self.gallery, self._gallery_buffer = _append_along(self.gallery, self._gallery_buffer, histograms, 0)
+        else:
+            self.gallery, self._gallery_buffer = _append_along(self.gallery, self._gallery_buffer, histograms.T, 1)
+        self._gallery_sums = np.concatenate([self._gallery_sums, histograms.sum(axis=1, dtype=np.float64)])
+
+    # -- признаки ----------------------------------------------------------
+
+    def _lbp_codes(self, images):
+        """Расширенный (круговой) LBP, повторяет elbp из OpenCV, images - (B, H, W) uint8"""
+        r = self.radius
+        src = images.astype(np.float32)
+        height, width = src.shape[1:]
+        center = src[:, r:height - r, r:width - r]
+        codes = np.zeros(center.shape, dtype=np.int32)
+
+        def shifted(dy, dx):
+            return src[:, r + dy:height - r + dy, r + dx:width - r + dx]
+
+        one = np.float32(1.0)
+        for n in range(self.neighbors):
+            x = np.float32(r * math.cos(2.0 * math.pi * n / float(self.neighbors)))
+            y = np.float32(-r * math.sin(2.0 * math.pi * n / float(self.neighbors)))
+            fx, fy = int(math.floor(x)), int(math.floor(y))
+            cx, cy = int(math.ceil(x)), int(math.ceil(y))
+            ty, tx = np.float32(y - fy), np.float32(x - fx)
+            w1, w2 = (one - tx) * (one - ty), tx * (one - ty)
+            w3, w4 = (one - tx) * ty, tx * ty
+
+            t = w1 * shifted(fy, fx) + w2 * shifted(fy, cx) + w3 * shifted(cy, fx) + w4 * shifted(cy, cx)
+            codes |= (((t > center) | (np.abs(t - center) < _FLOAT_EPSILON)).astype(np.int32) << n)
+        return codes
+
+    def _histograms_same_size(self, images):
+        codes = self._lbp_codes(images)
+        batch, height, width = codes.shape
+        cell_h, cell_w = height // self.grid_y, width // self.grid_x
+        patterns = 1 << self.neighbors
+        cells = self.grid_x * self.grid_y
+
+        # (B, grid_y, cell_h, grid_x, cell_w) -> номер ячейки для каждого кода
+        codes = codes[:, :cell_h * self.grid_y, :cell_w * self.grid_x]
+        codes = codes.reshape(batch, self.grid_y, cell_h, self.grid_x, cell_w)
+        cell_index = (np.arange(self.grid_y)[:, None, None, None] * self.grid_x
+                      + np.arange(self.grid_x)[None, None, :, None])
+        offsets = (np.arange(batch)[:, None, None, None, None] * cells + cell_index) * patterns
+        counts = np.bincount((codes + offsets).ravel(), minlength=batch * cells * patterns)
+        counts = counts.reshape(batch, cells * patterns)
+        return (counts * (1.0 / (cell_h * cell_w))).astype(np.float32)
+
+    def histograms(self, images):
+        """Пространственные LBP-гистограммы (N, grid_x*grid_y*2^neighbors) для набора кропов"""
+        images = [np.asarray(img, dtype=np.uint8) for img in images]
+        result = np.empty((len(images), self.bins), dtype=np.float32)
+        # Кропы разного размера обрабатываются пакетами одного размера
+        by_shape = {}
+        for index, img in enumerate(images):
+            by_shape.setdefault(img.shape, []).append(index)
+        for indices in by_shape.values():
+            result[indices] = self._histograms_same_size(np.stack([images[i] for i in indices]))
+        return result
+
+    # -- обучение ----------------------------------------------------------
+
+    def train(self, images, labels):
+        self._reset_gallery()
+        self.update(images, labels)
+
+    def update(self, images, labels):
+        """Добавить кропы в галерею без пересчёта уже известных"""
+        labels = np.asarray(labels, dtype=np.int32).reshape(-1)
+        if len(images) != len(labels):
+            raise ValueError("Число изображений и меток не совпадает")
+        if len(labels) == 0:
+            return
+        histograms = self.histograms(images)
+        # Новые люди (метки больше известных) дописываются в конец, если раскладка галереи не меняется
+        identities = len(self.identities) + len(np.unique(labels))
+        if (len(self.labels) and labels.min() > self.labels[-1]
+                and self._index_enabled(identities) == self.gallery_by_rows):
+            self._append_gallery(histograms, labels)
+            return
+        self._set_gallery(np.vstack([self.sample_histograms(), histograms]),
+                          np.concatenate([self.labels, labels]))
+
+    def remove(self, labels):
+        """Удалить образцы людей с метками labels, не пересчитывая остальных"""
+        removed = np.isin(self.identities, labels)
+        if not removed.any():
+            return
+        keep = np.isin(self.labels, labels, invert=True)
+        kept_identities = ~removed
+        if self._index_enabled(int(kept_identities.sum())) != self.gallery_by_rows:
+            self._set_gallery(self.sample_histograms()[keep], self.labels[keep])
+            return
+        self.labels = self.labels[keep]
+        self.gallery = self.gallery[keep] if self.gallery_by_rows else np.ascontiguousarray(self.gallery[:, keep])
+        self._gallery_sums = self._gallery_sums[keep]
+        self.identities = self.identities[kept_identities]
+        counts = np.diff(self._identity_ranges[kept_identities], axis=1).reshape(-1)
+        stops = np.cumsum(counts)
+        self._identity_ranges = np.stack([stops - counts, stops], axis=1)
+        self.centroids = np.ascontiguousarray(self.centroids[:, kept_identities])
+        self._centroid_sums = self._centroid_sums[kept_identities]
+        self._gallery_buffer = self._centroid_buffer = None
+
+    def copy(self):
+        """
+        Копия для изменения в стороне от опубликованной модели: массивы общие,
+        update/remove не меняют их, а заменяют новыми
+        """
+        return copy.copy(self)
+
+    def empty(self):
+        return len(self.labels) == 0
+
+    # -- распознавание -----------------------------------------------------
+
+    def _chi_square(self, histogram, matrix, matrix_sums, ranges=None, by_rows=False):
+        """
+        Расстояния хи-квадрат от одной гистограммы до образцов matrix
+        (бины x M, при by_rows - M x бины) или только до образцов из диапазонов
+        ranges [(start, stop), ...], склеенные по порядку.
+
+        sum (a-b)^2/(a+b) = sum a + sum b - 4 * sum ab/(a+b), а последнее слагаемое
+        отлично от нуля только в непустых бинах запроса, поэтому берутся только
+        эти бины, блоками не больше config.lbph_params["chunk_elements"].
+
+        Запросы считаются по одному намеренно: у кропа заполнена примерно треть
+        бинов, а у пачки из 8 запросов объединение непустых бинов уже около 80%, так что
+        общий проход Q x N по пачке делает в несколько раз больше работы
+        (галерея 2000 x 16384, 256 запросов: 9.5 с по одному против 78 с пачками по 8)
+        """
+        if ranges is None:
+            ranges = [(0, len(matrix_sums))]
+        bins = np.flatnonzero(histogram > _FLOAT_EPSILON)
+        values = histogram[bins]
+        chunk = config.lbph_params["chunk_elements"]
+
+        parts = []
+        for first, stop in ranges:
+            cross = np.zeros(stop - first, dtype=np.float64)
+            if by_rows:
+                step = max(1, chunk // max(len(bins), 1))
+                for start in range(first, stop, step):
+                    block = np.take(matrix[start:min(start + step, stop)], bins, axis=1)
+                    product = block * values
+                    np.divide(product, block + values, out=product)
+                    cross[start - first:start - first + len(block)] = product.sum(axis=1, dtype=np.float64)
+            else:
+                step = max(1, chunk // max(stop - first, 1))
+                for start in range(0, len(bins), step):
+                    block = matrix[bins[start:start + step], first:stop]
+                    block_values = values[start:start + step][:, None]
+                    product = block * block_values
+                    np.divide(product, block + block_values, out=product)
+                    cross += product.sum(axis=0, dtype=np.float64)
+            parts.append(values.sum(dtype=np.float64) + matrix_sums[first:stop] - 4.0 * cross)
+        result = np.concatenate(parts) if parts else np.empty(0, dtype=np.float64)
+        # Ошибка округления не должна давать отрицательных расстояний для совпадающих гистограмм
+        return 2.0 * np.maximum(result, 0.0)
+
+    def _gallery_distances(self, histogram, ranges=None):
+        return self._chi_square(histogram, self.gallery, self._gallery_sums, ranges, self.gallery_by_rows)
+
+    def distances(self, query):
+        """
+        Матрица расстояний хи-квадрат (Q, N) между гистограммами запросов и всей
+        галереей; строки считаются по одному запросу (см. _chi_square)
+        """
+        query = np.asarray(query, dtype=np.float32)
+        result = np.empty((len(query), len(self.labels)), dtype=np.float64)
+        for qi, histogram in enumerate(query):
+            result[qi] = self._gallery_distances(histogram)
+        return result
+
+    def _nearest(self, histogram, candidates):
+        """Ближайший образец галереи: полный перебор или среди образцов top-k людей по центроидам"""
+        if not (self.gallery_by_rows and 0 < candidates < len(self.identities)):
+            distances = self._gallery_distances(histogram)
+            nearest = int(distances.argmin())
+            return nearest, distances[nearest]
+
+        to_centroids = self._chi_square(histogram, self.centroids, self._centroid_sums)
+        top = np.sort(np.argpartition(to_centroids, candidates - 1)[:candidates])
+        ranges = self._identity_ranges[top]
+        distances = self._gallery_distances(histogram, ranges)
+        nearest = int(distances.argmin())
+        # Номер в склеенных диапазонах -> номер образца галереи
+        offsets = np.cumsum(ranges[:, 1] - ranges[:, 0])
+        block = int(np.searchsorted(offsets, nearest, side="right"))
+        sample = ranges[block, 0] + nearest - (offsets[block - 1] if block else 0)
+        return int(sample), distances[nearest]
+
+    def predict_batch(self, images, candidates=None):
+        """
+        Метки и расстояния ближайших гистограмм галереи для набора кропов.
+        candidates - сколько людей с ближайшими центроидами проверять точно
+        (по умолчанию config.lbph_params["candidate_identities"], 0 - полный перебор);
+        действует, только если галерея достаточно велика для индекса
+        """
+        if len(images) == 0:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float64)
+        if self.empty():
+            raise ValueError("Модель не обучена")
+        if candidates is None:
+            candidates = config.lbph_params["candidate_identities"]
+
+        nearest = np.empty(len(images), dtype=np.int64)
+        confidences = np.empty(len(images), dtype=np.float64)
+        for qi, histogram in enumerate(self.histograms(images)):
+            nearest[qi], confidences[qi] = self._nearest(histogram, candidates)
+
+        labels = self.labels[nearest].copy()
+        rejected = confidences >= self.threshold
+        labels[rejected] = -1
+        confidences[rejected] = np.finfo(np.float64).max
+        return labels, confidences
+
+    def predict(self, image):
+        labels, confidences = self.predict_batch([image])
+        return int(labels[0]), float(confidences[0])
+
+    # -- файл модели (формат cv2.face.LBPHFaceRecognizer) --------------------
+
+    def save(self, path):
+        fs = cv2.FileStorage(str(path), cv2.FILE_STORAGE_WRITE)
+        try:
+            fs.startWriteStruct("opencv_lbphfaces", cv2.FileNode_MAP)
+            fs.write("threshold", float(min(self.threshold, np.finfo(np.float64).max)))
+            fs.write("radius", self.radius)
+            fs.write("neighbors", self.neighbors)
+            fs.write("grid_x", self.grid_x)
+            fs.write("grid_y", self.grid_y)
+            fs.startWriteStruct("histograms", cv2.FileNode_SEQ)
+            for row in self.sample_histograms():
+                fs.write("", np.ascontiguousarray(row).reshape(1, -1))
+            fs.endWriteStruct()
+            fs.write("labels", self.labels.reshape(-1, 1))
+            fs.startWriteStruct("labelsInfo", cv2.FileNode_SEQ)
+            fs.endWriteStruct()
+            fs.endWriteStruct()
+        finally:
+            fs.release()
+
+    def read(self, path):
+        fs = cv2.FileStorage(str(path), cv2.FILE_STORAGE_READ)
+        try:
+            node = fs.getFirstTopLevelNode()
+            self.threshold = node.getNode("threshold").real()
+            self.radius = int(node.getNode("radius").real())
+            self.neighbors = int(node.getNode("neighbors").real())
+            self.grid_x = int(node.getNode("grid_x").real())
+            self.grid_y = int(node.getNode("grid_y").real())
+            histograms = node.getNode("histograms")
+            rows = [histograms.at(i).mat().reshape(-1) for i in range(histograms.size())]
+            if rows:
+                self._set_gallery(np.vstack(rows), node.getNode("labels").mat())
+            else:
+                self._reset_gallery()
+        finally:
+            fs.release()
+
+    @classmethod
+    def from_opencv(cls, model):
+        """Галерея уже обученной модели cv2.face.LBPHFaceRecognizer"""
+        engine = cls(model.getRadius(), model.getNeighbors(), model.getGridX(), model.getGridY(),
+                     model.getThreshold())
+        histograms = model.getHistograms()
+        if histograms:
+            engine._set_gallery(np.vstack([h.reshape(1, -1) for h in histograms]), model.getLabels())
+        return engine
+
+    def to_bundle(self):
+        """Массивы и параметры модели в готовой к поиску раскладке (см. app.services.model_bundle)"""
+        arrays = {
+            "gallery": self.gallery,
+            "labels": self.labels,
+            "gallery_sums": self._gallery_sums,
+            "identities": self.identities,
+            "identity_ranges": self._identity_ranges,
+            "centroids": self.centroids,
+            "centroid_sums": self._centroid_sums,
+        }
+        params = {"radius": self.radius, "neighbors": self.neighbors, "grid_x": self.grid_x,
+                  "grid_y": self.grid_y, "threshold": float(self.threshold),
+                  "gallery_by_rows": bool(self.gallery_by_rows)}
+        return arrays, params
+
+    @classmethod
+    def from_bundle(cls, arrays, params):
+        """
+        Модель из массивов to_bundle без пересчёта: массивы (в том числе
+        отображённые в память) используются как есть. Если раскладка галереи
+        сохранена при других настройках индекса, галерея перестраивается
+        """
+        engine = cls(params["radius"], params["neighbors"], params["grid_x"], params["grid_y"],
+                     params["threshold"])
+        by_rows = params["gallery_by_rows"]
+        if by_rows != engine._index_enabled(len(arrays["identities"])):
+            engine._set_gallery(arrays["gallery"] if by_rows else arrays["gallery"].T, arrays["labels"])
+            return engine
+        engine.labels = arrays["labels"]
+        engine.gallery = arrays["gallery"]
+        engine.gallery_by_rows = by_rows
+        engine._gallery_sums = arrays["gallery_sums"]
+        engine.identities = arrays["identities"]
+        engine._identity_ranges = arrays["identity_ranges"]
+        engine.centroids = arrays["centroids"]
+        engine._centroid_sums = arrays["centroid_sums"]
+        engine._gallery_buffer = engine._centroid_buffer = None
+        return engine
+
+
+def predict_batch(model, images):
+    """Пакетное распознавание для любой модели: OpenCV модель обходится по одному кропу"""
+    if hasattr(model, "predict_batch"):
+        labels, confidences = model.predict_batch(images)
+        return list(zip(labels.tolist(), confidences.tolist()))
+    return [model.predict(image) for image in images]
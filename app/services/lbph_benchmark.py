@@ -0,0 +1,105 @@
+"""
+Отчёт по двухступенчатому поиску NumpyLBPH на синтетической галерее:
+ускорение и расхождение с полным перебором при разном числе людей.
+
+    python -m app.services.lbph_benchmark
+    python -m app.services.lbph_benchmark --identities 100 1000 --samples 5 --candidates 10 20 50
+
+Для каждого человека генерируется «лицо» (сглаженный шум), образцы и запросы -
+его копии со сдвигом и шумом. Галерея 10 000 человек по 2 образца занимает
+около 1.3 ГБ (16384 бина float32 на образец).
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from app import config
+from app.services.lbph import NumpyLBPH
+
+BATCH = 256
+
+
+def _faces(rng, count):
+    height, width = config.IMAGE_SIZE[1], config.IMAGE_SIZE[0]
+    noise = rng.integers(0, 256, (count, height + 8, width + 8), dtype=np.uint8)
+    return np.stack([cv2.GaussianBlur(face, (9, 9), 0) for face in noise])
+
+
+def _sample(rng, bases):
+    """Образец человека: случайный сдвиг до 2 пикселей и шум"""
+    height, width = config.IMAGE_SIZE[1], config.IMAGE_SIZE[0]
+    dy, dx = rng.integers(2, 7, size=2)
+    crops = bases[:, dy:dy + height, dx:dx + width].astype(np.int16)
+    crops += rng.integers(-12, 13, crops.shape, dtype=np.int16)
+    return np.clip(crops, 0, 255).astype(np.uint8)
+
+
+def build_gallery(rng, identities, samples):
+    engine = NumpyLBPH()
+    bases = np.empty((identities, config.IMAGE_SIZE[1] + 8, config.IMAGE_SIZE[0] + 8), dtype=np.uint8)
+    histograms = np.empty((identities * samples, engine.bins), dtype=np.float32)
+    labels = np.repeat(np.arange(identities, dtype=np.int32), samples)
+    for start in range(0, identities, BATCH):
+        stop = min(start + BATCH, identities)
+        bases[start:stop] = _faces(rng, stop - start)
+        for s in range(samples):
+            rows = np.arange(start, stop) * samples + s
+            histograms[rows] = engine.histograms(list(_sample(rng, bases[start:stop])))
+    engine._set_gallery(histograms, labels)
+    del histograms
+    return engine, bases
+
+
+def run(identities, samples, queries, candidates_list, rng):
+    # Полный перебор - на раскладке галереи для полного перебора
+    config.lbph_params["index_min_identities"] = identities + 1
+    started = time.perf_counter()
+    engine, bases = build_gallery(rng, identities, samples)
+    build_time = time.perf_counter() - started
+
+    truth = rng.integers(0, identities, queries)
+    images = list(_sample(rng, bases[truth]))
+
+    started = time.perf_counter()
+    exact_labels, _ = engine.predict_batch(images, candidates=0)
+    exact_time = (time.perf_counter() - started) / queries
+
+    # Индекс включается при любом числе людей, чтобы сравнить его и с малой галереей
+    config.lbph_params["index_min_identities"] = 0
+    engine._set_gallery(engine.sample_histograms(), engine.labels)
+
+    rows = [("полный перебор", exact_time, 1.0, 1.0, float(np.mean(exact_labels == truth)))]
+    for candidates in candidates_list:
+        if candidates >= identities:
+            continue
+        started = time.perf_counter()
+        labels, _ = engine.predict_batch(images, candidates=candidates)
+        elapsed = (time.perf_counter() - started) / queries
+        rows.append((f"top-{candidates}", elapsed, exact_time / elapsed,
+                     float(np.mean(labels == exact_labels)), float(np.mean(labels == truth))))
+
+    print(f"\nЛюдей: {identities}, образцов на человека: {samples}, "
+          f"образцов в галерее: {len(engine.labels)}, построение: {build_time:.1f} с")
+    print(f"{'режим':>16} {'мс/запрос':>10} {'ускорение':>10} {'= перебору':>11} {'точность':>9}")
+    for name, elapsed, speedup, agreement, accuracy in rows:
+        print(f"{name:>16} {elapsed * 1000:10.2f} {speedup:9.1f}x {agreement:11.3f} {accuracy:9.3f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Отчёт по двухступенчатому поиску NumpyLBPH")
+    parser.add_argument("--identities", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--samples", type=int, default=2, help="образцов на человека")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--candidates", type=int, nargs="+", default=[5, 20, 50])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    for identities in args.identities:
+        run(identities, args.samples, args.queries, args.candidates, rng)
+
+
+if __name__ == "__main__":
+    main()
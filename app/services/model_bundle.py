@@ -0,0 +1,174 @@
+"""
+Бинарный файл модели: массивы модели (галерея, метки, индекс поиска), имена,
+пороги и метаданные обучения одним файлом, который открывается через
+memory-map без разбора текста.
+
+Формат: сигнатура FACEMDL1, длина заголовка (uint64 little-endian), заголовок
+JSON {"meta": {...}, "arrays": {имя: {"dtype", "shape", "offset"}}}, затем
+массивы сырыми байтами, каждый с выравниванием 64 байта от начала файла.
+
+    python -m app.services.model_bundle            # перевести XML модель (если ещё нет) и сравнить форматы
+    python -m app.services.model_bundle --runs 10
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+
+from app import config
+from app.services.embedding import EmbeddingRecognizer
+from app.services.lbph import NumpyLBPH
+
+MAGIC = b"FACEMDL1"
+_ALIGN = 64
+_LENGTH = struct.Struct("<Q")
+
+
+def _aligned(offset):
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def is_bundle(path):
+    """Начинается ли файл с сигнатуры бинарной модели"""
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def write(path, arrays, meta):
+    """Записать массивы {имя: ndarray} и метаданные (JSON) в файл path"""
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    layout, offset = {}, 0
+    for name, array in arrays.items():
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset = _aligned(offset + array.nbytes)
+    header = json.dumps({"meta": meta, "arrays": layout}, ensure_ascii=False).encode("utf-8")
+    # Смещения в заголовке - от начала области данных, она начинается с выровненной позиции
+    data_start = _aligned(len(MAGIC) + _LENGTH.size + len(header))
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(_LENGTH.pack(len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+
+
+def read(path, use_mmap=True):
+    """
+    (массивы, метаданные) из файла path. Массивы только для чтения: при use_mmap
+    они ссылаются на отображённый в память файл (страницы читаются по мере
+    обращения и общие для всех процессов), иначе файл читается целиком
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} не является бинарным файлом модели")
+        (length,) = _LENGTH.unpack(f.read(_LENGTH.size))
+        header = json.loads(f.read(length).decode("utf-8"))
+        if use_mmap:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            f.seek(0)
+            buffer = f.read()
+
+    data_start = _aligned(len(MAGIC) + _LENGTH.size + length)
+    arrays = {}
+    for name, info in header["arrays"].items():
+        dtype, shape = np.dtype(info["dtype"]), tuple(info["shape"])
+        count = int(np.prod(shape))
+        if count == 0:
+            arrays[name] = np.empty(shape, dtype=dtype)
+            continue
+        if data_start + info["offset"] + count * dtype.itemsize > len(buffer):
+            raise ValueError(f"{path} повреждён: массив {name} выходит за конец файла")
+        arrays[name] = np.frombuffer(buffer, dtype=dtype, count=count,
+                                     offset=data_start + info["offset"]).reshape(shape)
+    return arrays, header["meta"]
+
+
+def write_model(path, model, meta):
+    """
+    Записать модель любого бэкенда с метаданными. В заголовке - бэкенд, которым
+    модель обучена (backend), и класс, которым она сохранена (stored_as):
+    cv2.face LBPH сохраняется галереей NumpyLBPH - при чтении получается
+    NumpyLBPH с теми же расстояниями
+    """
+    if not hasattr(model, "to_bundle"):
+        model = NumpyLBPH.from_opencv(model)
+    arrays, params = model.to_bundle()
+    model_type = "embedding" if isinstance(model, EmbeddingRecognizer) else "lbph"
+    write(path, arrays, dict(meta, backend=meta.get("backend") or config.MODEL_BACKEND, model_type=model_type,
+                             stored_as=type(model).__name__, model_params=params))
+
+
+def read_model(path, use_mmap=True, backend=None):
+    """
+    (модель, метаданные) из бинарного файла. backend - ожидаемый бэкенд:
+    LBPH-модель (opencv или numpy) не подходит бэкенду embedding и наоборот
+    """
+    arrays, meta = read(path, use_mmap)
+    model_type = meta.get("model_type", "lbph")
+    if backend is not None and (model_type == "embedding") != (backend == "embedding"):
+        raise ValueError(f"{path} содержит модель бэкенда {meta.get('backend', model_type)}, "
+                         f"а MODEL_BACKEND = {backend}: нужно переобучение")
+    if model_type == "embedding":
+        return EmbeddingRecognizer.from_bundle(arrays, meta["model_params"]), meta
+    return NumpyLBPH.from_bundle(arrays, meta["model_params"]), meta
+
+
+def _timed(load, runs):
+    """Лучшее время загрузки и первого распознавания (мс) за runs запусков"""
+    probe = np.zeros((config.IMAGE_SIZE[1], config.IMAGE_SIZE[0]), dtype=np.uint8)
+    best_load = best_first = float("inf")
+    for _ in range(runs):
+        started = time.perf_counter()
+        model = load()
+        loaded = time.perf_counter()
+        model.predict(probe)
+        best_load = min(best_load, loaded - started)
+        best_first = min(best_first, time.perf_counter() - started)
+    return best_load * 1000, best_first * 1000
+
+
+def main(argv=None):
+    from app.services import models
+
+    parser = argparse.ArgumentParser(description="Перевод модели из XML в бинарный формат и сравнение загрузки")
+    parser.add_argument("--runs", type=int, default=3, help="запусков загрузки каждого формата")
+    args = parser.parse_args(argv)
+
+    if config.MODEL_BACKEND == "embedding":
+        legacy, bundle = config.EMBEDDING_MODEL_FILE, config.EMBEDDING_BUNDLE_FILE
+    else:
+        legacy, bundle = config.MODEL_FILE, config.MODEL_BUNDLE_FILE
+    if not os.path.exists(legacy):
+        print(f"Модель прежнего формата {legacy} не найдена")
+        return 1
+    # Уже существующий бинарный файл может быть новее прежнего - не перезаписываем
+    if not os.path.exists(bundle) and not models.convert_legacy_model():
+        return 1
+
+    def load_legacy():
+        model = models.create_model()
+        model.read(str(legacy))
+        with open(config.METADATA_FILE, "r", encoding="utf-8") as f:
+            json.load(f)
+        return model
+
+    rows = [("прежний", legacy, _timed(load_legacy, args.runs)),
+            ("бинарный", bundle, _timed(lambda: read_model(bundle, config.MODEL_BUNDLE_MMAP)[0], args.runs))]
+    print(f"{'формат':>10} {'размер МБ':>10} {'загрузка мс':>12} {'до 1-го ответа мс':>18}")
+    for title, path, (load_ms, first_ms) in rows:
+        print(f"{title:>10} {os.path.getsize(path) / 2 ** 20:10.2f} {load_ms:12.1f} {first_ms:18.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
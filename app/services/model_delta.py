@@ -0,0 +1,98 @@
+import os
+import re
+
+import numpy as np
+
+from app import config
+
+# Журнал изменений модели после последнего полного сохранения: по файлу на
+# операцию (добавление или удаление одного человека), номер операции - в имени.
+# В метаданных модели delta_seq - номер последней операции, уже вошедшей в файл
+# модели; при загрузке применяются только более поздние
+_ENTRY_NAME = re.compile(r"^(\d{8})\.npz$")
+
+
+def _entries():
+    """[(номер, путь)] операций журнала по возрастанию номера"""
+    if not os.path.isdir(config.MODEL_DELTA_DIR):
+        return []
+    result = []
+    for filename in os.listdir(config.MODEL_DELTA_DIR):
+        match = _ENTRY_NAME.match(filename)
+        if match:
+            result.append((int(match.group(1)), os.path.join(config.MODEL_DELTA_DIR, filename)))
+    return sorted(result)
+
+
+def last_seq():
+    entries = _entries()
+    return entries[-1][0] if entries else 0
+
+
+def count(after=0):
+    return sum(1 for seq, _ in _entries() if seq > after)
+
+
+def append(op, label, name, original_name=None, images=(), after=0, dataset_hash=""):
+    """
+    Записать операцию в журнал и вернуть её номер (больше after - номера,
+    уже учтённого моделью). Кропы добавляемого человека сохраняются как есть,
+    поэтому операция применима к модели любого бэкенда
+    """
+    os.makedirs(config.MODEL_DELTA_DIR, exist_ok=True)
+    seq = max(last_seq(), after) + 1
+    path = os.path.join(config.MODEL_DELTA_DIR, f"{seq:08d}.npz")
+    tmp = os.path.join(config.MODEL_DELTA_DIR, f"{seq:08d}.tmp{os.getpid()}.npz")
+    arrays = {f"image_{i}": image for i, image in enumerate(images)}
+    with open(tmp, "wb") as f:
+        np.savez(f, op=op, label=label, name=name, original_name=original_name or name,
+                 dataset_hash=dataset_hash, **arrays)
+    os.replace(tmp, path)
+    return seq
+
+
+def read(after=0):
+    """
+    Операции с номером больше after: [(номер, dict)]. Нечитаемая операция
+    пропускается и откладывается (см. discard), остальные читаются дальше
+    """
+    result = []
+    for seq, path in _entries():
+        if seq <= after:
+            continue
+        try:
+            with np.load(path) as data:
+                images = [data[f"image_{i}"] for i in range(sum(key.startswith("image_") for key in data.files))]
+                result.append((seq, {
+                    "op": str(data["op"]),
+                    "label": int(data["label"]),
+                    "name": str(data["name"]),
+                    "original_name": str(data["original_name"]),
+                    # Хеш набора данных человека (в записях прежних версий его нет)
+                    "dataset_hash": str(data["dataset_hash"]) if "dataset_hash" in data.files else "",
+                    "images": images,
+                }))
+        except Exception as e:
+            print(f"Операция журнала модели {seq} не читается, пропускаем её: {e}")
+            discard(seq)
+    return result
+
+
+def discard(seq):
+    """
+    Отложить операцию seq, которую нельзя прочитать или применить: файл
+    переименовывается в .bad и больше не читается. Модель без неё расходится
+    с набором данных, и при запуске человек переобучается
+    """
+    path = os.path.join(config.MODEL_DELTA_DIR, f"{seq:08d}.npz")
+    try:
+        os.replace(path, f"{path}.bad")
+    except FileNotFoundError:
+        pass  # уже отложена другим процессом
+
+
+def clear(upto=None):
+    """Удалить операции, вошедшие в файл модели (все при upto=None)"""
+    for seq, path in _entries():
+        if upto is None or seq <= upto:
+            os.remove(path)
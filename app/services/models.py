@@ -1,138 +1,625 @@
 import cv2
 import os
 import json
+import itertools
+import threading
+import time
 import numpy as np
+from collections import namedtuple
 from datetime import datetime
+from types import MappingProxyType
 
 from app import config
+from app.services.lbph import NumpyLBPH
+from app.services.embedding import EmbeddingRecognizer
+from app.services import dataset_cache, model_bundle, model_delta
+from app.services.dataset_manifest import get_dataset_manifest
+
+# Модель, её метки и пороги одним неизменяемым снимком. Снимок собирается
+# в стороне и публикуется одним присваиванием config.model_snapshot, поэтому
+# кадр или запрос, взявший снимок, до конца работает с согласованным набором
+ModelSnapshot = namedtuple("ModelSnapshot", [
+    "model",                 # обученная модель (не изменяется после публикации)
+    "names",                 # {метка: имя каталога}, только для чтения
+    "dataset",               # {имя каталога: хеш набора данных, на котором обучен человек}, только для чтения
+    "confidence_threshold",
+    "unknown_threshold",
+    "backend",
+    "version",               # номер публикации в этом процессе
+    "source_stamp",          # (отметка файла модели, номер последней применённой операции журнала)
+    "loaded_at",
+])
+
+_versions = itertools.count(1)
+_publish_lock = threading.Lock()
+# Сохранение/загрузка файлов и публикация снимка выполняются под одной блокировкой,
+# чтобы наблюдатель не перечитал файл, который этот же процесс сейчас записывает
+_swap_lock = threading.RLock()
+# Состояние диска (см. disk_state), которое этот процесс уже видел (записал или загрузил)
+_known_state = None
+
+def create_model():
+    """Модель распознавания выбранного бэкенда (config.MODEL_BACKEND)"""
+    if config.MODEL_BACKEND == "numpy":
+        return NumpyLBPH()
+    if config.MODEL_BACKEND == "embedding":
+        return EmbeddingRecognizer()
+    return cv2.face.LBPHFaceRecognizer_create()
+
+def model_file():
+    """Файл модели бэкенда: бинарный (MODEL_FORMAT="bundle") или прежнего формата"""
+    if config.MODEL_FORMAT == "bundle":
+        if config.MODEL_BACKEND == "embedding":
+            return config.EMBEDDING_BUNDLE_FILE
+        return config.MODEL_BUNDLE_FILE
+    return legacy_model_file()
+
+def legacy_model_file():
+    """Файл модели прежнего формата: LBPH (OpenCV и NumPy) в XML OpenCV, эмбеддинги - .npz"""
+    if config.MODEL_BACKEND == "embedding":
+        return config.EMBEDDING_MODEL_FILE
+    return config.MODEL_FILE
+
+def file_stamp(path):
+    """(mtime_ns, размер) файла или None, если файла нет"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def build_snapshot(model, names, source_stamp=None, dataset=None):
+    """Новый снимок с текущими порогами; names и dataset копируются"""
+    return ModelSnapshot(
+        model=model,
+        names=MappingProxyType(dict(names)),
+        dataset=MappingProxyType(dict(dataset or {})),
+        confidence_threshold=config.CONFIDENCE_THRESHOLD,
+        unknown_threshold=config.UNKNOWN_THRESHOLD,
+        backend=config.MODEL_BACKEND,
+        version=next(_versions),
+        source_stamp=source_stamp,
+        loaded_at=time.time(),
+    )
+
+def current_snapshot():
+    """Текущий снимок (или None): брать один раз на кадр или запрос"""
+    return config.model_snapshot
+
+def publish_snapshot(snapshot):
+    """Подменить текущий снимок одним присваиванием, предыдущий остаётся для отката"""
+    with _publish_lock:
+        if config.model_snapshot is not None:
+            config.previous_snapshot = config.model_snapshot
+        config.model_snapshot = snapshot
+        # Зеркала для кода, который читает модель и имена напрямую
+        config.model = snapshot.model if snapshot is not None else None
+        config.names = dict(snapshot.names) if snapshot is not None else {}
+    return snapshot
+
+def rollback():
+    """Вернуть предыдущий снимок (текущий становится предыдущим). False, если откатываться не на что"""
+    with _publish_lock:
+        previous = config.previous_snapshot
+        if previous is None:
+            return False
+        config.previous_snapshot = config.model_snapshot
+        # Пороги задаются настройками, а не моделью - откат их не меняет
+        config.model_snapshot = previous._replace(confidence_threshold=config.CONFIDENCE_THRESHOLD,
+                                                  unknown_threshold=config.UNKNOWN_THRESHOLD)
+        config.model = previous.model
+        config.names = dict(previous.names)
+    print(f"Откат модели на версию {previous.version}")
+    return True
+
+def refresh_thresholds():
+    """Перепубликовать текущий снимок с порогами из config (после их изменения)"""
+    with _publish_lock:
+        snapshot = config.model_snapshot
+        if snapshot is None:
+            return
+        if (snapshot.confidence_threshold, snapshot.unknown_threshold) == (config.CONFIDENCE_THRESHOLD,
+                                                                            config.UNKNOWN_THRESHOLD):
+            return
+        config.model_snapshot = snapshot._replace(confidence_threshold=config.CONFIDENCE_THRESHOLD,
+                                                  unknown_threshold=config.UNKNOWN_THRESHOLD)
+
+def snapshot_info(snapshot):
+    """Описание снимка для API"""
+    if snapshot is None:
+        return None
+    return {
+        "version": snapshot.version,
+        "backend": snapshot.backend,
+        "model_class": type(snapshot.model).__name__,  # opencv в бинарном формате - NumpyLBPH
+        "people_count": len(snapshot.names),
+        "confidence_threshold": snapshot.confidence_threshold,
+        "unknown_threshold": snapshot.unknown_threshold,
+        "loaded_at": datetime.fromtimestamp(snapshot.loaded_at).isoformat(),
+    }
+
+def load_training_data(progress=None):
+    """Загрузка данных для обучения; progress(**поля) получает число загруженных людей и изображений"""
+    # Дожидаемся записи кропов, которые ещё в очереди фонового писателя
+    if config.dataset_writer is not None and not config.dataset_writer.wait_idle(timeout=30):
+        print("ВНИМАНИЕ: часть собранных изображений ещё не записана на диск")
 
-def load_training_data():
-    """Загрузка данных для обучения"""
     if not os.path.exists(config.DATASET_DIR):
         print(f"Каталог наборов данных {config.DATASET_DIR} не существует")
         return None, None, {}
-    
-    images, labels = [], []
-    config.names = {}
-    id = 0
-    
-    for subdir in os.listdir(config.DATASET_DIR):
-        subpath = os.path.join(config.DATASET_DIR, subdir)
-        if os.path.isdir(subpath):
-            config.names[id] = subdir
-            # Сохраняем оригинальное имя если оно есть в словаре
-            original_name = config.original_names.get(subdir, subdir)
-            image_count = 0
-            for filename in os.listdir(subpath):
-                filepath = os.path.join(subpath, filename)
-                img = cv2.imread(filepath, cv2.IMREAD_GRAYSCALE)
-                if img is not None:
-                    images.append(img)
-                    labels.append(id)
-                    image_count += 1
-            print(f"Загружено {image_count} изображения для {original_name} (каталог: {subdir})")
-            id += 1
-    
-    if not images or not labels:
+
+    # Люди и число их изображений - из сводки набора данных (перечитываются
+    # только каталоги, изменённые в обход приложения).
+    # Имена собираются локально: текущий снимок продолжает работать со своими
+    manifest = get_dataset_manifest()
+    manifest.reconcile()
+    people = manifest.people()
+    subdirs = sorted(people)
+    if progress is not None:
+        progress(stage="loading", people_done=0, people_total=len(subdirs), images_loaded=0,
+                 images_total=sum(entry["count"] for entry in people.values()))
+
+    # Неизменившиеся каталоги читаются из упакованного кеша, остальные декодируются параллельно
+    people = dataset_cache.load_people(subdirs, progress)
+    dataset_cache.prune(subdirs)
+
+    names = {}
+    for id, subdir in enumerate(subdirs):
+        names[id] = subdir
+        # Сохраняем оригинальное имя если оно есть в словаре
+        original_name = config.original_names.get(subdir, subdir)
+        print(f"Загружено {len(people[subdir])} изображения для {original_name} (каталог: {subdir})")
+
+    total = sum(len(images) for images in people.values())
+    if total == 0:
         print("Данные для обучения не найдены.")
         return None, None, {}
-    
-    print(f"Общие данные обучения: {len(images)} изображения, {len(set(labels))} люди")
-    return np.array(images), np.array(labels), config.names
 
-def save_model():
-    """Сохранение обученной модели"""
-    if config.model is not None:
-        try:
-            # Сохраняем модель OpenCV
-            config.model.save(config.MODEL_FILE)
-            
+    # Одно копирование упакованных массивов в общий массив обучения
+    images = np.concatenate([people[subdir] for subdir in subdirs])
+    labels = np.repeat(np.arange(len(subdirs)), [len(people[subdir]) for subdir in subdirs])
+    print(f"Общие данные обучения: {total} изображения, {len(np.unique(labels))} люди")
+    return images, labels, names
+
+def _temp_path(path):
+    """Временный файл рядом с целевым, с тем же расширением (по нему OpenCV выбирает формат)"""
+    path = str(path)
+    root, ext = os.path.splitext(path)
+    return f"{root}.tmp{os.getpid()}{ext}"
+
+def disk_state():
+    """Состояние модели на диске: (отметка файла модели, номер последней операции журнала)"""
+    return file_stamp(model_file()), model_delta.last_seq()
+
+def save_model(model=None, names=None, delta_seq=None, training_date=None, dataset=None):
+    """
+    Полное сохранение модели (по умолчанию - текущего снимка).
+    Файлы пишутся во временные и подменяются os.replace. Бинарный файл содержит
+    и модель, и метаданные; в прежнем формате сначала подменяются метаданные,
+    последним - файл модели, по изменению которого другие процессы перезагружаются.
+    delta_seq - последняя операция журнала, уже учтённая моделью (по умолчанию
+    все), такие операции из журнала удаляются. Возвращает источник для снимка
+    (отметка файла модели, delta_seq) или None. dataset - хеши наборов данных
+    людей из сводки (см. build_snapshot), по ним при запуске решается, нужно ли
+    переобучение
+    """
+    global _known_state
+    if model is None:
+        snapshot = config.model_snapshot
+        if snapshot is None:
+            return None
+        model, names, dataset = snapshot.model, snapshot.names, snapshot.dataset
+    if delta_seq is None:
+        delta_seq = model_delta.last_seq()
+    path = str(model_file())
+    model_tmp, metadata_tmp = _temp_path(path), _temp_path(config.METADATA_FILE)
+    try:
+        model_data = {
+            'names': dict(names),
+            'original_names': config.original_names,  # Сохраняем оригинальные имена
+            'image_size': config.IMAGE_SIZE,
+            'backend': config.MODEL_BACKEND,
+            'confidence_threshold': config.CONFIDENCE_THRESHOLD,
+            'unknown_threshold': config.UNKNOWN_THRESHOLD,
+            'delta_seq': delta_seq,
+            'dataset': dict(dataset or {}),
+            'training_date': training_date or datetime.now().isoformat()
+        }
+
+        if config.MODEL_FORMAT == "bundle":
+            model_bundle.write_model(model_tmp, model, model_data)
+            replacements = [(model_tmp, path)]
+        else:
+            # Сохраняем модель
+            model.save(model_tmp)
+
             # Сохраняем метаданные
-            model_data = {
-                'names': config.names,
-                'original_names': config.original_names,  # Сохраняем оригинальные имена
-                'image_size': config.IMAGE_SIZE,
-                'confidence_threshold': config.CONFIDENCE_THRESHOLD,
-                'unknown_threshold': config.UNKNOWN_THRESHOLD,
-                'training_date': datetime.now().isoformat()
-            }
-            
-            with open(config.METADATA_FILE, 'w', encoding='utf-8') as f:
+            with open(metadata_tmp, 'w', encoding='utf-8') as f:
                 json.dump(model_data, f, ensure_ascii=False, indent=2)
-            
-            print(f"Модель сохранена в {config.MODEL_FILE}")
-            return True
+            replacements = [(metadata_tmp, config.METADATA_FILE), (model_tmp, path)]
+
+        with _swap_lock:
+            for tmp, target in replacements:
+                os.replace(tmp, target)
+            model_delta.clear(upto=delta_seq)
+            _known_state = disk_state()
+
+        print(f"Модель сохранена в {path}")
+        return file_stamp(path), delta_seq
+    except Exception as e:
+        print(f"Ошибка сохранения модели: {e}")
+        for tmp in (model_tmp, metadata_tmp):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return None
+
+def _editable_copy(model):
+    """
+    Копия модели для изменения в стороне от опубликованной. У cv2.face LBPH
+    нет ни копирования, ни удаления образцов, поэтому берётся её галерея
+    в NumpyLBPH (те же расстояния и тот же формат файла)
+    """
+    if hasattr(model, "copy"):
+        return model.copy()
+    return NumpyLBPH.from_opencv(model)
+
+def _apply_delta(model, names, dataset, entry):
+    """Применить операцию журнала к копии модели, словарю имён и хешам наборов данных"""
+    if entry["op"] == "remove":
+        model.remove([entry["label"]])
+        names.pop(entry["label"], None)
+        dataset.pop(entry["name"], None)
+        return
+    # Повторное добавление заменяет прежние образцы человека
+    previous = [label for label, name in names.items() if name == entry["name"]]
+    if previous:
+        model.remove(previous)
+        for label in previous:
+            del names[label]
+    model.update(entry["images"], np.full(len(entry["images"]), entry["label"], dtype=np.int32))
+    names[entry["label"]] = entry["name"]
+    if entry["dataset_hash"]:
+        dataset[entry["name"]] = entry["dataset_hash"]
+    else:
+        dataset.pop(entry["name"], None)
+    config.original_names.setdefault(entry["name"], entry["original_name"])
+
+def _replay(snapshot, after):
+    """Снимок с операциями журнала новее after (или тот же снимок, если их нет)"""
+    entries = model_delta.read(after)
+    if not entries:
+        return snapshot
+    model, names, dataset = _editable_copy(snapshot.model), dict(snapshot.names), dict(snapshot.dataset)
+    for seq, entry in entries:
+        try:
+            _apply_delta(model, names, dataset, entry)
         except Exception as e:
-            print(f"Ошибка сохранения модели: {e}")
-            return False
-    return False
+            # Базовая модель остаётся, человек без хеша набора данных будет переобучен
+            print(f"Операцию журнала модели {seq} ({entry['op']} {entry['name']}) не удалось применить: {e}")
+            dataset.pop(entry["name"], None)
+            model_delta.discard(seq)
+    return build_snapshot(model, names, (snapshot.source_stamp[0], entries[-1][0]), dataset)
+
+def _read_files(path):
+    """(модель, имена, метаданные) из бинарного файла модели или из файлов прежнего формата"""
+    # Файл модели в формате bundle читается только как бинарный, иначе ошибка - о сигнатуре
+    if model_bundle.is_bundle(path) or (config.MODEL_FORMAT == "bundle" and path == str(model_file())):
+        # Массивы модели отображаются в память, разбирается только заголовок
+        model, model_data = model_bundle.read_model(path, config.MODEL_BUNDLE_MMAP, config.MODEL_BACKEND)
+        if model_data.get("backend") == "opencv":
+            print("Модель cv2.face LBPH хранится в бинарном файле галереей и выполняется NumpyLBPH "
+                  "(те же гистограммы и расстояния)")
+    else:
+        model = create_model()
+        model.read(path)
+
+        # Загружаем метаданные
+        with open(config.METADATA_FILE, 'r', encoding='utf-8') as f:
+            model_data = json.load(f)
+
+    # Восстанавливаем names с правильными типами ключей
+    names = {int(k): v for k, v in model_data['names'].items()}
+
+    # Восстанавливаем оригинальные имена
+    config.original_names.update(model_data.get('original_names', {}))
+    return model, names, model_data
+
+def read_snapshot(path=None):
+    """Прочитать модель, метаданные и журнал изменений с диска в новый снимок, не трогая текущий"""
+    path = str(path or model_file())
+    stamp = file_stamp(path)
+    model, names, model_data = _read_files(path)
+    delta_seq = model_data.get('delta_seq', 0)
+    return _replay(build_snapshot(model, names, (stamp, delta_seq), model_data.get('dataset')), delta_seq)
+
+def convert_legacy_model():
+    """
+    Перевести модель прежнего формата (XML OpenCV или .npz и model_metadata.json)
+    в бинарный файл; операции журнала, не вошедшие в неё, остаются в журнале.
+    Прежние файлы не удаляются. True, если бинарный файл записан
+    """
+    legacy = legacy_model_file()
+    if not (os.path.exists(legacy) and os.path.exists(config.METADATA_FILE)):
+        return False
+    if config.MODEL_BACKEND == "opencv" and not hasattr(cv2, 'face'):
+        print("Ошибка: opencv-contrib-python не установлен")
+        return False
+    try:
+        model, names, model_data = _read_files(str(legacy))
+        with _swap_lock:
+            state = save_model(model, names, delta_seq=model_data.get('delta_seq', 0),
+                               training_date=model_data.get('training_date'), dataset=model_data.get('dataset'))
+    except Exception as e:
+        print(f"Ошибка перевода модели в бинарный формат: {e}")
+        return False
+    if state is None:
+        return False
+    print(f"Модель {legacy} ({os.path.getsize(legacy) / 2 ** 20:.2f} МБ) переведена в "
+          f"{model_file()} ({os.path.getsize(model_file()) / 2 ** 20:.2f} МБ)")
+    return True
 
 def load_model():
     """Загрузка сохраненной модели"""
+    global _known_state
+    path = model_file()
+    # Бинарный файл содержит и метаданные
+    files = [path] if config.MODEL_FORMAT == "bundle" else [path, config.METADATA_FILE]
     try:
-        if os.path.exists(config.MODEL_FILE) and os.path.exists(config.METADATA_FILE):
+        if config.MODEL_FORMAT == "bundle" and not os.path.exists(path):
+            convert_legacy_model()
+
+        if all(os.path.exists(f) for f in files):
             # Проверяем целостность файлов
-            if os.path.getsize(config.MODEL_FILE) == 0 or os.path.getsize(config.METADATA_FILE) == 0:
+            if any(os.path.getsize(f) == 0 for f in files):
                 print("Файлы модели повреждены, удаляем их")
                 try:
-                    os.remove(config.MODEL_FILE)
-                    os.remove(config.METADATA_FILE)
+                    for f in files:
+                        os.remove(f)
                 except:
                     pass
                 return False
-            
+
             # Загружаем модель
-            if not hasattr(cv2, 'face'):
+            if config.MODEL_BACKEND == "opencv" and not hasattr(cv2, 'face'):
                 print("Ошибка: opencv-contrib-python не установлен")
                 return False
-                
-            config.model = cv2.face.LBPHFaceRecognizer_create()
-            config.model.read(config.MODEL_FILE)
-            
-            # Загружаем метаданные
-            with open(config.METADATA_FILE, 'r', encoding='utf-8') as f:
-                model_data = json.load(f)
-            
-            # Восстанавливаем names с правильными типами ключей
-            config.names = {}
-            for k, v in model_data['names'].items():
-                config.names[int(k)] = v
-            
-            # Восстанавливаем оригинальные имена
-            config.original_names = model_data.get('original_names', {})
-            
+
+            with _swap_lock:
+                snapshot = read_snapshot(path)
+                publish_snapshot(snapshot)
+                _known_state = disk_state()
             return True
-            
+
     except Exception as e:
-        try:
-            if os.path.exists(config.MODEL_FILE):
-                os.remove(config.MODEL_FILE)
-            if os.path.exists(config.METADATA_FILE):
-                os.remove(config.METADATA_FILE)
-        except:
-            pass
-    
+        # Файлы не удаляем: ошибка может быть не в них (бэкенд, зависимости)
+        print(f"Ошибка загрузки модели из {path}: {e}")
+        if config.MODEL_FORMAT == "bundle" and os.path.exists(legacy_model_file()):
+            print(f"Модель прежнего формата {legacy_model_file()} сохранена; чтобы перевести её заново, "
+                  f"удалите {path}")
+
     return False
 
-def train_model():
-    """Обучение модели распознавания лиц"""
-    images, labels, _ = load_training_data()
+def reload_if_changed():
+    """
+    Перезагрузить модель, если файл модели или журнал изменил другой процесс.
+    Новые операции журнала применяются к текущему снимку, замена файла -
+    полная загрузка. Ошибка чтения не трогает ни файл модели, ни текущий снимок
+    (нечитаемые операции журнала откладываются).
+    True, если снимок заменён
+    """
+    global _known_state
+    state = disk_state()
+    if state[0] is None or state == _known_state:
+        return False
+    with _swap_lock:
+        if disk_state() != state:
+            return False  # файлы ещё подменяются - проверим в следующий раз
+        snapshot = config.model_snapshot
+        try:
+            if snapshot is not None and _known_state is not None and state[0] == _known_state[0]:
+                snapshot = _replay(snapshot, max(_known_state[1], snapshot.source_stamp[1]))
+            else:
+                snapshot = read_snapshot()
+        except Exception as e:
+            print(f"Не удалось перезагрузить модель: {e}")
+            return False
+        _known_state = state
+        if snapshot is config.model_snapshot:
+            return False
+        publish_snapshot(snapshot)
+    print(f"Модель перезагружена с диска: версия {snapshot.version}, людей: {len(snapshot.names)}")
+    if config.camera_manager is not None:
+        config.camera_manager.reload_models()
+    return True
+
+def compact_model():
+    """Записать текущий снимок полным файлом модели и очистить журнал изменений"""
+    with _swap_lock:
+        snapshot = config.model_snapshot
+        if snapshot is None or snapshot.backend != config.MODEL_BACKEND:
+            return False
+        state = save_model(snapshot.model, snapshot.names, delta_seq=snapshot.source_stamp[1],
+                           dataset=snapshot.dataset)
+        if state is None:
+            return False
+        # Модель та же, меняется только её источник на диске
+        with _publish_lock:
+            if config.model_snapshot is snapshot:
+                config.model_snapshot = snapshot._replace(source_stamp=state)
+    return True
+
+def _commit_delta(snapshot, op, label, name, images=(), dataset_hash=""):
+    """
+    Применить операцию к копии текущей модели, записать её в журнал и опубликовать
+    новый снимок (вызывается под _swap_lock). Полное сохранение модели выполняется
+    в фоне, когда журнал вырастает до MODEL_DELTA_MAX операций
+    """
+    global _known_state
+    entry = {"op": op, "label": label, "name": name, "images": images, "dataset_hash": dataset_hash,
+             "original_name": config.original_names.get(name, name)}
+    model, names, dataset = _editable_copy(snapshot.model), dict(snapshot.names), dict(snapshot.dataset)
+    _apply_delta(model, names, dataset, entry)
+    seq = model_delta.append(op, label, name, entry["original_name"], images, after=snapshot.source_stamp[1],
+                             dataset_hash=dataset_hash)
+    publish_snapshot(build_snapshot(model, names, (snapshot.source_stamp[0], seq), dataset))
+    _known_state = disk_state()
+    if model_delta.count() >= config.MODEL_DELTA_MAX:
+        threading.Thread(target=compact_model, name="model-compaction", daemon=True).start()
+    return names
+
+def _remove_model_files():
+    global _known_state
+    # Прежние файлы тоже: иначе load_model перевёл бы их обратно в бинарный файл
+    for path in (model_file(), legacy_model_file(), config.METADATA_FILE):
+        if os.path.exists(path):
+            os.remove(path)
+    model_delta.clear()
+    _known_state = None
+
+def enroll_person(directory_name):
+    """
+    Добавить одного человека в текущую модель без переобучения остальных:
+    читаются и обрабатываются только его кропы, новая метка - следующая после
+    известных, на диск пишется только операция журнала. Повторное добавление
+    заменяет образцы человека. Если модели ещё нет (или сменился бэкенд),
+    выполняется полное обучение
+    """
+    path = os.path.join(config.DATASET_DIR, directory_name)
+    if not os.path.isdir(path):
+        print(f"Каталог {path} не найден")
+        return False
+    if config.dataset_writer is not None and not config.dataset_writer.wait_idle(timeout=30):
+        print("ВНИМАНИЕ: часть собранных изображений ещё не записана на диск")
+    images = dataset_cache.load_person(directory_name)
+    # Хеш набора данных человека запоминается вместе с его образцами в модели
+    manifest = get_dataset_manifest()
+    manifest.scan_person(directory_name)
+    manifest.flush()
+    dataset_hash = manifest.hashes().get(directory_name, "")
+    if len(images) == 0:
+        print(f"Нет изображений в {path}")
+        return False
+
+    try:
+        with _swap_lock:
+            snapshot = config.model_snapshot
+            if snapshot is None or snapshot.backend != config.MODEL_BACKEND:
+                return train_model()
+            label = max(snapshot.names, default=-1) + 1
+            names = _commit_delta(snapshot, "enroll", label, directory_name, images, dataset_hash)
+    except Exception as e:
+        print(f"Ошибка добавления {directory_name}: {e}")
+        return False
+
+    if config.camera_manager is not None:
+        config.camera_manager.reload_models()
+    print(f"Добавлено {len(images)} изображений для {config.original_names.get(directory_name, directory_name)}, "
+          f"людей в модели: {len(names)}")
+    return True
+
+def remove_person(directory_name):
+    """
+    Удалить образцы человека из текущей модели без переобучения остальных.
+    Человека, которого нет в модели, удалять не нужно - это не ошибка
+    """
+    try:
+        with _swap_lock:
+            snapshot = config.model_snapshot
+            names = snapshot.names if snapshot is not None else {}
+            removed = [label for label, name in names.items() if name == directory_name]
+            if not removed:
+                print(f"{directory_name} нет в модели, удалять нечего")
+                return True
+            if len(removed) == len(snapshot.names):
+                # Удалён последний человек - распознавать больше некого
+                _remove_model_files()
+                publish_snapshot(None)
+                names = {}
+            else:
+                for label in removed:
+                    names = _commit_delta(config.model_snapshot, "remove", label, directory_name)
+    except Exception as e:
+        print(f"Ошибка удаления {directory_name} из модели: {e}")
+        return False
+
+    if config.camera_manager is not None:
+        config.camera_manager.reload_models()
+    print(f"{directory_name} удалён из модели, людей в модели: {len(names)}")
+    return True
+
+def train_model(progress=None):
+    """Обучение модели распознавания лиц; progress(**поля) - см. TrainingJob.report"""
+    images, labels, names = load_training_data(progress)
     if images is not None and labels is not None:
+        # Хеши наборов данных, по которым обучается модель (сводка сверена в load_training_data)
+        dataset = {name: value for name, value in get_dataset_manifest().hashes().items()
+                   if name in names.values()}
         try:
-            if not hasattr(cv2, 'face'):
+            if config.MODEL_BACKEND == "opencv" and not hasattr(cv2, 'face'):
                 print("Ошибка: opencv-contrib-python Не установлен. Установить с помощью: pip install opencv-contrib-python==4.8.1.78")
                 return False
-            
-            config.model = cv2.face.LBPHFaceRecognizer_create()
-            config.model.train(images, labels)
-            
-            # Сохраняем модель после обучения
-            save_model()
-            
+
+            # Новая модель обучается в стороне, текущий снимок обслуживает запросы до подмены
+            if progress is not None:
+                progress(stage="training")
+            model = create_model()
+            model.train(images, labels)
+
+            if progress is not None:
+                progress(stage="saving")
+            # Сохраняем модель после обучения и публикуем снимок;
+            # полная модель включает все операции журнала, он очищается
+            with _swap_lock:
+                state = save_model(model, names, dataset=dataset)
+                if state is None:
+                    return False
+                publish_snapshot(build_snapshot(model, names, state, dataset))
+
+            # Процессы камер загружают модель заново
+            if config.camera_manager is not None:
+                config.camera_manager.reload_models()
+
             print("Модель успешно обучена")
             return True
         except Exception as e:
             print(f"Модель обучения ошибок: {e}")
             return False
     print("Данные по обучению отсутствуют.")
-    return False
\ No newline at end of file
+    return False
+
+class ModelWatcher:
+    """Фоновая проверка файла модели: замена другим процессом обучения подхватывается без перезапуска"""
+
+    def __init__(self, interval=None):
+        self.interval = interval or config.MODEL_WATCH_INTERVAL
+        self.reloads = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="model-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if reload_if_changed():
+                    self.reloads += 1
+            except Exception as e:
+                print(f"Ошибка проверки файла модели: {e}")
+
+_watcher_lock = threading.Lock()
+
+def start_model_watcher():
+    """Общий наблюдатель за файлом модели (запускается один раз)"""
+    with _watcher_lock:
+        if config.model_watcher is None:
+            config.model_watcher = ModelWatcher()
+        config.model_watcher.start()
+        return config.model_watcher
@@ -0,0 +1,143 @@
+import os
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from app import config
+
+
+class OverlayRenderer:
+    """
+    Компоновщик текстовых надписей на кадре.
+
+    Шрифты загружаются один раз, отрисованные строки кешируются как маски
+    (ключ: текст, размер, цвет), все надписи кадра накладываются за один
+    проход без конвертации всего кадра в PIL. Статичные блоки (HUD) хранятся
+    как слои и перерисовываются только при изменении содержимого.
+    Цвета задаются в BGR, как и в cv2.
+    """
+
+    def __init__(self, font_paths=None, cache_size=None):
+        self.font_paths = font_paths or config.FONT_PATHS
+        self.cache_size = cache_size or config.OVERLAY_SPRITE_CACHE_SIZE
+        self._font_path = self._find_font_path()
+        self._fonts = {}
+        self._sprites = OrderedDict()
+        self._layers = {}
+        self._labels = []
+
+    def _find_font_path(self):
+        """Поиск шрифта с поддержкой кириллицы (выполняется один раз)"""
+        for font_path in self.font_paths:
+            if os.path.exists(font_path):
+                try:
+                    ImageFont.truetype(font_path, 12)
+                    return font_path
+                except Exception:
+                    continue
+        return None
+
+    def get_font(self, size):
+        font = self._fonts.get(size)
+        if font is None:
+            try:
+                font = ImageFont.truetype(self._font_path or "arial.ttf", size)
+            except Exception:
+                # Стандартный шрифт может не поддерживать кириллицу
+                font = ImageFont.load_default()
+            self._fonts[size] = font
+        return font
+
+    def _get_sprite(self, text, size, color):
+        """Маска строки и её цвет, из кеша или с отрисовкой через Pillow"""
+        key = (text, size, color)
+        sprite = self._sprites.get(key)
+        if sprite is not None:
+            self._sprites.move_to_end(key)
+            return sprite
+
+        font = self.get_font(size)
+        left, top, right, bottom = font.getbbox(text)
+        width, height = max(right, 1), max(bottom, 1)
+
+        mask_image = Image.new("L", (width, height), 0)
+        ImageDraw.Draw(mask_image).text((0, 0), text, font=font, fill=255)
+        mask = np.asarray(mask_image, dtype=np.uint16)[..., None]
+        sprite = (mask, np.array(color, dtype=np.uint16))
+
+        self._sprites[key] = sprite
+        if len(self._sprites) > self.cache_size:
+            self._sprites.popitem(last=False)
+        return sprite
+
+    def text_size(self, text, size):
+        """Ширина и высота строки в пикселях"""
+        mask, _ = self._get_sprite(text, size, (255, 255, 255))
+        return mask.shape[1], mask.shape[0]
+
+    def add_text(self, text, position, color=(0, 255, 0), size=20):
+        """Поставить надпись в очередь текущего кадра"""
+        self._labels.append((text, position, tuple(color), size))
+
+    def set_layer(self, name, items):
+        """
+        Задать статичный слой: список (text, position, color, size).
+        Если содержимое не изменилось, используется ранее собранный слой
+        """
+        items = tuple((text, tuple(pos), tuple(color), size) for text, pos, color, size in items)
+        layer = self._layers.get(name)
+        if layer is not None and layer[0] == items:
+            return
+        self._layers[name] = (items, self._build_layer(items))
+
+    def clear_layer(self, name):
+        self._layers.pop(name, None)
+
+    def _build_layer(self, items):
+        """Склеить строки слоя в один BGR-патч с маской"""
+        if not items:
+            return None
+        placed = [(self._get_sprite(text, size, color), pos) for text, pos, color, size in items]
+        x0 = min(pos[0] for _, pos in placed)
+        y0 = min(pos[1] for _, pos in placed)
+        x1 = max(pos[0] + sprite[0].shape[1] for sprite, pos in placed)
+        y1 = max(pos[1] + sprite[0].shape[0] for sprite, pos in placed)
+
+        colors = np.zeros((y1 - y0, x1 - x0, 3), dtype=np.uint16)
+        alpha = np.zeros((y1 - y0, x1 - x0, 1), dtype=np.uint16)
+        for (mask, color), (x, y) in placed:
+            h, w = mask.shape[:2]
+            region = (slice(y - y0, y - y0 + h), slice(x - x0, x - x0 + w))
+            stronger = mask > alpha[region]
+            colors[region] = np.where(stronger, color, colors[region])
+            alpha[region] = np.maximum(alpha[region], mask)
+        return (x0, y0), alpha, colors
+
+    @staticmethod
+    def _blend(frame, position, alpha, colors):
+        """Наложить патч на кадр на месте с обрезкой по границам"""
+        x, y = int(position[0]), int(position[1])
+        h, w = alpha.shape[:2]
+        fx0, fy0 = max(x, 0), max(y, 0)
+        fx1, fy1 = min(x + w, frame.shape[1]), min(y + h, frame.shape[0])
+        if fx0 >= fx1 or fy0 >= fy1:
+            return
+
+        a = alpha[fy0 - y:fy1 - y, fx0 - x:fx1 - x]
+        c = colors if colors.ndim == 1 else colors[fy0 - y:fy1 - y, fx0 - x:fx1 - x]
+        roi = frame[fy0:fy1, fx0:fx1]
+        roi[:] = ((c * a + roi.astype(np.uint16) * (255 - a)) // 255).astype(np.uint8)
+
+    def compose(self, frame):
+        """Наложить все слои и надписи из очереди на кадр за один проход"""
+        for items, layer in self._layers.values():
+            if layer is not None:
+                position, alpha, colors = layer
+                self._blend(frame, position, alpha, colors)
+
+        for text, position, color, size in self._labels:
+            mask, sprite_color = self._get_sprite(text, size, color)
+            self._blend(frame, position, mask, sprite_color)
+        self._labels = []
+        return frame
@@ -0,0 +1,71 @@
+import threading
+
+import cv2
+
+from app import config
+from app.utils.metrics import stage_timer
+
+# CLAHE-объекты держат внутренние буферы, поэтому у каждого потока свои,
+# но создаются они один раз на поток, а не на каждый кадр или лицо
+_local = threading.local()
+
+
+def get_clahe(clip_limit=2.0, tile_grid_size=(8, 8)):
+    cache = getattr(_local, "clahe", None)
+    if cache is None:
+        cache = _local.clahe = {}
+    key = (float(clip_limit), tuple(tile_grid_size))
+    clahe = cache.get(key)
+    if clahe is None:
+        clahe = cache[key] = cv2.createCLAHE(clipLimit=key[0], tileGridSize=key[1])
+    return clahe
+
+
+def to_gray(image):
+    if len(image.shape) == 3:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return image
+
+
+def enhance(gray):
+    """CLAHE и медианный фильтр для уменьшения шума"""
+    params = config.preprocessing_params
+    enhanced = get_clahe(params["claheClipLimit"], params["claheTileGrid"]).apply(gray)
+    return cv2.medianBlur(enhanced, params["medianBlur"])
+
+
+class FrameContext:
+    """
+    Предобработка одного кадра, общая для обнаружения, проверки глаз и
+    распознавания: серое и улучшенное изображения считаются один раз при
+    первом обращении, кропы лиц берутся из уже посчитанных изображений
+    """
+
+    def __init__(self, frame):
+        self.frame = frame
+        self._gray = None
+        self._enhanced = None
+
+    @property
+    def gray(self):
+        if self._gray is None:
+            with stage_timer("grayscale"):
+                self._gray = to_gray(self.frame)
+        return self._gray
+
+    @property
+    def enhanced(self):
+        if self._enhanced is None:
+            gray = self.gray
+            with stage_timer("enhance"):
+                self._enhanced = enhance(gray)
+        return self._enhanced
+
+    def face(self, rect, enhanced=False, size=None):
+        """Кроп лица (x, y, w, h) из серого или улучшенного кадра, при size - с изменением размера"""
+        x, y, w, h = rect
+        source = self.enhanced if enhanced else self.gray
+        roi = source[y:y + h, x:x + w]
+        if size is not None:
+            roi = cv2.resize(roi, size)
+        return roi
@@ -0,0 +1,146 @@
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from app import config
+from app.utils.metrics import stage_timer
+
+StreamTier = namedtuple("StreamTier", ["width", "quality"])
+
+
+def frame_signature(frame):
+    """Дешёвая контрольная сумма кадра по прореженной сетке пикселей"""
+    return zlib.crc32(np.ascontiguousarray(frame[::8, ::8]))
+
+
+class TierEncoder:
+    """JPEG-кодировщик одного уровня качества, общий для всех его клиентов"""
+
+    def __init__(self, tier):
+        self.tier = tier
+        self._lock = threading.Lock()
+        self._seq = None
+        self._signature = None
+        self._jpeg = None
+        self.encoded = 0
+        self.reused = 0
+
+    def encode(self, seq, frame, signature):
+        with self._lock:
+            if seq == self._seq:
+                return self._jpeg
+            if signature == self._signature and self._jpeg is not None:
+                # Аннотированный кадр не изменился - повторно не кодируем
+                self._seq = seq
+                self.reused += 1
+                return self._jpeg
+
+            image = frame
+            if self.tier.width and self.tier.width < frame.shape[1]:
+                height = int(round(frame.shape[0] * self.tier.width / frame.shape[1]))
+                image = cv2.resize(frame, (self.tier.width, height), interpolation=cv2.INTER_AREA)
+
+            with stage_timer("jpeg_encode"):
+                ret, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, self.tier.quality])
+            if not ret:
+                return None
+            self._seq, self._signature, self._jpeg = seq, signature, buffer.tobytes()
+            self.encoded += 1
+            return self._jpeg
+
+
+class EncoderPool:
+    """Кодировщики по уровням: кадр кодируется один раз на уровень, а не на клиента"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._encoders = {}
+
+    def get_jpeg(self, tier, seq, frame, signature):
+        with self._lock:
+            encoder = self._encoders.get(tier)
+            if encoder is None:
+                encoder = self._encoders[tier] = TierEncoder(tier)
+        return encoder.encode(seq, frame, signature)
+
+    def stats(self):
+        with self._lock:
+            encoders = list(self._encoders.values())
+        return [{
+            "width": e.tier.width,
+            "quality": e.tier.quality,
+            "encoded": e.encoded,
+            "reused": e.reused
+        } for e in encoders]
+
+
+def _quantize_down(value, levels):
+    """Ближайший уровень не выше value (или минимальный)"""
+    candidates = [level for level in levels if level <= value]
+    return max(candidates) if candidates else min(levels)
+
+
+class ClientStream:
+    """
+    Адаптивное состояние одного клиента /video_feed.
+    По времени отправки кадра оценивается скорость опустошения буфера клиента:
+    если он не успевает, понижается качество, затем разрешение; при запасе -
+    постепенно возвращается к запрошенному уровню
+    """
+
+    def __init__(self, max_fps=None, width=None, quality=None):
+        self.max_fps = min(max(float(max_fps or config.STREAM_MAX_FPS), 1.0), config.STREAM_MAX_FPS)
+        qualities = sorted(config.STREAM_QUALITY_LEVELS, reverse=True)
+        widths = sorted(config.STREAM_WIDTHS, reverse=True)
+
+        top_quality = _quantize_down(int(quality), qualities) if quality else qualities[0]
+        top_width = _quantize_down(int(width), widths) if width else None
+
+        # Лестница уровней: сначала снижаем качество, потом разрешение
+        self.ladder = [StreamTier(top_width, q) for q in qualities if q <= top_quality]
+        lowest = self.ladder[-1].quality
+        self.ladder += [StreamTier(w, lowest) for w in widths if top_width is None or w < top_width]
+
+        self.level = 0
+        self._send_time = None
+        self._last_change = time.monotonic()
+        self._last_frame_start = 0.0
+        self.drain_rate = None  # байт/с
+        self.frames_sent = 0
+
+    def wait_for_slot(self):
+        """Ограничение частоты кадров клиента: промежуточные кадры пропускаются"""
+        delay = self._last_frame_start + 1.0 / self.max_fps - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self._last_frame_start = time.monotonic()
+
+    def current_tier(self, source_width):
+        tier = self.ladder[self.level]
+        if tier.width and tier.width >= source_width:
+            tier = StreamTier(None, tier.quality)
+        return tier
+
+    def on_sent(self, size, duration):
+        """Учесть отправку кадра размером size байт, занявшую duration секунд"""
+        self.frames_sent += 1
+        duration = max(duration, 1e-4)
+        self._send_time = duration if self._send_time is None else 0.7 * self._send_time + 0.3 * duration
+        rate = size / duration
+        self.drain_rate = rate if self.drain_rate is None else 0.7 * self.drain_rate + 0.3 * rate
+
+        now = time.monotonic()
+        budget = 1.0 / self.max_fps
+        since_change = now - self._last_change
+        if self._send_time > budget and since_change > config.STREAM_ADAPT_COOLDOWN:
+            if self.level < len(self.ladder) - 1:
+                self.level += 1
+                self._last_change = now
+        elif self._send_time < budget * 0.25 and since_change > config.STREAM_ADAPT_COOLDOWN * 3:
+            if self.level > 0:
+                self.level -= 1
+                self._last_change = now
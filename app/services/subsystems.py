@@ -0,0 +1,106 @@
+import threading
+import time
+from collections import OrderedDict
+
+from app import config
+
+
+class Subsystem:
+    """
+    Тяжёлый ресурс (каскады, модель, Serial, камеры), который загружается
+    один раз: в фоне при запуске или при первом обращении. Обратившиеся во
+    время загрузки дожидаются её, а не запускают вторую
+    """
+
+    def __init__(self, name, loader, required=True):
+        self.name = name
+        self.required = required  # без неё система не готова (/readyz)
+        self.state = "pending"    # pending -> loading -> ready / failed
+        self.message = ""
+        self.started_at = None
+        self.finished_at = None
+        self._loader = loader
+        self._condition = threading.Condition()
+
+    def ensure(self, timeout=None):
+        """Загрузить, если загрузка ещё не начиналась, иначе дождаться её. True, если готова"""
+        with self._condition:
+            if self.state != "pending":
+                self._condition.wait_for(lambda: self.state in ("ready", "failed"), timeout=timeout)
+                return self.state == "ready"
+            self.state, self.started_at = "loading", time.time()
+
+        try:
+            success = bool(self._loader())
+            message = "" if success else "не удалось загрузить, подробности в журнале"
+        except Exception as e:
+            success, message = False, str(e)
+
+        with self._condition:
+            self.state = "ready" if success else "failed"
+            self.message = message
+            self.finished_at = time.time()
+            self._condition.notify_all()
+        print(f"Подсистема {self.name}: {self.state} за {self.finished_at - self.started_at:.2f} с")
+        return success
+
+    def start(self):
+        """Загрузить в фоновом потоке"""
+        threading.Thread(target=self.ensure, name=f"init-{self.name}", daemon=True).start()
+
+    def status(self):
+        with self._condition:
+            finished = self.finished_at or (time.time() if self.started_at else None)
+            return {
+                "state": self.state,
+                "required": self.required,
+                "message": self.message,
+                "seconds": round(finished - self.started_at, 3) if self.started_at else None,
+            }
+
+
+class SubsystemRegistry:
+    """Подсистемы в порядке регистрации"""
+
+    def __init__(self):
+        self._subsystems = OrderedDict()
+
+    def register(self, name, loader, required=True):
+        self._subsystems[name] = Subsystem(name, loader, required)
+        return self._subsystems[name]
+
+    def get(self, name):
+        return self._subsystems.get(name)
+
+    def ensure(self, *names, timeout=None):
+        """Загрузить (или дождаться) подсистемы names. True, если все готовы"""
+        return all([self._subsystems[name].ensure(timeout) for name in names])
+
+    def load_all(self):
+        """Загрузить все подсистемы по очереди в вызывающем потоке"""
+        for subsystem in self._subsystems.values():
+            subsystem.ensure()
+
+    def start_all(self):
+        """Загрузить все подсистемы в фоне, каждую в своём потоке"""
+        for subsystem in self._subsystems.values():
+            subsystem.start()
+
+    def ready(self):
+        return all(s.state == "ready" for s in self._subsystems.values() if s.required)
+
+    def status(self):
+        return {name: subsystem.status() for name, subsystem in self._subsystems.items()}
+
+
+_registry_lock = threading.Lock()
+
+
+def get_subsystems():
+    """Общий реестр подсистем (загрузчики - в app.services.init_system)"""
+    from app.services.init_system import register_subsystems
+
+    with _registry_lock:
+        if config.subsystems is None:
+            config.subsystems = register_subsystems(SubsystemRegistry())
+        return config.subsystems
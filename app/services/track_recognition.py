@@ -0,0 +1,79 @@
+from collections import Counter, deque
+
+import cv2
+import numpy as np
+
+from app import config
+from app.utils.metrics import stage_timer, LBPH_PREDICTIONS_TOTAL
+
+
+class TrackIdentity:
+    """Кеш распознавания одного трека: последние предсказания для голосования"""
+
+    def __init__(self, model):
+        self.model = model
+        self.predictions = deque(maxlen=config.track_recognition_params["vote_window"])
+        self.thumbnail = None
+        self.last_predict_frame = None
+
+
+class TrackRecognizer:
+    """
+    Распознавание лиц по трекам: LBPH predict вызывается только для новых
+    треков, периодически или при заметном изменении кадрированного лица,
+    а отображаемое имя выбирается голосованием по последним K предсказаниям
+    """
+
+    THUMBNAIL_SIZE = (26, 32)
+
+    def __init__(self):
+        self.predict_calls = 0
+        self.cache_hits = 0
+
+    def _thumbnail(self, face_resize):
+        return cv2.resize(face_resize, self.THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    def _needs_predict(self, identity, thumbnail, frame_count):
+        params = config.track_recognition_params
+        if not identity.predictions or identity.thumbnail is None:
+            return True
+        if frame_count - identity.last_predict_frame >= params["reverify_interval"]:
+            return True
+        change = float(np.mean(np.abs(thumbnail - identity.thumbnail)))
+        return change > params["crop_change_threshold"]
+
+    def recognize(self, track, face_resize, frame_count, model):
+        """
+        Вернуть (label, confidence) по голосованию для трека.
+        confidence - медиана уверенностей победившей метки.
+        model - модель снимка, взятого на этот кадр; при смене модели кеш трека сбрасывается
+        """
+        if track.identity is None or track.identity.model is not model:
+            track.identity = TrackIdentity(model)
+        identity = track.identity
+
+        thumbnail = self._thumbnail(face_resize)
+        if self._needs_predict(identity, thumbnail, frame_count):
+            with stage_timer("lbph_predict"):
+                label, confidence = model.predict(face_resize)
+            LBPH_PREDICTIONS_TOTAL.inc()
+            identity.predictions.append((label, confidence))
+            identity.thumbnail = thumbnail
+            identity.last_predict_frame = frame_count
+            self.predict_calls += 1
+        else:
+            self.cache_hits += 1
+
+        votes = Counter(label for label, _ in identity.predictions)
+        label, _ = votes.most_common(1)[0]
+        confidence = float(np.median([c for l, c in identity.predictions if l == label]))
+        return label, confidence
+
+    @staticmethod
+    def is_settled(track):
+        """Достаточно ли голосов, чтобы учитывать решение в статистике"""
+        identity = track.identity
+        if identity is None:
+            return False
+        return len(identity.predictions) >= min(config.track_recognition_params["min_votes"],
+                                                identity.predictions.maxlen)
@@ -0,0 +1,189 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from app import config
+
+
+class TrainingJob:
+    """
+    Задание обучения: полное переобучение или список операций добавления/удаления
+    людей. Пока задание ждёт в очереди, новые запросы сливаются в него
+    """
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:12]
+        self.status = "queued"   # queued -> running -> done / failed
+        self.operations = []     # [("train", None)] или [("enroll" | "remove", каталог), ...]
+        self.requests = 0        # сколько запросов слито в задание
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.success = None
+        self.message = ""
+        self.progress = {}
+        self.seconds_per_image = None  # по прошлому полному обучению, для оценки ETA
+        self._lock = threading.Lock()
+
+    def add(self, operation, name=None):
+        """
+        Слить запрос в задание: полное обучение поглощает любые операции, для
+        каждого человека остаётся только последняя операция (добавить, удалить,
+        снова добавить - человек добавляется)
+        """
+        with self._lock:
+            self.requests += 1
+            if operation == "train" or self.operations == [("train", None)]:
+                self.operations = [("train", None)]
+            else:
+                self.operations = [(op, other) for op, other in self.operations if other != name]
+                self.operations.append((operation, name))
+
+    def report(self, **fields):
+        """Обновить прогресс: stage, people_done/people_total, images_loaded/images_total"""
+        with self._lock:
+            self.progress.update(fields)
+
+    def _eta(self):
+        """Оценка оставшегося времени по прошлому полному обучению или по скорости загрузки"""
+        if self.status != "running":
+            return None
+        progress = self.progress
+        elapsed = time.time() - self.started_at
+        total, loaded = progress.get("images_total"), progress.get("images_loaded")
+        if self.seconds_per_image and total:
+            return max(0.0, self.seconds_per_image * total - elapsed)
+        if progress.get("stage") == "loading" and loaded and total:
+            return elapsed / loaded * (total - loaded)
+        done, people = progress.get("people_done"), progress.get("people_total")
+        if progress.get("stage") == "updating" and done and people:
+            return elapsed / done * (people - done)
+        return None
+
+    def to_dict(self):
+        with self._lock:
+            eta = self._eta()
+            return {
+                "id": self.id,
+                "status": self.status,
+                "operations": [{"operation": op, "name": name} for op, name in self.operations],
+                "requests": self.requests,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "success": self.success,
+                "message": self.message,
+                "progress": dict(self.progress),
+                "eta_seconds": None if eta is None else round(eta, 1),
+            }
+
+
+class TrainingQueue:
+    """
+    Фоновое обучение в одном потоке. Задания выполняются по одному, запросы,
+    пришедшие пока задание ждёт, сливаются в него. Распознавание всё это время
+    работает на прежнем снимке модели, новый публикуется по готовности
+    """
+
+    def __init__(self, history=None):
+        self._condition = threading.Condition()
+        self._thread = None
+        self._jobs = OrderedDict()
+        self._history = history or config.TRAINING_JOB_HISTORY
+        self.pending = None
+        self.current = None
+        self.seconds_per_image = None
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="training-queue", daemon=True)
+            self._thread.start()
+
+    def submit(self, operation, name=None):
+        """Поставить операцию в очередь (или слить с ожидающим заданием) и вернуть задание"""
+        with self._condition:
+            job = self.pending
+            if job is None:
+                job = self.pending = TrainingJob()
+                self._jobs[job.id] = job
+                while len(self._jobs) > self._history:
+                    self._jobs.popitem(last=False)
+            job.add(operation, name)
+            self._condition.notify_all()
+        self._ensure_thread()
+        return job
+
+    def get(self, job_id):
+        with self._condition:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._condition:
+            return list(self._jobs.values())
+
+    def wait(self, job, timeout=None):
+        """Дождаться завершения задания, False по таймауту"""
+        with self._condition:
+            return self._condition.wait_for(lambda: job.status in ("done", "failed"), timeout=timeout)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self.pending is not None)
+                job, self.pending = self.pending, None
+                self.current = job
+                job.status, job.started_at = "running", time.time()
+                job.seconds_per_image = self.seconds_per_image
+
+            try:
+                job.success, job.message = self._execute(job)
+            except Exception as e:
+                job.success, job.message = False, f"Ошибка обучения: {e}"
+
+            with self._condition:
+                job.status = "done" if job.success else "failed"
+                job.finished_at = time.time()
+                images = job.progress.get("images_total")
+                if job.success and job.operations == [("train", None)] and images:
+                    self.seconds_per_image = (job.finished_at - job.started_at) / images
+                self.current = None
+                self._condition.notify_all()
+            print(f"Задание обучения {job.id}: {job.message}")
+
+    def _execute(self, job):
+        from app.services.models import train_model, enroll_person, remove_person
+
+        if job.operations == [("train", None)]:
+            if train_model(progress=job.report):
+                return True, "Модель успешно обучена"
+            return False, "Ошибка обучения модели"
+
+        failed = []
+        job.report(stage="updating", people_done=0, people_total=len(job.operations))
+        for done, (operation, name) in enumerate(job.operations, 1):
+            action = enroll_person if operation == "enroll" else remove_person
+            if not action(name):
+                failed.append(name)
+            job.report(people_done=done)
+        if failed:
+            return False, f"Не удалось обновить модель для: {', '.join(failed)}"
+        return True, "Модель обновлена"
+
+    def status(self):
+        with self._condition:
+            return {
+                "current": self.current.to_dict() if self.current else None,
+                "pending": self.pending.to_dict() if self.pending else None,
+            }
+
+
+_queue_lock = threading.Lock()
+
+
+def get_training_queue():
+    """Общая очередь фонового обучения"""
+    with _queue_lock:
+        if config.training_queue is None:
+            config.training_queue = TrainingQueue()
+        return config.training_queue
@@ -0,0 +1,215 @@
+"""
+Пакетное распознавание лиц в видеофайлах без камеры и веб-интерфейса.
+
+    python -m app.services.video_batch data/videos/door.mp4 -o results.jsonl
+    python -m app.services.video_batch data/videos/ -o day.jsonl --skip 2 --workers 4 --annotated out/
+
+Кадры декодируются в отдельном потоке, обнаружение и распознавание идут
+в пуле процессов (модель загружается один раз на процесс), результаты
+пишутся построчно в JSON Lines в порядке кадров.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+
+from app import config
+from app.services.lbph import predict_batch
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv', '.mov', '.m4v', '.webm')
+
+
+def _init_worker():
+    """Инициализация процесса пула: каскады и модель загружаются один раз"""
+    from app.services.inference import init_headless
+
+    # Параллелизм даёт пул процессов, внутренние потоки OpenCV только мешают
+    cv2.setNumThreads(1)
+    init_headless()
+
+
+def recognize_gray_frame(gray):
+    """Обнаружение и распознавание лиц на сером кадре, как в видео потоке"""
+    from app.services.frame_generator import detect_faces
+
+    detections = detect_faces(gray)
+    predictions = [(None, None)] * len(detections)
+    snapshot = config.model_snapshot
+    if snapshot is not None and detections:
+        # Все лица кадра распознаются одним пакетом
+        crops = [cv2.resize(gray[y:y+h, x:x+w], config.IMAGE_SIZE) for (x, y, w, h), _ in detections]
+        predictions = predict_batch(snapshot.model, crops)
+
+    faces = []
+    for ((x, y, w, h), eyes_detected), (label, confidence) in zip(detections, predictions):
+        name, recognized = None, False
+        if confidence is not None:
+            confidence = float(confidence)
+            if confidence < snapshot.confidence_threshold:
+                name, recognized = snapshot.names.get(label, "Неизвестный"), True
+        faces.append({
+            'bbox': [x, y, w, h],
+            'name': name,
+            'confidence': confidence,
+            'recognized': recognized,
+            'eyes_detected': eyes_detected
+        })
+    return faces
+
+
+def _process_frame_task(task):
+    frame_index, timestamp, gray = task
+    return frame_index, timestamp, recognize_gray_frame(gray)
+
+
+def _read_frames(path, skip, frames_queue, keep_color):
+    """Поток чтения: декодирует кадры, пропуская skip кадров между обрабатываемыми"""
+    capture = cv2.VideoCapture(path)
+    frame_index = -1
+    try:
+        while True:
+            if not capture.grab():
+                break
+            frame_index += 1
+            if frame_index % (skip + 1):
+                continue
+            success, frame = capture.retrieve()
+            if not success:
+                continue
+            timestamp = capture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            frames_queue.put((frame_index, timestamp, gray, frame if keep_color else None))
+    finally:
+        capture.release()
+        frames_queue.put(None)
+
+
+def _annotate(frame, faces):
+    for face in faces:
+        x, y, w, h = face['bbox']
+        color = (0, 255, 0) if face['recognized'] else (0, 0, 255)
+        cv2.rectangle(frame, (x, y), (x+w, y+h), color, 2)
+        # Имена в наборе данных транслитерированы, поэтому достаточно putText
+        label = face['name'] or "Unknown"
+        if face['confidence'] is not None:
+            label += f" ({face['confidence']:.0f})"
+        cv2.putText(frame, label, (x, max(y - 10, 10)), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+    return frame
+
+
+def process_video(path, output, executor, workers, skip=0, annotated_path=None):
+    """Обработать один видеофайл, возвращает (число обработанных кадров, секунды)"""
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        print(f"Не удалось открыть видео: {path}")
+        return 0, 0.0
+    fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+    capture.release()
+
+    frames_queue = queue.Queue(maxsize=workers * 4)
+    reader = threading.Thread(target=_read_frames, args=(path, skip, frames_queue, annotated_path is not None),
+                              name="video-reader", daemon=True)
+    reader.start()
+
+    writer = None
+    in_flight = deque()
+    processed = 0
+    started = time.perf_counter()
+    video_name = os.path.basename(path)
+
+    def flush_one():
+        nonlocal writer, processed
+        future, color_frame = in_flight.popleft()
+        frame_index, timestamp, faces = future.result()
+        output.write(json.dumps({
+            'video': video_name,
+            'frame': frame_index,
+            'timestamp': round(timestamp, 3),
+            'faces': faces
+        }, ensure_ascii=False) + "\n")
+
+        if color_frame is not None:
+            if writer is None:
+                height, width = color_frame.shape[:2]
+                writer = cv2.VideoWriter(annotated_path, cv2.VideoWriter_fourcc(*'MJPG'),
+                                         fps / (skip + 1), (width, height))
+            writer.write(_annotate(color_frame, faces))
+
+        processed += 1
+        if processed % 500 == 0:
+            elapsed = time.perf_counter() - started
+            print(f"{video_name}: {processed} кадров, {processed / elapsed:.1f} кадр/с")
+
+    while True:
+        item = frames_queue.get()
+        if item is None:
+            break
+        frame_index, timestamp, gray, color_frame = item
+        in_flight.append((executor.submit(_process_frame_task, (frame_index, timestamp, gray)), color_frame))
+        # Ограниченное окно задач: память не растёт на длинных видео, порядок сохраняется
+        while len(in_flight) >= workers * 2:
+            flush_one()
+
+    while in_flight:
+        flush_one()
+
+    if writer is not None:
+        writer.release()
+    return processed, time.perf_counter() - started
+
+
+def collect_videos(path):
+    if os.path.isdir(path):
+        return sorted(os.path.join(path, f) for f in os.listdir(path)
+                      if f.lower().endswith(VIDEO_EXTENSIONS))
+    return [path]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетное распознавание лиц в видеофайлах")
+    parser.add_argument("input", help="видеофайл или каталог с видео")
+    parser.add_argument("-o", "--output", default="results.jsonl", help="файл результатов JSON Lines")
+    parser.add_argument("--annotated", help="видео с разметкой (для каталога - каталог вывода)")
+    parser.add_argument("--skip", type=int, default=0, help="сколько кадров пропускать между обрабатываемыми")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="число процессов")
+    args = parser.parse_args(argv)
+
+    videos = collect_videos(args.input)
+    if not videos:
+        print("Видео не найдены")
+        return 1
+
+    total_frames, total_time = 0, 0.0
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=context,
+                             initializer=_init_worker) as executor, \
+            open(args.output, 'w', encoding='utf-8') as output:
+        for video in videos:
+            annotated_path = args.annotated
+            if annotated_path and len(videos) > 1:
+                os.makedirs(annotated_path, exist_ok=True)
+                name = os.path.splitext(os.path.basename(video))[0]
+                annotated_path = os.path.join(annotated_path, f"{name}_annotated.avi")
+
+            frames, seconds = process_video(video, output, executor, args.workers,
+                                            skip=max(0, args.skip), annotated_path=annotated_path)
+            total_frames += frames
+            total_time += seconds
+            if seconds > 0:
+                print(f"{os.path.basename(video)}: {frames} кадров за {seconds:.1f} с ({frames / seconds:.1f} кадр/с)")
+
+    if total_time > 0:
+        print(f"Итого: {total_frames} кадров за {total_time:.1f} с ({total_frames / total_time:.1f} кадр/с)")
+    print(f"Результаты записаны в {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
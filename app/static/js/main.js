@@ -154,6 +154,32 @@ const API = {
     return this.post("/train_model")
   },
 
+  // Добавить одного человека в модель без полного переобучения
+  enrollPerson: function (personName) {
+    return this.post("/enroll_person", { name: personName })
+  },
+
+  // Состояние задания обучения
+  getTrainingJob: function (jobId) {
+    return this.get(`/api/train_jobs/${jobId}`)
+  },
+
+  // Опрашивать задание getJob(jobId) до завершения, onProgress получает задание при каждом опросе
+  waitForJob: async function (getJob, jobId, onProgress = null, interval = 1000) {
+    while (true) {
+      const data = await getJob.call(this, jobId)
+      if (!data.success) throw new Error(data.message)
+      if (onProgress) onProgress(data.job)
+      if (data.job.status === "done" || data.job.status === "failed") return data.job
+      await new Promise((resolve) => setTimeout(resolve, interval))
+    }
+  },
+
+  // Дождаться завершения задания обучения
+  waitForTrainingJob: function (jobId, onProgress = null, interval = 1000) {
+    return this.waitForJob(this.getTrainingJob, jobId, onProgress, interval)
+  },
+
   // Получить информацию о модели
   getModelInfo: function () {
     return this.get("/api/model_info")
@@ -171,9 +197,19 @@ const API = {
     return this.post("/api/update_threshold", { threshold })
   },
 
-  // Тест точности
-  testAccuracy: function (testImagesPerPerson = 5) {
-    return this.post("/api/test_accuracy", { test_images_per_person: testImagesPerPerson })
+  // Тест точности: k-fold оценка в фоне, ответ содержит задание job
+  testAccuracy: function (folds = 5) {
+    return this.post("/api/test_accuracy", { folds })
+  },
+
+  // Состояние и результат оценки точности
+  getEvaluationJob: function (jobId) {
+    return this.get(`/api/test_accuracy/${jobId}`)
+  },
+
+  // Дождаться результата оценки точности
+  waitForEvaluationJob: function (jobId, onProgress = null, interval = 1000) {
+    return this.waitForJob(this.getEvaluationJob, jobId, onProgress, interval)
   },
 }
 
@@ -0,0 +1,197 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+from app import config
+
+# Границы корзин гистограмм в секундах
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _format_labels(labelnames, labels, extra=None):
+    pairs = list(zip(labelnames, labels))
+    if extra:
+        pairs += list(extra.items())
+    if not pairs:
+        return ""
+    escaped = ",".join(
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in pairs
+    )
+    return "{" + escaped + "}"
+
+
+class Histogram:
+    """Потокобезопасная гистограмма: одна блокировка и bisect на наблюдение"""
+
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: [list(s[0]), s[1], s[2]] for labels, s in self._series.items()}
+
+    def render(self, snapshot, extra=None):
+        lines = []
+        for labels, (counts, total, count) in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket"
+                             f"{_format_labels(self.labelnames + ('le',), labels + (le,), extra)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels, extra)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels, extra)} {count}")
+        return lines
+
+
+class Counter:
+    """Потокобезопасный счётчик"""
+
+    type_name = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def inc(self, value=1, *labels):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._series)
+
+    def render(self, snapshot, extra=None):
+        return [f"{self.name}{_format_labels(self.labelnames, labels, extra)} {value}"
+                for labels, value in sorted(snapshot.items())]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def snapshot(self):
+        """Снимок значений для передачи из процесса камеры в главный процесс"""
+        return {metric.name: metric.snapshot() for metric in self.metrics}
+
+    def render(self, remote_snapshots=None):
+        """Текстовый формат Prometheus; remote_snapshots - {camera_id: snapshot}"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines += metric.render(metric.snapshot())
+            for camera_id, snapshot in (remote_snapshots or {}).items():
+                if metric.name in snapshot:
+                    lines += metric.render(snapshot[metric.name], extra={"camera": camera_id})
+        return lines
+
+
+REGISTRY = Registry()
+
+FRAME_STAGE_SECONDS = REGISTRY.register(Histogram(
+    "faceid_frame_stage_seconds",
+    "Время этапов обработки кадра видео потока",
+    labelnames=("stage",)
+))
+FRAME_LATENCY_SECONDS = REGISTRY.register(Histogram(
+    "faceid_frame_latency_seconds",
+    "Время от захвата кадра до публикации подписчикам"
+))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "faceid_request_seconds",
+    "Время обработки HTTP запросов API распознавания",
+    labelnames=("endpoint",)
+))
+FRAMES_TOTAL = REGISTRY.register(Counter(
+    "faceid_frames_total",
+    "Кадры по результату: processed - обработан, dropped - заменён более свежим",
+    labelnames=("result",)
+))
+LBPH_PREDICTIONS_TOTAL = REGISTRY.register(Counter(
+    "faceid_lbph_predictions_total",
+    "Вызовы predict модели распознавания"
+))
+
+
+def stage_timer(stage):
+    """Замер этапа обработки кадра: with stage_timer("detection"): ..."""
+    return FRAME_STAGE_SECONDS.time(stage)
+
+
+# Статистика распознавания (config.recognition_stats) изменяется только под блокировкой
+_stats_lock = threading.Lock()
+
+
+def increment_stat(key, value=1):
+    with _stats_lock:
+        config.recognition_stats[key] += value
+
+
+def set_stat(key, value):
+    with _stats_lock:
+        config.recognition_stats[key] = value
+
+
+def reset_stats():
+    with _stats_lock:
+        config.recognition_stats = {
+            'total_faces_detected': 0,
+            'known_faces': 0,
+            'unknown_faces': 0,
+            'last_recognized': None
+        }
+
+
+def stats_snapshot():
+    with _stats_lock:
+        return dict(config.recognition_stats)
+
+
+def render_recognition_stats():
+    stats = stats_snapshot()
+    lines = []
+    for key in ('total_faces_detected', 'known_faces', 'unknown_faces'):
+        name = f"faceid_{key}"
+        lines.append(f"# HELP {name} Счётчик recognition_stats['{key}'] (люди, а не кадры)")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {stats[key]}")
+    return lines
+
+
+def render_all(remote_snapshots=None):
+    return "\n".join(REGISTRY.render(remote_snapshots) + render_recognition_stats()) + "\n"
@@ -0,0 +1,166 @@
+import cProfile
+import functools
+import io
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+from app import config
+
+TARGETS = ("frames", "requests")
+
+
+class ProfilerSession:
+    """
+    Профилирование следующих N кадров видео потока или N запросов распознавания.
+    Сессия сама выключается после N замеров или по таймауту - таймер срабатывает
+    и без кадров и запросов
+    """
+
+    def __init__(self, target, count, with_tracemalloc=False, top=40):
+        self.target = target
+        self.count = count
+        self.remaining = count
+        self.top = top
+        self.with_tracemalloc = with_tracemalloc
+        self.started_at = time.time()
+        self.profile = cProfile.Profile()
+        # cProfile профилирует один поток, поэтому одновременно замеряется один кадр/запрос
+        self._busy = threading.Lock()
+        self._snapshot = None
+        self._started_tracemalloc = False
+        self._timer = None
+
+        if with_tracemalloc:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracemalloc = True
+            self._snapshot = tracemalloc.take_snapshot()
+
+    def expired(self):
+        return time.time() - self.started_at > config.PROFILER_MAX_SECONDS
+
+    def report(self):
+        stream = io.StringIO()
+        measured = self.count - self.remaining
+        stream.write(f"Профиль: {self.target}, замеров: {measured}, "
+                     f"начало: {datetime.fromtimestamp(self.started_at).isoformat()}\n\n")
+        try:
+            pstats.Stats(self.profile, stream=stream).sort_stats("cumulative").print_stats(self.top)
+        except TypeError:
+            stream.write("Нет данных профиля\n")
+
+        if self._snapshot is not None:
+            stream.write("\nРост памяти (tracemalloc):\n")
+            diff = tracemalloc.take_snapshot().compare_to(self._snapshot, "lineno")
+            for stat in diff[:self.top]:
+                stream.write(f"{stat}\n")
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+        return stream.getvalue()
+
+
+_lock = threading.Lock()
+_session = None
+last_report = None
+last_report_file = None
+
+
+def start(target, count, with_tracemalloc=False):
+    """Включить профилирование, False если уже идёт другая сессия"""
+    global _session
+    if target not in TARGETS:
+        raise ValueError(f"target должен быть одним из {TARGETS}")
+    count = min(max(int(count), 1), config.PROFILER_MAX_COUNT)
+    current = _session
+    if current is not None:
+        if not current.expired():
+            return False
+        # Просроченная сессия завершается как обычно: tracemalloc выключается, отчёт сохраняется
+        _finish(current)
+    with _lock:
+        if _session is not None:
+            return False
+        session = _session = ProfilerSession(target, count, with_tracemalloc)
+        session._timer = threading.Timer(config.PROFILER_MAX_SECONDS, _finish, args=(session,))
+        session._timer.daemon = True
+        session._timer.start()
+    return True
+
+
+def _finish(session):
+    """Выключить сессию, сохранить отчёт в logs/profiles"""
+    global _session, last_report, last_report_file
+    with _lock:
+        if _session is not session:
+            return
+        _session = None
+    if session._timer is not None:
+        session._timer.cancel()
+    # Отчёт - после замера, который может идти в другом потоке
+    with session._busy:
+        last_report = session.report()
+    try:
+        profiles_dir = config.LOGS_DIR / 'profiles'
+        os.makedirs(profiles_dir, exist_ok=True)
+        filename = profiles_dir / f"{session.target}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write(last_report)
+        last_report_file = str(filename)
+        print(f"Отчёт профилировщика сохранён: {filename}")
+    except Exception as e:
+        print(f"Ошибка сохранения отчёта профилировщика: {e}")
+
+
+@contextmanager
+def profile_scope(target):
+    """Замер одного кадра или запроса, если для target включена сессия"""
+    session = _session
+    if session is None or session.target != target:
+        yield
+        return
+    if session.expired():
+        _finish(session)
+        yield
+        return
+    if not session._busy.acquire(blocking=False):
+        yield
+        return
+
+    try:
+        session.profile.enable()
+        try:
+            yield
+        finally:
+            session.profile.disable()
+        session.remaining -= 1
+    finally:
+        session._busy.release()
+
+    if session.remaining <= 0:
+        _finish(session)
+
+
+def profiled(target):
+    """Декоратор: замер вызова функции внутри profile_scope(target)"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with profile_scope(target):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def status():
+    session = _session
+    return {
+        "active": session is not None,
+        "target": session.target if session else None,
+        "remaining": session.remaining if session else 0,
+        "last_report_file": last_report_file,
+    }